@@ -0,0 +1,247 @@
+#!/usr/bin/env python3
+"""
+changefeed.py
+
+Journal des changements (change feed) écrit par conv.py, mess.py et users.py,
+pour que les traitements en aval ne relisent que ce qui a changé.
+
+Stockage: `/conversations/changes.sqlite`
+- `changes` : une ligne par enregistrement ajouté ou modifié, avec un numéro de
+  séquence strictement croissant (jamais réutilisé, même après purge):
+  - `record_type` : `conversation` (id = session_id), `message`
+    (id = `session_id:fingerprint`) ou `profile` (id = email en minuscules)
+  - `op` : `insert` ou `update`
+  - `ts` : date du changement (secondes epoch)
+  - `location` : fichier contenant l'enregistrement
+- `offsets` : dernière séquence traitée par chaque consommateur
+
+Lecture depuis un offset sauvegardé:
+
+    feed = ChangeFeed(feed_path_for(CONVS_FILE))
+    consumer = Consumer(feed, "etl")
+    for change in consumer.poll(limit=1000):
+        ...
+    consumer.commit()      # enregistre la dernière séquence lue
+
+Ligne de commande:
+    python3 changefeed.py read --consumer etl --limit 100 --commit
+    python3 changefeed.py read --after 0 --type message
+    python3 changefeed.py status
+    python3 changefeed.py prune     # supprime les changements lus par tous les consommateurs
+
+Commentaires en français.
+"""
+
+import argparse
+import sqlite3
+import time
+from pathlib import Path
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+import jsoncodec
+
+
+ROOT = Path(__file__).resolve().parent
+
+# Emplacement par défaut (peut être patché par les tests via monkeypatch)
+CONVS_FILE = ROOT / "conversations" / "conversations.jsonl"
+
+FEED_NAME = "changes.sqlite"
+
+RECORD_TYPES = ("conversation", "message", "profile")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS changes (
+    seq         INTEGER PRIMARY KEY AUTOINCREMENT,
+    record_type TEXT NOT NULL,
+    record_id   TEXT NOT NULL,
+    op          TEXT NOT NULL,
+    ts          REAL NOT NULL,
+    location    TEXT
+);
+CREATE INDEX IF NOT EXISTS changes_type_seq ON changes (record_type, seq);
+CREATE TABLE IF NOT EXISTS offsets (
+    consumer TEXT PRIMARY KEY,
+    seq      INTEGER NOT NULL
+);
+"""
+
+
+class Change(NamedTuple):
+    seq: int
+    record_type: str
+    record_id: str
+    op: str
+    ts: float
+    location: Optional[str]
+
+
+def feed_path_for(convs_file: Path) -> Path:
+    """Chemin du journal, placé à côté du fichier de conversations."""
+    return convs_file.parent / FEED_NAME
+
+
+class ChangeFeed:
+    """Journal des changements dans un fichier SQLite."""
+
+    def __init__(self, path: Path, timeout: float = 30.0):
+        self.path = Path(path)
+        self.timeout = timeout
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        conn = self._connect()
+        try:
+            conn.executescript(SCHEMA)
+        finally:
+            conn.close()
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(str(self.path), timeout=self.timeout)
+
+    def append(self, record_type: str, changes: Iterable[Tuple[str, str]], location: Optional[Path] = None) -> int:
+        """Ajoute des changements (record_id, op) d'un même type et emplacement, dans une transaction.
+        Retourne le nombre de changements ajoutés.
+        """
+        if record_type not in RECORD_TYPES:
+            raise ValueError(f"Type d'enregistrement inconnu: {record_type}")
+        now = time.time()
+        loc = str(location) if location is not None else None
+        conn = self._connect()
+        try:
+            with conn:
+                cur = conn.executemany(
+                    "INSERT INTO changes (record_type, record_id, op, ts, location) VALUES (?, ?, ?, ?, ?)",
+                    ((record_type, record_id, op, now, loc) for record_id, op in changes),
+                )
+                return cur.rowcount
+        finally:
+            conn.close()
+
+    def read(self, after: int = 0, limit: int = 1000, record_type: Optional[str] = None) -> List[Change]:
+        """Changements de séquence > `after`, dans l'ordre, au plus `limit`."""
+        conn = self._connect()
+        try:
+            if record_type is None:
+                rows = conn.execute(
+                    "SELECT seq, record_type, record_id, op, ts, location FROM changes"
+                    " WHERE seq > ? ORDER BY seq LIMIT ?",
+                    (after, limit),
+                ).fetchall()
+            else:
+                rows = conn.execute(
+                    "SELECT seq, record_type, record_id, op, ts, location FROM changes"
+                    " WHERE record_type = ? AND seq > ? ORDER BY seq LIMIT ?",
+                    (record_type, after, limit),
+                ).fetchall()
+        finally:
+            conn.close()
+        return [Change(*row) for row in rows]
+
+    def last_seq(self) -> int:
+        conn = self._connect()
+        try:
+            return conn.execute("SELECT COALESCE(MAX(seq), 0) FROM changes").fetchone()[0]
+        finally:
+            conn.close()
+
+    def get_offset(self, consumer: str) -> int:
+        conn = self._connect()
+        try:
+            row = conn.execute("SELECT seq FROM offsets WHERE consumer = ?", (consumer,)).fetchone()
+        finally:
+            conn.close()
+        return row[0] if row else 0
+
+    def set_offset(self, consumer: str, seq: int) -> None:
+        conn = self._connect()
+        try:
+            with conn:
+                conn.execute("INSERT OR REPLACE INTO offsets (consumer, seq) VALUES (?, ?)", (consumer, seq))
+        finally:
+            conn.close()
+
+    def offsets(self) -> Dict[str, int]:
+        conn = self._connect()
+        try:
+            return dict(conn.execute("SELECT consumer, seq FROM offsets ORDER BY consumer"))
+        finally:
+            conn.close()
+
+    def prune(self) -> int:
+        """Supprime les changements déjà lus par tous les consommateurs enregistrés.
+        Retourne le nombre de changements supprimés (0 s'il n'y a aucun consommateur).
+        """
+        conn = self._connect()
+        try:
+            with conn:
+                row = conn.execute("SELECT MIN(seq) FROM offsets").fetchone()
+                if row[0] is None:
+                    return 0
+                return conn.execute("DELETE FROM changes WHERE seq <= ?", (row[0],)).rowcount
+        finally:
+            conn.close()
+
+
+class Consumer:
+    """Lecteur du journal qui reprend depuis son offset sauvegardé."""
+
+    def __init__(self, feed: ChangeFeed, name: str):
+        self.feed = feed
+        self.name = name
+        self.position = feed.get_offset(name)
+
+    def poll(self, limit: int = 1000, record_type: Optional[str] = None) -> List[Change]:
+        """Changements suivants (l'offset n'est sauvegardé qu'au `commit()`)."""
+        # lue avant les changements: une séquence ajoutée entre-temps ne peut pas être sautée
+        end = self.feed.last_seq() if record_type is not None else 0
+        changes = self.feed.read(self.position, limit, record_type)
+        if changes:
+            self.position = changes[-1].seq
+        elif record_type is not None:
+            # rien de ce type jusqu'à `end`: inutile de relire les autres changements
+            self.position = max(self.position, end)
+        return changes
+
+    def commit(self) -> None:
+        """Enregistre la position courante comme offset du consommateur."""
+        self.feed.set_offset(self.name, self.position)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Journal des changements de l'archive Crisp")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p_read = sub.add_parser("read", help="Lire les changements (JSON, un par ligne)")
+    p_read.add_argument("--consumer", help="Reprendre depuis l'offset de ce consommateur")
+    p_read.add_argument("--after", type=int, default=None, help="Lire après cette séquence")
+    p_read.add_argument("--type", choices=RECORD_TYPES, default=None, help="Filtrer par type d'enregistrement")
+    p_read.add_argument("--limit", type=int, default=1000, help="Nombre max de changements (défaut 1000)")
+    p_read.add_argument("--commit", action="store_true", help="Enregistrer l'offset du consommateur après lecture")
+    sub.add_parser("status", help="Dernière séquence et offsets des consommateurs")
+    sub.add_parser("prune", help="Supprimer les changements lus par tous les consommateurs")
+    args = parser.parse_args()
+
+    feed = ChangeFeed(feed_path_for(CONVS_FILE))
+    if args.command == "status":
+        print(f"Dernière séquence: {feed.last_seq()}")
+        for consumer, seq in feed.offsets().items():
+            print(f"{consumer}\t{seq}")
+        return
+    if args.command == "prune":
+        print(f"{feed.prune()} changements supprimés.")
+        return
+
+    if args.consumer:
+        consumer = Consumer(feed, args.consumer)
+        if args.after is not None:
+            consumer.position = args.after
+        changes = consumer.poll(args.limit, args.type)
+    else:
+        consumer = None
+        changes = feed.read(args.after or 0, args.limit, args.type)
+    for change in changes:
+        print(jsoncodec.dumps(change._asdict()))
+    if consumer is not None and args.commit:
+        consumer.commit()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,345 @@
+#!/usr/bin/env python3
+"""
+columnar.py
+
+Export colonnaire des conversations et des messages pour l'analyse.
+
+Au lieu de relire et décoder des milliers de fichiers
+`/conversations/messages/{session_id}.jsonl`, ce script produit dans
+`/conversations/columnar/` des colonnes binaires typées (un fichier `.bin` par
+colonne, valeurs brutes dans l'ordre natif de la machine) lisibles par
+memory-map, sans décodage JSON:
+
+- `messages/` : session, fingerprint, timestamp, from, type, origin,
+  offset, length (position de la ligne du message dans son fichier .jsonl)
+- `conversations/` : session, state, created_at, updated_at, active_last,
+  offset, length (position de la ligne dans conversations.jsonl)
+- `dictionaries.json` : valeurs des colonnes de type dictionnaire (session,
+  from, type, origin, state), la colonne contenant l'index dans la liste (-1 = absent)
+- `manifest.json` : types des colonnes et, par session, les lignes occupées
+  ainsi que la taille et la date du fichier source
+
+L'export est incrémental: seuls les fichiers de messages modifiés depuis
+l'export précédent sont relus ; les lignes des autres sessions sont recopiées
+depuis les colonnes existantes. `--full` force une reconstruction complète.
+
+Lecture (exemple avec NumPy, optionnel):
+    numpy.memmap("conversations/columnar/messages/timestamp.bin", dtype="int64", mode="r")
+
+Commentaires en français.
+"""
+
+import argparse
+import json
+import mmap
+import os
+import shutil
+import sys
+from array import array
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+import jsoncodec
+from records import extract_session_id_from_line
+
+ROOT = Path(__file__).resolve().parent
+
+# Emplacements par défaut (peuvent être patchés par les tests via monkeypatch)
+CONVS_FILE = ROOT / "conversations" / "conversations.jsonl"
+MESS_DIR = ROOT / "conversations" / "messages"
+COLUMNAR_DIR = ROOT / "conversations" / "columnar"
+
+# Colonnes et typecodes `array` (i: int32, h: int16, q: int64)
+MESSAGE_COLUMNS = {
+    "session": "i",
+    "fingerprint": "q",
+    "timestamp": "q",
+    "from": "h",
+    "type": "h",
+    "origin": "i",
+    "offset": "q",
+    "length": "i",
+}
+CONVERSATION_COLUMNS = {
+    "session": "i",
+    "state": "h",
+    "created_at": "q",
+    "updated_at": "q",
+    "active_last": "q",
+    "offset": "q",
+    "length": "i",
+}
+DICTIONARY_COLUMNS = ("session", "from", "type", "origin", "state")
+
+MANIFEST_VERSION = 1
+
+
+class Dictionary:
+    """Dictionnaire de chaînes (ajout seulement) : valeur -> code entier."""
+
+    def __init__(self, values: Optional[List[str]] = None):
+        self.values: List[str] = list(values or [])
+        self.codes: Dict[str, int] = {v: i for i, v in enumerate(self.values)}
+
+    def code(self, value: Any) -> int:
+        if value is None:
+            return -1
+        value = str(value)
+        code = self.codes.get(value)
+        if code is None:
+            code = len(self.values)
+            self.codes[value] = code
+            self.values.append(value)
+        return code
+
+
+class ColumnSet:
+    """Colonnes d'une table ouvertes en memory-map (memoryview typées)."""
+
+    def __init__(self, directory: Path, columns: Dict[str, str]):
+        self.columns: Dict[str, memoryview] = {}
+        self._maps: List[mmap.mmap] = []
+        for name, typecode in columns.items():
+            path = directory / f"{name}.bin"
+            if not path.exists() or path.stat().st_size == 0:
+                self.columns[name] = memoryview(array(typecode))
+                continue
+            with path.open("rb") as f:
+                mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            self._maps.append(mm)
+            self.columns[name] = memoryview(mm).cast(typecode)
+
+    def __getitem__(self, name: str) -> memoryview:
+        return self.columns[name]
+
+    def __len__(self) -> int:
+        first = next(iter(self.columns.values()), None)
+        return len(first) if first is not None else 0
+
+    def close(self) -> None:
+        for view in self.columns.values():
+            view.release()
+        for mm in self._maps:
+            mm.close()
+        self.columns = {}
+        self._maps = []
+
+    def __enter__(self) -> "ColumnSet":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+
+def open_table(table: str, directory: Optional[Path] = None) -> ColumnSet:
+    """Ouvre la table `messages` ou `conversations` de l'export colonnaire."""
+    directory = directory or COLUMNAR_DIR
+    columns = MESSAGE_COLUMNS if table == "messages" else CONVERSATION_COLUMNS
+    return ColumnSet(directory / table, columns)
+
+
+def load_dictionaries(directory: Optional[Path] = None) -> Dict[str, Dictionary]:
+    """Charge les dictionnaires de l'export (vides si absents)."""
+    path = (directory or COLUMNAR_DIR) / "dictionaries.json"
+    raw: Dict[str, List[str]] = {}
+    if path.exists():
+        try:
+            raw = jsoncodec.loads(path.read_bytes())
+        except Exception:
+            raw = {}
+    return {name: Dictionary(raw.get(name)) for name in DICTIONARY_COLUMNS}
+
+
+def load_manifest(directory: Optional[Path] = None) -> Dict[str, Any]:
+    """Charge le manifeste de l'export (dict vide si absent ou d'une autre version)."""
+    path = (directory or COLUMNAR_DIR) / "manifest.json"
+    try:
+        manifest = jsoncodec.loads(path.read_bytes())
+    except Exception:
+        return {}
+    if manifest.get("version") != MANIFEST_VERSION or manifest.get("byteorder") != sys.byteorder:
+        return {}
+    return manifest
+
+
+def _as_int(value: Any, default: int = 0) -> int:
+    try:
+        number = int(value)
+    except Exception:
+        return default
+    # hors plage int64: valeur par défaut
+    if -(1 << 63) <= number < (1 << 63):
+        return number
+    return default
+
+
+def _new_arrays(columns: Dict[str, str]) -> Dict[str, array]:
+    return {name: array(typecode) for name, typecode in columns.items()}
+
+
+def parse_messages_file(path: Path, session_code: int, dictionaries: Dict[str, Dictionary]) -> Dict[str, array]:
+    """Décode un fichier de messages en colonnes (lignes malformées ignorées)."""
+    cols = _new_arrays(MESSAGE_COLUMNS)
+    with path.open("rb") as f:
+        offset = 0
+        for raw in f:
+            start = offset
+            offset += len(raw)
+            line = raw.strip()
+            if not line:
+                continue
+            try:
+                m = jsoncodec.loads(line)
+            except Exception:
+                continue
+            if not isinstance(m, dict):
+                continue
+            cols["session"].append(session_code)
+            cols["fingerprint"].append(_as_int(m.get("fingerprint"), -1))
+            cols["timestamp"].append(_as_int(m.get("timestamp")))
+            cols["from"].append(dictionaries["from"].code(m.get("from")))
+            cols["type"].append(dictionaries["type"].code(m.get("type")))
+            cols["origin"].append(dictionaries["origin"].code(m.get("origin")))
+            cols["offset"].append(start + len(raw) - len(raw.lstrip()))
+            cols["length"].append(len(line))
+    return cols
+
+
+def parse_conversations_file(path: Path, dictionaries: Dict[str, Dictionary]) -> Dict[str, array]:
+    """Décode conversations.jsonl en colonnes (lignes malformées ou sans session_id ignorées)."""
+    cols = _new_arrays(CONVERSATION_COLUMNS)
+    if not path.exists():
+        return cols
+    with path.open("rb") as f:
+        offset = 0
+        for raw in f:
+            start = offset
+            offset += len(raw)
+            line = raw.strip()
+            if not line:
+                continue
+            try:
+                c = jsoncodec.loads(line)
+            except Exception:
+                continue
+            session_id = extract_session_id_from_line(c)
+            if not session_id:
+                continue
+            active = c.get("active")
+            cols["session"].append(dictionaries["session"].code(session_id))
+            cols["state"].append(dictionaries["state"].code(c.get("state")))
+            cols["created_at"].append(_as_int(c.get("created_at")))
+            cols["updated_at"].append(_as_int(c.get("updated_at")))
+            cols["active_last"].append(_as_int(active.get("last") if isinstance(active, dict) else None))
+            cols["offset"].append(start + len(raw) - len(raw.lstrip()))
+            cols["length"].append(len(line))
+    return cols
+
+
+def _file_signature(path: Path) -> Optional[Tuple[int, int]]:
+    try:
+        st = path.stat()
+    except OSError:
+        return None
+    return st.st_mtime_ns, st.st_size
+
+
+def export(full: bool = False) -> Dict[str, int]:
+    """Met à jour l'export colonnaire. Retourne des statistiques (sessions converties/reprises, lignes)."""
+    manifest = {} if full else load_manifest()
+    dictionaries = load_dictionaries() if manifest else {name: Dictionary() for name in DICTIONARY_COLUMNS}
+    previous_sessions: Dict[str, List[int]] = manifest.get("sessions", {})
+
+    tmp_dir = COLUMNAR_DIR.with_name(COLUMNAR_DIR.name + ".tmp")
+    if tmp_dir.exists():
+        shutil.rmtree(tmp_dir)
+    (tmp_dir / "messages").mkdir(parents=True)
+    (tmp_dir / "conversations").mkdir(parents=True)
+
+    stats = {"converted": 0, "reused": 0, "removed": 0, "rows": 0}
+    sessions: Dict[str, List[int]] = {}
+    old = open_table("messages") if manifest else None
+    outputs = {name: (tmp_dir / "messages" / f"{name}.bin").open("wb") for name in MESSAGE_COLUMNS}
+    try:
+        row = 0
+        for path in sorted(MESS_DIR.glob("*.jsonl")):
+            session_id = path.stem
+            signature = _file_signature(path)
+            if signature is None:
+                continue
+            prev = previous_sessions.get(session_id)
+            if old is not None and prev is not None and tuple(prev[2:4]) == signature:
+                # session inchangée: recopier ses lignes depuis l'export précédent
+                start, count = prev[0], prev[1]
+                for name, out in outputs.items():
+                    out.write(old[name][start:start + count].tobytes())
+                stats["reused"] += 1
+            else:
+                cols = parse_messages_file(path, dictionaries["session"].code(session_id), dictionaries)
+                count = len(cols["timestamp"])
+                for name, out in outputs.items():
+                    cols[name].tofile(out)
+                stats["converted"] += 1
+            sessions[session_id] = [row, count, signature[0], signature[1]]
+            row += count
+        stats["rows"] = row
+        stats["removed"] = len(set(previous_sessions) - set(sessions))
+    finally:
+        for out in outputs.values():
+            out.close()
+        if old is not None:
+            old.close()
+
+    # Conversations: un seul fichier source, reconverti seulement s'il a changé
+    conv_signature = _file_signature(CONVS_FILE)
+    if manifest and conv_signature is not None and tuple(manifest.get("conversations", ())) == conv_signature:
+        shutil.copytree(COLUMNAR_DIR / "conversations", tmp_dir / "conversations", dirs_exist_ok=True)
+    else:
+        cols = parse_conversations_file(CONVS_FILE, dictionaries)
+        for name, values in cols.items():
+            with (tmp_dir / "conversations" / f"{name}.bin").open("wb") as out:
+                values.tofile(out)
+
+    with (tmp_dir / "dictionaries.json").open("w", encoding="utf-8") as f:
+        json.dump({name: d.values for name, d in dictionaries.items()}, f, ensure_ascii=False)
+    with (tmp_dir / "manifest.json").open("w", encoding="utf-8") as f:
+        json.dump({
+            "version": MANIFEST_VERSION,
+            "byteorder": sys.byteorder,
+            "columns": {"messages": MESSAGE_COLUMNS, "conversations": CONVERSATION_COLUMNS},
+            "conversations": list(conv_signature) if conv_signature else None,
+            "sessions": sessions,
+        }, f)
+
+    # Remplacer l'export précédent
+    old_dir = COLUMNAR_DIR.with_name(COLUMNAR_DIR.name + ".old")
+    if old_dir.exists():
+        shutil.rmtree(old_dir)
+    if COLUMNAR_DIR.exists():
+        os.replace(COLUMNAR_DIR, old_dir)
+    os.replace(tmp_dir, COLUMNAR_DIR)
+    if old_dir.exists():
+        shutil.rmtree(old_dir)
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export colonnaire des conversations et messages Crisp")
+    parser.add_argument("--full", action="store_true", help="Reconstruire tout l'export (ignorer l'export précédent)")
+    args = parser.parse_args()
+
+    if not MESS_DIR.exists():
+        print(f"Répertoire de messages introuvable: {MESS_DIR}")
+        return
+
+    stats = export(full=args.full)
+    print("--- Récapitulatif ---")
+    print(f"Sessions converties: {stats['converted']}")
+    print(f"Sessions inchangées (reprises): {stats['reused']}")
+    print(f"Sessions supprimées de l'export: {stats['removed']}")
+    print(f"Messages dans l'export: {stats['rows']}")
+    print(f"Export colonnaire: {COLUMNAR_DIR}")
+
+
+if __name__ == "__main__":
+    main()
@@ -8,7 +8,18 @@ Fonctionnalités :
 - Pagination via page_number et per_page=20
 - Gestion d'un fichier d'état pour reprendre l'export
 - Dé-duplication par session_id
-- Tri descendant par active.last
+- Tri descendant par active.last (tri externe sur disque au-delà de --sort-mem Mo)
+- Table compacte en mémoire (empreinte session_id, active.last, offset) : les
+  conversations complètes ne sont relues depuis le disque qu'à l'écriture
+- Mode --upsert : remplace les conversations déjà présentes dont le contenu ou
+  active.last a changé (détection par empreinte du contenu). Chaque run relit
+  une fenêtre de --upsert-pages pages à partir d'un curseur sauvegardé dans
+  l'état (`upsert_next_page`, remis à 1 après la dernière page): toutes les
+  pages finissent relues, même si l'API ne trie pas par activité. En cours de
+  run, seules les conversations qui gardent leur rang sont réécrites en place ;
+  le run se termine par la réécriture triée du fichier (lignes inchangées
+  recopiées telles quelles)
+- Options --projection / --cold : ne stocker que certains champs (voir projection.py)
 - Options : --nb N (nombre max de nouvelles conversations à exporter, défaut 400), --reset
 
 Variables d'environnement attendues :
@@ -25,16 +36,35 @@ import sys
 import time
 import json
 import argparse
-from typing import Dict, Any, List, Optional
+import threading
+from array import array
+from bisect import bisect_left
+from typing import Dict, Any, List, Optional, BinaryIO, Iterator, Tuple
 from pathlib import Path
 import requests
 
+import changefeed
+import crisp_api
+import jsoncodec
+import projection
+import query
+from extsort import sort_lines, DEFAULT_BUFFER_BYTES
+from hashing import hash64
+from records import conversation_last, extract_email_from_conv, extract_session_id
+from writer import BackgroundWriter
+
 # Constantes
 BASE_API = "https://api.crisp.chat/v1/website/{website_id}/conversations/{page_number}?per_page=20"
 CONV_DIR = Path(__file__).parent / "conversations"
 CONV_FILE = CONV_DIR / "conversations.jsonl"
 STATE_FILE = CONV_DIR / "conversations.jsonl.state.json"
 
+# Pages relues par run en mode --upsert (fenêtre glissante, curseur dans l'état)
+DEFAULT_UPSERT_PAGES = 50
+
+# Conversations ajoutées au-delà desquelles l'index trié de ConversationTable est reconstruit
+REINDEX_ROWS = 1 << 16
+
 # Headers requis
 HEADERS = {
     "Content-Type": "application/json",
@@ -46,8 +76,7 @@ def load_state() -> Dict[str, Any]:
     """Charge l'état depuis STATE_FILE si disponible."""
     if STATE_FILE.exists():
         try:
-            with STATE_FILE.open("r", encoding="utf-8") as f:
-                return json.load(f)
+            return jsoncodec.loads(STATE_FILE.read_bytes())
         except Exception:
             return {}
     return {}
@@ -59,18 +88,32 @@ def save_state(state: Dict[str, Any]) -> None:
         json.dump(state, f, ensure_ascii=False, indent=2)
 
 
+def reset_files() -> List[Path]:
+    """Supprime le fichier de conversations et ses fichiers associés (état, fichier froid
+    de la projection, index de l'archive de query.py, reconstructible avec
+    `python3 query.py rebuild`). Retourne les fichiers supprimés.
+    """
+    paths = [CONV_FILE, STATE_FILE, projection.cold_path_for(CONV_FILE), query.index_path_for(CONV_FILE)]
+    removed = []
+    for path in paths:
+        if path.exists():
+            path.unlink()
+            removed.append(path)
+    return removed
+
+
 def read_existing_conversations() -> Dict[str, Dict[str, Any]]:
     """Lit le fichier JSONL existant et renvoie un dict par session_id."""
     res = {}
     if not CONV_FILE.exists():
         return res
-    with CONV_FILE.open("r", encoding="utf-8") as f:
+    with CONV_FILE.open("rb") as f:
         for line in f:
             line = line.strip()
             if not line:
                 continue
             try:
-                obj = json.loads(line)
+                obj = jsoncodec.loads(line)
                 session_id = extract_session_id(obj)
                 if session_id:
                     res[session_id] = obj
@@ -80,47 +123,337 @@ def read_existing_conversations() -> Dict[str, Dict[str, Any]]:
     return res
 
 
-def extract_session_id(conv_obj: Dict[str, Any]) -> Optional[str]:
-    """Extrait session_id d'un objet conversation selon la structure attendue."""
-    # Selon la doc, l'identifiant est typiquement dans conv_obj.get('session_id')
-    if not isinstance(conv_obj, dict):
-        return None
-    # Plusieurs clés possibles selon la réponse
-    for key in ("session_id", "id", "_id"):
-        if key in conv_obj and isinstance(conv_obj[key], str):
-            return conv_obj[key]
-    # Parfois il peut être sous data -> session_id
-    if "data" in conv_obj and isinstance(conv_obj["data"], dict):
-        s = conv_obj["data"].get("session_id")
-        if isinstance(s, str):
-            return s
-    return None
-
-
 def sort_conversations(convs: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
     """Trie les conversations par active.last descendant (timestamp)."""
-    def last_ts(c: Dict[str, Any]) -> int:
+    return sorted(convs, key=conversation_last, reverse=True)
+
+
+def session_key(session_id: str) -> int:
+    """Empreinte d'un session_id, utilisée comme clé compacte."""
+    return hash64(session_id.encode("utf-8"))
+
+
+class ConversationTable:
+    """Table compacte des conversations du fichier JSONL.
+
+    Au lieu de garder chaque conversation complète en mémoire, on ne conserve
+    par conversation que l'empreinte du session_id, active.last, l'empreinte
+    du contenu (ligne JSON) ainsi que la position (offset, longueur) de la
+    ligne dans le fichier, dans des `array`.
+    La dé-duplication et le tri se font sur cette table ; le contenu des
+    conversations est relu depuis le disque uniquement lors de la réécriture.
+
+    Les empreintes sont retrouvées par recherche dichotomique dans un index trié
+    (`sorted_keys`/`sorted_rows`, 16 octets par conversation), les conversations
+    ajoutées depuis sa dernière reconstruction étant dans le petit dict `added`.
+    Une empreinte trouvée ne suffit pas: le session_id stocké est comparé, une
+    collision d'empreintes ne fait donc pas passer une conversation pour un doublon.
+
+    Les conversations nouvelles ou modifiées (pas encore écrites) sont gardées
+    sérialisées dans `pending` jusqu'au prochain `write()` ou `write_changes()`.
+    `add()`/`update()` peuvent être appelés depuis un autre thread pendant une écriture.
+
+    `write_changes()` réécrit en place, sans réécrire le fichier, celles qui gardent
+    leur rang et tiennent dans leur ancienne ligne (complétée par des espaces). Les
+    espaces de complément sont comptés dans `dead_bytes` ; `write()` (réécriture
+    triée) les supprime.
+    """
+
+    __slots__ = ("path", "keys", "sorted_keys", "sorted_rows", "added", "lasts", "hashes", "offsets",
+                 "lengths", "pending", "replaced", "dead_bytes", "lock")
+
+    def __init__(self, path: Path):
+        self.path = path
+        # empreinte du session_id de chaque ligne de la table
+        self.keys = array("q")
+        # index: empreintes triées et numéros de ligne correspondants
+        self.sorted_keys = array("q")
+        self.sorted_rows = array("q")
+        # empreinte -> ligne, pour les conversations ajoutées depuis la dernière reconstruction de l'index
+        self.added: Dict[int, int] = {}
+        self.lasts = array("q")
+        self.hashes = array("q")
+        # offset = -1 pour une conversation non encore écrite sur disque
+        self.offsets = array("q")
+        self.lengths = array("q")
+        self.pending: Dict[int, bytes] = {}
+        # ligne -> (offset, longueur, active.last) de la version sur disque d'une conversation modifiée
+        self.replaced: Dict[int, Tuple[int, int, int]] = {}
+        # octets blancs du fichier (espaces de complément, lignes vides, doublons)
+        self.dead_bytes = 0
+        self.lock = threading.Lock()
+
+    @classmethod
+    def load(cls, path: Path) -> "ConversationTable":
+        """Construit la table en parcourant le fichier ligne à ligne (lignes malformées ignorées)."""
+        table = cls(path)
+        if not path.exists():
+            return table
+        with path.open("rb") as f:
+            offset = 0
+            for raw in f:
+                start = offset
+                offset += len(raw)
+                line = raw.strip()
+                table.dead_bytes += len(raw) - len(line) - (1 if raw.endswith(b"\n") else 0)
+                if not line:
+                    continue
+                try:
+                    obj = jsoncodec.loads(line)
+                except Exception:
+                    # ignore malformed lines
+                    continue
+                session_id = extract_session_id(obj)
+                if not session_id:
+                    continue
+                # position exacte de la ligne sans les blancs de début
+                start += len(raw) - len(raw.lstrip())
+                table._append(session_key(session_id), conversation_last(obj), hash64(line), start, len(line))
+        table._reindex()
+        table._merge_duplicates()
+        return table
+
+    def _append(self, key: int, last: int, content_hash: int, offset: int, length: int) -> int:
+        """Ajoute une ligne à la table (sans l'indexer). Retourne son numéro."""
+        row = len(self.keys)
+        self.keys.append(key)
+        self.lasts.append(last)
+        self.hashes.append(content_hash)
+        self.offsets.append(offset)
+        self.lengths.append(length)
+        return row
+
+    def _set(self, row: int, last: int, content_hash: int, offset: int, length: int) -> None:
+        """Met à jour une ligne (garde sa position dans la table)."""
+        self.lasts[row] = last
+        self.hashes[row] = content_hash
+        self.offsets[row] = offset
+        self.lengths[row] = length
+
+    def _reindex(self) -> None:
+        """Reconstruit l'index trié des empreintes à partir de toutes les lignes."""
+        order = sorted(range(len(self.keys)), key=self.keys.__getitem__)
+        self.sorted_rows = array("q", order)
+        self.sorted_keys = array("q", (self.keys[row] for row in order))
+        self.added = {}
+
+    def _candidates(self, key: int) -> Iterator[int]:
+        """Lignes dont le session_id a l'empreinte `key` (plusieurs en cas de collision)."""
+        i = bisect_left(self.sorted_keys, key)
+        while i < len(self.sorted_keys) and self.sorted_keys[i] == key:
+            yield self.sorted_rows[i]
+            i += 1
+        row = self.added.get(key)
+        if row is not None:
+            yield row
+
+    def _session_id(self, row: int) -> Optional[str]:
+        """session_id stocké d'une ligne (version en attente, sinon relue sur disque)."""
+        line = self.pending.get(row)
+        if line is None:
+            with self.path.open("rb") as f:
+                f.seek(self.offsets[row])
+                line = f.read(self.lengths[row])
         try:
-            # accès à active.last
-            active = c.get("active", {})
-            if isinstance(active, dict):
-                last = active.get("last")
-                if isinstance(last, int):
-                    return last
-                # parfois string
-                if isinstance(last, str) and last.isdigit():
-                    return int(last)
+            return extract_session_id(jsoncodec.loads(line))
         except Exception:
-            pass
-        return 0
-
-    return sorted(convs, key=last_ts, reverse=True)
+            return None
 
+    def _find(self, session_id: str) -> Optional[int]:
+        """Ligne de la conversation `session_id`, None si absente."""
+        for row in self._candidates(session_key(session_id)):
+            if self._session_id(row) == session_id:
+                return row
+        return None
 
-def call_api(website_id: str, page_number: int, auth: requests.auth.AuthBase):
+    def _merge_duplicates(self) -> None:
+        """Fusionne les lignes d'un même session_id présent plusieurs fois dans le fichier.
+
+        La dernière version lue remplace la première (qui garde son rang), comme une
+        mise à jour ; l'ancienne ligne compte dans `dead_bytes`.
+        """
+        drop = set()
+        i = 0
+        while i < len(self.sorted_keys):
+            j = i + 1
+            while j < len(self.sorted_keys) and self.sorted_keys[j] == self.sorted_keys[i]:
+                j += 1
+            first: Dict[Optional[str], int] = {}
+            for row in sorted(self.sorted_rows[i:j]) if j - i > 1 else ():
+                session_id = self._session_id(row)
+                if session_id not in first:
+                    first[session_id] = row
+                    continue
+                keep = first[session_id]
+                self.dead_bytes += self.lengths[keep] + 1
+                self._set(keep, self.lasts[row], self.hashes[row], self.offsets[row], self.lengths[row])
+                drop.add(row)
+            i = j
+        if drop:
+            rows = [row for row in range(len(self.keys)) if row not in drop]
+            for name in ("keys", "lasts", "hashes", "offsets", "lengths"):
+                column = getattr(self, name)
+                setattr(self, name, array("q", (column[row] for row in rows)))
+            self._reindex()
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    def __contains__(self, session_id: str) -> bool:
+        with self.lock:
+            return self._find(session_id) is not None
+
+    def add(self, session_id: str, conv: Dict[str, Any]) -> bool:
+        """Ajoute une nouvelle conversation. Retourne False si elle est déjà présente."""
+        if session_id in self:
+            return False
+        key = session_key(session_id)
+        line = jsoncodec.dumpb(conv)
+        with self.lock:
+            row = self._append(key, conversation_last(conv), hash64(line), -1, len(line))
+            self.pending[row] = line
+            if key in self.added or len(self.added) >= REINDEX_ROWS:
+                self._reindex()
+            else:
+                self.added[key] = row
+        return True
+
+    def update(self, session_id: str, conv: Dict[str, Any]) -> bool:
+        """Remplace une conversation connue si son contenu a changé.
+
+        La détection compare active.last et l'empreinte du contenu sérialisé à
+        celles de la version stockée. Retourne True si la conversation a été
+        remplacée, False si elle est inchangée (ou inconnue).
+        """
+        with self.lock:
+            row = self._find(session_id)
+        if row is None:
+            return False
+        line = jsoncodec.dumpb(conv)
+        last = conversation_last(conv)
+        content_hash = hash64(line)
+        if self.lasts[row] == last and self.hashes[row] == content_hash:
+            return False
+        with self.lock:
+            if self.offsets[row] >= 0 and row not in self.replaced:
+                self.replaced[row] = (self.offsets[row], self.lengths[row], self.lasts[row])
+            self._set(row, last, content_hash, -1, len(line))
+            self.pending[row] = line
+        return True
+
+    @staticmethod
+    def _lines(old: Optional[BinaryIO], lasts: array, offsets: array, lengths: array,
+               pending: Dict[int, bytes]) -> Iterator[Tuple[Tuple[int, int], bytes]]:
+        """Produit (clé de tri, ligne) pour chaque conversation, dans l'ordre de la table.
+
+        La clé (active.last, -numéro de ligne) trie par last descendant et, à
+        égalité, dans l'ordre d'insertion (comme un tri stable).
+        """
+        for row in range(len(lasts)):
+            line = pending.get(row)
+            if line is None:
+                old.seek(offsets[row])
+                line = old.read(lengths[row])
+            yield (lasts[row], -row), line
+
+    def write(self, buffer_bytes: int = DEFAULT_BUFFER_BYTES) -> None:
+        """Réécrit le fichier trié par active.last descendant.
+
+        Les conversations inchangées sont recopiées telles quelles depuis
+        l'ancien fichier (lecture par offset), sans être re-décodées ; seules
+        les conversations nouvelles ou modifiées sont re-sérialisées. Le tri
+        passe par un tri externe : au-delà de `buffer_bytes`, des runs triés
+        sont écrits dans des fichiers temporaires puis fusionnés.
+
+        L'écriture travaille sur un instantané de la table : les conversations
+        ajoutées ou modifiées pendant l'écriture restent en attente.
+        """
+        with self.lock:
+            count = len(self.keys)
+            lasts = self.lasts[:count]
+            offsets = self.offsets[:count]
+            lengths = self.lengths[:count]
+            pending = dict(self.pending)
+
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.path.with_name(self.path.name + ".tmp")
+        new_offsets = array("q", bytes(8 * count))
+        new_lengths = array("q", bytes(8 * count))
+        old = self.path.open("rb") if self.path.exists() else None
+        try:
+            with tmp_path.open("wb") as out:
+                position = 0
+                ordered = sort_lines(self._lines(old, lasts, offsets, lengths, pending), reverse=True,
+                                     buffer_bytes=buffer_bytes, tmp_dir=self.path.parent)
+                for (_, neg_row), line in ordered:
+                    out.write(line)
+                    out.write(b"\n")
+                    new_offsets[-neg_row] = position
+                    new_lengths[-neg_row] = len(line)
+                    position += len(line) + 1
+        finally:
+            if old is not None:
+                old.close()
+
+        with self.lock:
+            os.replace(tmp_path, self.path)
+            # conversations ajoutées ou modifiées pendant l'écriture: toujours en attente
+            still_pending = {row: line for row, line in self.pending.items() if pending.get(row) is not line}
+            # fichier compact: seules restent les anciennes versions (dans le nouveau fichier)
+            # des conversations modifiées pendant l'écriture
+            self.replaced = {}
+            for row in still_pending:
+                if row < count:
+                    self.replaced[row] = (new_offsets[row], new_lengths[row], lasts[row])
+                    new_offsets[row] = -1
+            self.offsets = new_offsets + self.offsets[count:]
+            self.pending = still_pending
+            self.dead_bytes = 0
+
+    def write_changes(self) -> int:
+        """Écrit à leur place les conversations modifiées dont le rang ne change pas.
+
+        Seules les conversations déjà sur disque dont active.last est inchangé (même
+        position dans le tri) et dont la nouvelle ligne tient dans l'ancienne sont
+        réécrites, complétées par des espaces en fin de ligne: le fichier reste trié,
+        une conversation par ligne. Les autres (nouvelles, déplacées, plus longues)
+        restent en attente du prochain `write()`. Retourne le nombre de conversations écrites.
+        """
+        with self.lock:
+            lines = {row: line for row, line in self.pending.items()
+                     if row in self.replaced and self.replaced[row][2] == self.lasts[row]
+                     and len(line) <= self.replaced[row][1]}
+            places = {row: self.replaced[row] for row in lines}
+        if not lines:
+            return 0
+
+        padding = 0
+        with self.path.open("r+b") as f:
+            for row, line in lines.items():
+                offset, length, _ = places[row]
+                f.seek(offset)
+                f.write(line + b" " * (length - len(line)))
+                padding += length - len(line)
+
+        with self.lock:
+            for row, line in lines.items():
+                offset, length, last = places[row]
+                if self.pending.get(row) is line:
+                    del self.pending[row]
+                    del self.replaced[row]
+                    self.offsets[row] = offset
+                else:
+                    # modifiée de nouveau pendant l'écriture: la version écrite devient l'ancienne
+                    self.replaced[row] = (offset, len(line), last)
+            self.dead_bytes += padding
+        return len(lines)
+
+
+def call_api(website_id: str, page_number: int, auth: requests.auth.AuthBase, fresh: bool = False):
     url = BASE_API.format(website_id=website_id, page_number=page_number)
     try:
-        resp = requests.get(url, headers=HEADERS, auth=auth, timeout=30)
+        # la première page (nouvelles conversations) n'est jamais servie depuis le cache
+        resp = crisp_api.get(url, headers=HEADERS, auth=auth, fresh=fresh or page_number == 1)
         return resp
     except requests.RequestException as e:
         print(f"Erreur réseau lors de l'appel API: {e}")
@@ -130,8 +463,19 @@ def call_api(website_id: str, page_number: int, auth: requests.auth.AuthBase):
 def main():
     parser = argparse.ArgumentParser(description="Exporter les conversations Crisp en JSONL")
     parser.add_argument("--nb", type=int, default=400, help="Nombre max de nouvelles conversations à exporter (défaut 400)")
-    parser.add_argument("--reset", action="store_true", help="Supprimer le fichier conversations.jsonl et réinitialiser l'état")
+    parser.add_argument("--reset", action="store_true", help="Supprimer le fichier conversations.jsonl (et ses index) et réinitialiser l'état")
+    parser.add_argument("--sort-mem", type=int, default=DEFAULT_BUFFER_BYTES // (1024 * 1024),
+                        help="Mémoire max (Mo) du tri avant débordement sur disque (défaut 64, minimum 1)")
+    parser.add_argument("--upsert", action="store_true",
+                        help="Mettre aussi à jour les conversations déjà présentes dont le contenu a changé "
+                             "(relit --upsert-pages pages depuis un curseur dédié, sans toucher à l'état de pagination)")
+    parser.add_argument("--upsert-pages", type=int, default=DEFAULT_UPSERT_PAGES,
+                        help=f"Pages relues par run en mode --upsert (défaut {DEFAULT_UPSERT_PAGES})")
+    crisp_api.add_arguments(parser)
+    projection.add_arguments(parser)
     args = parser.parse_args()
+    crisp_api.configure_from_args(args)
+    projection.configure_from_args(args)
 
     # Vérification des variables d'environnement
     identifier = os.getenv("CRISP_IDENTIFIER_PROD")
@@ -145,116 +489,182 @@ def main():
     CONV_DIR.mkdir(parents=True, exist_ok=True)
 
     if args.reset:
-        if CONV_FILE.exists():
-            CONV_FILE.unlink()
-        if STATE_FILE.exists():
-            STATE_FILE.unlink()
-        print("Fichiers de conversations et d'état supprimés. Reprise depuis le début.")
+        reset_files()
+        print("Fichiers de conversations, d'état et index associés supprimés. Reprise depuis le début.")
 
     # Auth HTTP Basic (Identifier:Key)
     auth = (identifier, key)
 
-    # Load existing conversations
-    existing = read_existing_conversations()
+    # Charger la table compacte des conversations existantes (dé-duplication et tri)
+    existing = ConversationTable.load(CONV_FILE)
     existing_count_initial = len(existing)
 
     # Load or init state
     state = load_state()
     page_number = int(state.get("next_page", 1))
+    if args.upsert:
+        # fenêtre glissante: reprise au curseur du mode upsert (page 1 après un tour complet)
+        page_number = int(state.get("upsert_next_page", 1))
+    pages_read = 0
 
     exported = 0
+    updated = 0
     ignored = 0
     total_added_this_run = 0
 
-    # Ouvrir le fichier en mode append
-    convs_to_write = []
-
     target_nb = args.nb
 
-    # Loop jusqu'à atteindre target_nb ou plus d'items
-    while exported < target_nb:
-        print(f"Appel API page {page_number} ... (exportés: {exported}, ignorés: {ignored})")
-        resp = call_api(website_id, page_number, auth)
-        if resp is None:
-            print("Échec de l'appel API, arrêt.")
-            break
+    # Étape d'écriture en arrière-plan: les pages récupérées sont enregistrées par lots
+    # (une réécriture triée du fichier et une sauvegarde d'état par lot), pendant que
+    # le thread principal continue d'appeler l'API
+    buffer_bytes = max(args.sort_mem, 1) * 1024 * 1024
+    dirty = False
+    # Index de requête (query.py): conversations ajoutées ou mises à jour en attente d'indexation
+    index = query.ArchiveIndex(query.index_path_for(CONV_FILE))
+    index_rows: List[Tuple[str, Optional[str], int]] = []
+    # Journal des changements (changefeed.py): (session_id, insert|update) en attente
+    feed = changefeed.ChangeFeed(changefeed.feed_path_for(CONV_FILE))
+    feed_rows: List[Tuple[str, str]] = []
+
+    def record_page(page: Tuple[int, bool, List[Tuple[str, Optional[str], int]], List[Tuple[str, str]], bool]) -> None:
+        nonlocal dirty
+        next_page, changed, rows, changes, last_page = page
+        dirty = dirty or changed
+        index_rows.extend(rows)
+        feed_rows.extend(changes)
+        if args.upsert:
+            # tour complet: le prochain run repart de la première page
+            state["upsert_next_page"] = 1 if last_page else next_page
+        else:
+            state["next_page"] = next_page
+            # dernière page atteinte: plus rien à récupérer au-delà du curseur (utilisé par planner.py)
+            state["complete"] = last_page
+
+    def flush_pages() -> None:
+        nonlocal dirty
+        if dirty:
+            if args.upsert:
+                # en place seulement (même rang) ; le reste attend la réécriture triée de fin de run
+                existing.write_changes()
+            else:
+                # Trier et réécrire l'ensemble du fichier selon last desc (unicité garantie par la table)
+                existing.write(buffer_bytes=buffer_bytes)
+            dirty = bool(existing.pending)
+        if dirty:
+            # conversations pas encore sur disque: index, journal et état publiés après la réécriture
+            return
+        publish_pages()
+
+    def publish_pages() -> None:
+        if index_rows:
+            index.update_sessions(index_rows)
+            index_rows.clear()
+        if feed_rows:
+            # publiés une fois les conversations écrites dans le fichier
+            feed.append("conversation", feed_rows, CONV_FILE)
+            feed_rows.clear()
+        # Mettre à jour l'état une fois les conversations écrites
+        save_state(state)
+
+    with BackgroundWriter(record_page, flush_pages) as writer:
+        # Loop jusqu'à atteindre target_nb ou plus d'items
+        while exported + updated < target_nb:
+            if args.upsert and pages_read >= args.upsert_pages:
+                print(f"{pages_read} pages relues, suite au prochain run (page {page_number}).")
+                break
+            print(f"Appel API page {page_number} ... (exportés: {exported}, mis à jour: {updated}, ignorés: {ignored})")
+            # en mode upsert, toutes les pages sont relues pour détecter les changements
+            resp = call_api(website_id, page_number, auth, fresh=args.upsert)
+            if resp is None:
+                print("Échec de l'appel API, arrêt.")
+                break
 
-        if resp.status_code == 429:
-            # quota atteint
-            print("Réponse 429: quota d'appels atteint. Arrêt prématuré.")
-            break
+            if resp.status_code == 429:
+                # quota atteint
+                print("Réponse 429: quota d'appels atteint. Arrêt prématuré.")
+                break
 
-        if resp.status_code not in (200, 206):
-            print(f"Réponse inattendue de l'API: {resp.status_code} {resp.text}")
-            break
+            if resp.status_code not in (200, 206):
+                print(f"Réponse inattendue de l'API: {resp.status_code} {resp.text}")
+                break
 
-        try:
-            data = resp.json()
-        except Exception:
-            print("Impossible de décoder la réponse JSON, arrêt.")
-            break
-
-        # La réponse devrait contenir 'data' : liste
-        page_items = data.get("data") if isinstance(data, dict) else None
-        if not page_items:
-            print("Aucun résultat sur cette page, fin de la récupération.")
-            break
-
-        new_found = 0
-        for item in page_items:
-            session_id = None
-            # L'item peut être une structure contenant 'session_id' ou 'session' etc.
-            if isinstance(item, dict):
-                session_id = extract_session_id(item)
-            if not session_id:
-                ignored += 1
-                continue
-            if session_id in existing:
-                ignored += 1
-                continue
-            # Ajout
-            existing[session_id] = item
-            convs_to_write.append(item)
-            exported += 1
-            new_found += 1
-            if exported >= target_nb:
+            try:
+                data = resp.json()
+            except Exception:
+                print("Impossible de décoder la réponse JSON, arrêt.")
                 break
 
-        if new_found > 0:
-            # Sauver les nouvelles conversations dans le fichier (append)
-            with CONV_FILE.open("a", encoding="utf-8") as f:
-                for c in convs_to_write:
-                    f.write(json.dumps(c, ensure_ascii=False) + "\n")
-            total_added_this_run += len(convs_to_write)
-            convs_to_write = []
-            # Trier et réécrire l'ensemble du fichier selon last desc et en s'assurant d'uniques
-            all_convs = list(existing.values())
-            sorted_convs = sort_conversations(all_convs)
-            with CONV_FILE.open("w", encoding="utf-8") as f:
-                for c in sorted_convs:
-                    f.write(json.dumps(c, ensure_ascii=False) + "\n")
-
-        # Mettre à jour l'état
-        page_number += 1
-        state["next_page"] = page_number
-        save_state(state)
+            # La réponse devrait contenir 'data' : liste
+            page_items = data.get("data") if isinstance(data, dict) else None
+            if not page_items:
+                print("Aucun résultat sur cette page, fin de la récupération.")
+                writer.submit((page_number, False, [], [], True))
+                break
 
-        # Si moins que per_page renvoyé, fin
-        try:
-            if isinstance(page_items, list) and len(page_items) < 20:
+            new_found = 0
+            updated_found = 0
+            page_rows: List[Tuple[str, Optional[str], int]] = []
+            page_changes: List[Tuple[str, str]] = []
+            page_cold: List[Tuple[str, Optional[Dict[str, Any]]]] = []
+            for item in page_items:
+                session_id = None
+                # L'item peut être une structure contenant 'session_id' ou 'session' etc.
+                if isinstance(item, dict):
+                    session_id = extract_session_id(item)
+                if not session_id:
+                    ignored += 1
+                    continue
+                # champs stockés (projection) ; l'empreinte du contenu porte sur la version projetée
+                item, cold = projection.split("conversation", item)
+                if session_id in existing:
+                    # En mode upsert, remplacer la conversation si elle a changé
+                    if not args.upsert or not existing.update(session_id, item):
+                        ignored += 1
+                        continue
+                    updated += 1
+                    updated_found += 1
+                    page_changes.append((session_id, "update"))
+                else:
+                    # Ajout
+                    existing.add(session_id, item)
+                    exported += 1
+                    new_found += 1
+                    page_changes.append((session_id, "insert"))
+                page_cold.append((session_id, cold))
+                page_rows.append((session_id, extract_email_from_conv(item), conversation_last(item)))
+                if exported + updated >= target_nb:
+                    break
+
+            total_added_this_run += new_found
+            # parties écartées écrites avant la conversation projetée (rien n'est perdu)
+            projection.write_cold(CONV_FILE, "conversation", page_cold)
+
+            # Si moins que per_page renvoyé, c'est la dernière page
+            last_page = isinstance(page_items, list) and len(page_items) < 20
+
+            # Confier la réécriture du fichier et la mise à jour de l'état à l'étape d'écriture
+            page_number += 1
+            pages_read += 1
+            writer.submit((page_number, new_found > 0 or updated_found > 0, page_rows, page_changes, last_page))
+
+            if last_page:
                 print("Dernière page atteinte (moins de 20 items).")
                 break
-        except Exception:
-            pass
 
-        # Petite pause pour respecter quota
-        time.sleep(0.2)
+            # Petite pause pour respecter quota
+            time.sleep(0.2)
+
+    if existing.pending or existing.dead_bytes:
+        # fin de run: fichier trié par active.last, une conversation par ligne, sans espaces de complément
+        existing.write(buffer_bytes=buffer_bytes)
+        publish_pages()
 
     # Rapport final
     final_total = len(existing)
     print("--- Récapitulatif ---")
     print(f"Conversations initialement présentes: {existing_count_initial}")
     print(f"Nouvelles conversations exportées lors de cette exécution: {total_added_this_run}")
+    print(f"Conversations mises à jour lors de cette exécution: {updated}")
     print(f"Conversations ignorées lors de cette exécution: {ignored}")
     print(f"Conversations totales dans le fichier: {final_total}")
 
@@ -0,0 +1,437 @@
+#!/usr/bin/env python3
+"""
+crisp_api.py
+
+Couche HTTP commune aux scripts conv.py, mess.py et users.py.
+
+- `get()` : appel GET vers l'API Crisp (via `requests.get`), avec un cache de
+  réponses optionnel.
+- `ResponseCache` : cache disque SQLite des réponses valides (200/206), clé
+  (méthode, URL, paramètres), corps compressés (zlib), expiration par TTL.
+- `RetryPolicy` : nouvelles tentatives (sous le cache) sur erreur réseau transitoire
+  (connexion, délai dépassé) et réponse 5xx, avec attente exponentielle aléatoire
+  (« full jitter »). Les autres erreurs (URL invalide...) sont relevées aussitôt. Un 429
+  n'est retenté que s'il annonce une attente courte (`Retry-After`, limitation de débit) ;
+  sinon les scripts le traitent comme fin de quota. Chaque tentative a des délais courts
+  de connexion et de lecture (DEFAULT_TIMEOUT): une requête bloquée est vite retentée
+  ou doublée.
+- `Hedger` (option `--hedge`) : si une requête dépasse le p95 des durées observées, une
+  requête identique est lancée en parallèle et la première réponse l'emporte, dans la
+  limite d'une fraction du nombre de requêtes (`--hedge-budget`).
+- `RequestBudget` (option `--max-requests`) : nombre max de requêtes réseau de
+  l'exécution (nouvelles tentatives et requêtes doublées comprises). Une fois le
+  budget épuisé, `get()` retourne une réponse 429 synthétique, que les scripts
+  traitent comme la fin du quota (utilisé par planner.py).
+
+Modes du cache (option `--cache` des scripts):
+- `off`    : pas de cache (défaut)
+- `on`     : sert depuis le cache si présent et non expiré, sinon appelle l'API et enregistre ;
+  les appels `fresh=True` (première page de la liste des conversations, page la plus
+  récente des messages: là où arrivent les nouvelles données) vont toujours à l'API
+  et rafraîchissent le cache
+- `record` : appelle toujours l'API et enregistre les réponses
+- `replay` : sert uniquement depuis le cache, sans aucun accès réseau
+  (une réponse absente lève `CacheMiss`, traitée par les scripts comme une erreur réseau)
+
+Commentaires en français.
+"""
+
+import argparse
+import hashlib
+import json
+import queue
+import random
+import sqlite3
+import threading
+import time
+import zlib
+from collections import deque
+from pathlib import Path
+from typing import Any, Callable, Dict, Optional
+
+import requests
+
+import jsoncodec
+
+
+ROOT = Path(__file__).resolve().parent
+
+CACHE_MODES = ("off", "on", "record", "replay")
+DEFAULT_CACHE_FILE = ROOT / ".cache" / "http_cache.sqlite"
+# Durée de validité par défaut d'une réponse en cache (heures)
+DEFAULT_CACHE_TTL_HOURS = 24.0
+
+# Nouvelles tentatives: nombre max, attente de base et attente max (secondes)
+DEFAULT_RETRIES = 3
+DEFAULT_BACKOFF = 1.0
+DEFAULT_MAX_BACKOFF = 30.0
+# Codes HTTP considérés comme transitoires
+RETRY_STATUSES = (500, 502, 503, 504)
+# Erreurs réseau transitoires (les autres, comme InvalidURL ou InvalidSchema, ne sont pas retentées)
+RETRY_EXCEPTIONS = (requests.ConnectionError, requests.Timeout)
+# Délais (secondes) de connexion et de lecture d'une tentative
+DEFAULT_TIMEOUT = (3.05, 10.0)
+
+# Requêtes doublées (hedging): fraction max de requêtes supplémentaires, nombre de
+# durées observées avant d'activer le doublement et taille de la fenêtre d'observation
+DEFAULT_HEDGE_BUDGET = 0.05
+HEDGE_MIN_SAMPLES = 20
+HEDGE_WINDOW = 200
+
+CACHE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS responses (
+    key       TEXT PRIMARY KEY,
+    url       TEXT NOT NULL,
+    status    INTEGER NOT NULL,
+    body      BLOB NOT NULL,
+    stored_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS responses_stored_at ON responses (stored_at);
+"""
+
+
+class CacheMiss(requests.RequestException):
+    """Réponse absente du cache en mode replay."""
+
+
+class BudgetExhausted(Exception):
+    """Budget de requêtes (--max-requests) épuisé: aucune requête n'est envoyée."""
+
+
+class CachedResponse:
+    """Réponse servie depuis le cache (interface minimale de requests.Response)."""
+
+    from_cache = True
+
+    def __init__(self, status_code: int, content: bytes):
+        self.status_code = status_code
+        self.content = content
+
+    @property
+    def text(self) -> str:
+        return self.content.decode("utf-8", errors="replace")
+
+    def json(self) -> Any:
+        return jsoncodec.loads(self.content)
+
+
+class ResponseCache:
+    """Cache disque des réponses HTTP dans un fichier SQLite."""
+
+    def __init__(self, path: Path, ttl_seconds: float):
+        self.path = Path(path)
+        self.ttl_seconds = ttl_seconds
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        conn = self._connect()
+        try:
+            conn.executescript(CACHE_SCHEMA)
+        finally:
+            conn.close()
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(str(self.path), timeout=30, isolation_level=None)
+
+    @staticmethod
+    def make_key(method: str, url: str, params: Optional[Dict[str, Any]] = None) -> str:
+        """Clé de cache: empreinte de la méthode, de l'URL et des paramètres triés."""
+        raw = json.dumps([method.upper(), url, sorted((params or {}).items())], default=str)
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Optional[CachedResponse]:
+        """Retourne la réponse en cache, ou None si absente ou expirée."""
+        conn = self._connect()
+        try:
+            row = conn.execute(
+                "SELECT status, body FROM responses WHERE key = ? AND stored_at >= ?",
+                (key, time.time() - self.ttl_seconds),
+            ).fetchone()
+        finally:
+            conn.close()
+        if row is None:
+            return None
+        return CachedResponse(row[0], zlib.decompress(row[1]))
+
+    def put(self, key: str, url: str, status: int, content: bytes) -> None:
+        conn = self._connect()
+        try:
+            conn.execute(
+                "INSERT OR REPLACE INTO responses (key, url, status, body, stored_at) VALUES (?, ?, ?, ?, ?)",
+                (key, url, status, zlib.compress(content), time.time()),
+            )
+        finally:
+            conn.close()
+
+    def purge(self) -> int:
+        """Supprime les réponses expirées. Retourne le nombre de réponses supprimées."""
+        conn = self._connect()
+        try:
+            cur = conn.execute("DELETE FROM responses WHERE stored_at < ?", (time.time() - self.ttl_seconds,))
+            return cur.rowcount
+        finally:
+            conn.close()
+
+
+class QuotaResponse(CachedResponse):
+    """Réponse 429 synthétique retournée une fois le budget de requêtes épuisé."""
+
+    from_cache = False
+
+    def __init__(self):
+        super().__init__(429, b'{"error": true, "reason": "request_budget_exhausted"}')
+
+
+class RequestBudget:
+    """Nombre max de requêtes réseau (partagé entre threads)."""
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.used = 0
+        self._lock = threading.Lock()
+
+    def take(self) -> bool:
+        """Réserve une requête. Retourne False si le budget est épuisé."""
+        with self._lock:
+            if self.used >= self.limit:
+                return False
+            self.used += 1
+            return True
+
+
+class RetryPolicy:
+    """Nouvelles tentatives avec attente exponentielle aléatoire (full jitter)."""
+
+    def __init__(self, retries: int = DEFAULT_RETRIES, backoff: float = DEFAULT_BACKOFF,
+                 max_backoff: float = DEFAULT_MAX_BACKOFF):
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+
+    def delay(self, attempt: int) -> float:
+        """Attente avant la tentative suivante (attempt = 0 pour la première nouvelle tentative)."""
+        return random.uniform(0, min(self.max_backoff, self.backoff * (2 ** attempt)))
+
+    def retry_after(self, resp: Any) -> Optional[float]:
+        """Attente annoncée par un 429 (`Retry-After` en secondes), si elle est courte."""
+        headers = getattr(resp, "headers", None) or {}
+        try:
+            wait = float(headers.get("Retry-After"))
+        except (TypeError, ValueError):
+            return None
+        return wait if 0 <= wait <= self.max_backoff else None
+
+    def call(self, send: Callable[[], Any]) -> Any:
+        """Appelle `send()` et recommence sur erreur réseau transitoire, réponse 5xx ou
+        429 à attente courte. Après la dernière tentative, l'erreur est relevée ou la
+        réponse retournée.
+        """
+        attempt = 0
+        while True:
+            try:
+                resp = send()
+            except RETRY_EXCEPTIONS as e:
+                if attempt >= self.retries:
+                    raise
+                wait = self.delay(attempt)
+                print(f"Erreur réseau ({e}), nouvelle tentative dans {wait:.1f}s...")
+            else:
+                if attempt >= self.retries:
+                    return resp
+                if resp.status_code in RETRY_STATUSES:
+                    wait = self.delay(attempt)
+                elif resp.status_code == 429 and self.retry_after(resp) is not None:
+                    wait = self.retry_after(resp)
+                else:
+                    return resp
+                print(f"Réponse {resp.status_code}, nouvelle tentative dans {wait:.1f}s...")
+            time.sleep(wait)
+            attempt += 1
+
+
+class Hedger:
+    """Double une requête lente (au-delà du p95 observé), dans la limite d'un budget."""
+
+    def __init__(self, budget: float = DEFAULT_HEDGE_BUDGET, min_samples: int = HEDGE_MIN_SAMPLES,
+                 window: int = HEDGE_WINDOW):
+        self.budget = budget
+        self.min_samples = min_samples
+        self.latencies: "deque[float]" = deque(maxlen=window)
+        self.requests = 0
+        self.hedges = 0
+        self._lock = threading.Lock()
+
+    def threshold(self) -> Optional[float]:
+        """p95 des durées observées (None tant qu'il y a trop peu d'observations)."""
+        with self._lock:
+            if len(self.latencies) < self.min_samples:
+                return None
+            ordered = sorted(self.latencies)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))]
+
+    def _may_hedge(self) -> bool:
+        with self._lock:
+            if self.hedges + 1 > self.budget * self.requests:
+                return False
+            self.hedges += 1
+            return True
+
+    def call(self, send: Callable[[], Any]) -> Any:
+        """Appelle `send()`; si la réponse tarde au-delà du p95, lance un second appel
+        et retourne la première réponse obtenue (l'autre est abandonnée).
+        """
+        with self._lock:
+            self.requests += 1
+        results: "queue.Queue[Any]" = queue.Queue()
+
+        def attempt() -> None:
+            started = time.monotonic()
+            try:
+                resp = send()
+            except BaseException as e:  # relevée dans l'appelant
+                results.put((False, e))
+                return
+            with self._lock:
+                self.latencies.append(time.monotonic() - started)
+            results.put((True, resp))
+
+        # threads démons: une requête abandonnée ne bloque pas la fin du script
+        threading.Thread(target=attempt, daemon=True).start()
+        pending = 1
+        threshold = self.threshold()
+        if threshold is not None:
+            try:
+                ok, value = results.get(timeout=threshold)
+            except queue.Empty:
+                if self._may_hedge():
+                    threading.Thread(target=attempt, daemon=True).start()
+                    pending += 1
+            else:
+                if ok:
+                    return value
+                raise value
+        while True:
+            ok, value = results.get()
+            pending -= 1
+            if ok:
+                return value
+            if not pending:
+                # tous les appels ont échoué: dernière erreur
+                raise value
+
+
+# Configuration active (mode et cache), fixée par configure()
+_mode = "off"
+_cache: Optional[ResponseCache] = None
+# Nouvelles tentatives, doublement des requêtes et budget, fixés par configure_requests()
+_retry = RetryPolicy()
+_hedger: Optional[Hedger] = None
+_budget: Optional[RequestBudget] = None
+
+
+def configure(mode: str = "off", path: Optional[Path] = None,
+              ttl_hours: float = DEFAULT_CACHE_TTL_HOURS) -> None:
+    """Active le cache de réponses pour les appels suivants à get()."""
+    global _mode, _cache
+    if mode not in CACHE_MODES:
+        raise ValueError(f"Mode de cache inconnu: {mode}")
+    _mode = mode
+    _cache = None
+    if mode == "replay":
+        # en replay on rejoue tout ce qui a été enregistré, même expiré
+        _cache = ResponseCache(path or DEFAULT_CACHE_FILE, float("inf"))
+    elif mode != "off":
+        _cache = ResponseCache(path or DEFAULT_CACHE_FILE, ttl_hours * 3600)
+        _cache.purge()
+
+
+def configure_requests(retries: int = DEFAULT_RETRIES, backoff: float = DEFAULT_BACKOFF,
+                       hedge: bool = False, hedge_budget: float = DEFAULT_HEDGE_BUDGET,
+                       max_requests: Optional[int] = None) -> None:
+    """Règle les nouvelles tentatives, le doublement des requêtes lentes et le budget de requêtes."""
+    global _retry, _hedger, _budget
+    _retry = RetryPolicy(retries, backoff)
+    _hedger = Hedger(hedge_budget) if hedge else None
+    _budget = RequestBudget(max_requests) if max_requests is not None else None
+
+
+def requests_used() -> Optional[int]:
+    """Nombre de requêtes réseau envoyées sous le budget configuré (None sans budget)."""
+    return _budget.used if _budget is not None else None
+
+
+def add_arguments(parser: argparse.ArgumentParser) -> None:
+    """Ajoute les options communes de la couche HTTP au parser d'un script."""
+    parser.add_argument("--cache", choices=CACHE_MODES, default="off",
+                        help="Cache disque des réponses API: off, on, record ou replay (sans réseau)")
+    parser.add_argument("--cache-ttl", type=float, default=DEFAULT_CACHE_TTL_HOURS,
+                        help=f"Durée de validité des réponses en cache, en heures (défaut {DEFAULT_CACHE_TTL_HOURS:.0f})")
+    parser.add_argument("--cache-file", type=Path, default=None,
+                        help=f"Fichier du cache (défaut {DEFAULT_CACHE_FILE})")
+    parser.add_argument("--retries", type=int, default=DEFAULT_RETRIES,
+                        help=f"Nouvelles tentatives sur erreur réseau ou 5xx (défaut {DEFAULT_RETRIES})")
+    parser.add_argument("--backoff", type=float, default=DEFAULT_BACKOFF,
+                        help=f"Attente de base (secondes) entre tentatives, doublée à chaque essai (défaut {DEFAULT_BACKOFF:g})")
+    parser.add_argument("--hedge", action="store_true",
+                        help="Doubler les requêtes plus lentes que le p95 observé")
+    parser.add_argument("--hedge-budget", type=float, default=DEFAULT_HEDGE_BUDGET,
+                        help=f"Fraction max de requêtes doublées (défaut {DEFAULT_HEDGE_BUDGET:g})")
+    parser.add_argument("--max-requests", type=int, default=None,
+                        help="Nombre max de requêtes API de l'exécution; au-delà, arrêt comme sur un 429")
+
+
+def configure_from_args(args: argparse.Namespace) -> None:
+    """Applique les options ajoutées par add_arguments()."""
+    configure(args.cache, args.cache_file, args.cache_ttl)
+    configure_requests(args.retries, args.backoff, args.hedge, args.hedge_budget, args.max_requests)
+
+
+def _send(url: str, headers: Dict[str, str], auth, params: Optional[Dict[str, Any]], timeout: Any):
+    if _budget is not None and not _budget.take():
+        raise BudgetExhausted(url)
+    kwargs: Dict[str, Any] = {"headers": headers, "auth": auth, "timeout": timeout}
+    if params is not None:
+        kwargs["params"] = params
+    return requests.get(url, **kwargs)
+
+
+def _fetch(url: str, headers: Dict[str, str], auth, params: Optional[Dict[str, Any]], timeout: Any):
+    """Appel réseau avec nouvelles tentatives et, si activé, doublement des requêtes lentes."""
+    hedger = _hedger
+
+    def send():
+        if hedger is not None:
+            return hedger.call(lambda: _send(url, headers, auth, params, timeout))
+        return _send(url, headers, auth, params, timeout)
+
+    try:
+        return _retry.call(send)
+    except BudgetExhausted:
+        # budget épuisé avant l'envoi (une requête doublée refusée laisse simplement l'autre répondre)
+        return QuotaResponse()
+
+
+def get(url: str, headers: Dict[str, str], auth, params: Optional[Dict[str, Any]] = None,
+        timeout: Any = DEFAULT_TIMEOUT, fresh: bool = False):
+    """Appel GET avec le cache, les nouvelles tentatives et le doublement configurés.
+
+    `fresh`: page susceptible de changer à tout moment, jamais servie depuis le
+    cache en mode `on` (seul le mode `replay` la lit, faute de réseau).
+
+    Lève requests.RequestException (dont CacheMiss) en cas d'erreur réseau,
+    comme requests.get, une fois les nouvelles tentatives épuisées.
+    """
+    if _cache is None:
+        return _fetch(url, headers, auth, params, timeout)
+
+    key = ResponseCache.make_key("GET", url, params)
+    if _mode == "replay" or (_mode == "on" and not fresh):
+        cached = _cache.get(key)
+        if cached is not None:
+            return cached
+        if _mode == "replay":
+            raise CacheMiss(f"Réponse absente du cache (mode replay): {url}")
+
+    resp = _fetch(url, headers, auth, params, timeout)
+    # seules les réponses valides sont mises en cache (pas les 429 ni les erreurs)
+    if resp.status_code in (200, 206):
+        _cache.put(key, url, resp.status_code, resp.content)
+    return resp
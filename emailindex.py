@@ -0,0 +1,196 @@
+#!/usr/bin/env python3
+"""
+emailindex.py
+
+Index persistant des emails présents dans utilisateurs.jsonl, pour que users.py
+sache quels profils existent déjà (et quand ils ont été récupérés) sans relire ni
+décoder le fichier.
+
+Fichiers (à côté du fichier utilisateurs):
+- `utilisateurs.jsonl.emails` : une ligne `email<TAB>fetched_at` par profil, email
+  normalisé (strip + minuscules), triées par email et sans doublons. `fetched_at` est
+  la date de récupération du profil en millisecondes (0 si inconnue). La recherche est
+  une dichotomie sur le fichier mappé en mémoire (memory-map): rien n'est chargé au
+  démarrage.
+- `utilisateurs.jsonl.emails.new` : emails ajoutés ou re-récupérés depuis le dernier
+  tri (non triés, petit fichier chargé en mémoire; la dernière ligne d'un email
+  l'emporte), fusionnés lors de la prochaine réécriture triée.
+
+L'index est considéré à jour s'il est au moins aussi récent que le fichier utilisateurs
+(voir `is_fresh`); users.py le reconstruit sinon.
+
+Commentaires en français.
+"""
+
+import mmap
+import os
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, Optional, Tuple
+
+
+def normalize_email(email: str) -> str:
+    return email.strip().lower()
+
+
+def index_path_for(users_file: Path) -> Path:
+    return users_file.with_name(users_file.name + ".emails")
+
+
+def _parse_line(line: bytes) -> Tuple[str, int]:
+    email, _, fetched_at = line.partition(b"\t")
+    return email.decode("utf-8"), int(fetched_at or 0)
+
+
+def _find_line(mm: mmap.mmap, key: bytes) -> Optional[int]:
+    """Cherche un email dans un fichier de lignes triées (dichotomie sur les octets).
+    Retourne son `fetched_at`, ou None s'il est absent.
+    """
+    lo, hi = 0, len(mm)
+    while lo < hi:
+        mid = (lo + hi) // 2
+        start = mm.rfind(b"\n", 0, mid) + 1
+        end = mm.find(b"\n", start, hi)
+        if end == -1:
+            end = hi
+        email, _, fetched_at = mm[start:end].partition(b"\t")
+        if email == key:
+            return int(fetched_at or 0)
+        if email < key:
+            lo = end + 1
+        else:
+            hi = start
+    return None
+
+
+class EmailIndex:
+    """Ensemble persistant d'emails normalisés avec leur date de récupération:
+    fichier trié + journal des ajouts.
+    """
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self.new_path = self.path.with_name(self.path.name + ".new")
+        self._file = None
+        self._map: Optional[mmap.mmap] = None
+        self._sorted_count: Optional[int] = None
+        self._added: Dict[str, int] = {}
+        # emails du journal absents du fichier trié
+        self._new_count = 0
+        self._open()
+
+    def _open(self) -> None:
+        if self.path.exists() and self.path.stat().st_size > 0:
+            self._file = self.path.open("rb")
+            self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        if self.new_path.exists():
+            with self.new_path.open("rb") as f:
+                for line in f:
+                    line = line.rstrip(b"\n")
+                    if line:
+                        email, fetched_at = _parse_line(line)
+                        if email not in self._added and self._in_sorted(email) is None:
+                            self._new_count += 1
+                        self._added[email] = fetched_at
+
+    def close(self) -> None:
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        self._sorted_count = None
+        self._added = {}
+        self._new_count = 0
+
+    def __enter__(self) -> "EmailIndex":
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        self.close()
+
+    def _in_sorted(self, email: str) -> Optional[int]:
+        if self._map is None:
+            return None
+        return _find_line(self._map, email.encode("utf-8"))
+
+    def fetched_at(self, email: str) -> Optional[int]:
+        """Date de récupération (ms) du profil, 0 si inconnue, None si l'email est absent."""
+        email = normalize_email(email)
+        if email in self._added:
+            return self._added[email]
+        return self._in_sorted(email)
+
+    def __contains__(self, email: str) -> bool:
+        return self.fetched_at(email) is not None
+
+    def __len__(self) -> int:
+        if self._sorted_count is None:
+            # compté à la demande, par blocs, sans copier le fichier en mémoire
+            self._sorted_count = 0
+            if self._map is not None:
+                for start in range(0, len(self._map), 1 << 20):
+                    self._sorted_count += self._map[start:start + (1 << 20)].count(b"\n")
+        return self._sorted_count + self._new_count
+
+    def __iter__(self) -> Iterator[Tuple[str, int]]:
+        """Parcourt tous les couples (email, fetched_at), sans ordre garanti."""
+        added = dict(self._added)
+        if self._map is not None:
+            pos, size = 0, len(self._map)
+            while pos < size:
+                end = self._map.find(b"\n", pos)
+                if end == -1:
+                    end = size
+                email, fetched_at = _parse_line(self._map[pos:end])
+                pos = end + 1
+                if email in added:
+                    fetched_at = added.pop(email)
+                yield email, fetched_at
+        yield from added.items()
+
+    def add(self, email: str, fetched_at: int = 0) -> bool:
+        """Enregistre un email et sa date de récupération (journalisé immédiatement).
+        Retourne False si l'email était déjà présent (sa date est alors mise à jour).
+        """
+        email = normalize_email(email)
+        is_new = self.fetched_at(email) is None
+        if is_new:
+            self._new_count += 1
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with self.new_path.open("a", encoding="utf-8") as f:
+            f.write(f"{email}\t{int(fetched_at)}\n")
+        self._added[email] = int(fetched_at)
+        return is_new
+
+    def is_fresh(self, source: Path) -> bool:
+        """Vrai si l'index a été écrit après la dernière modification de `source`."""
+        if not source.exists():
+            return len(self) == 0
+        mtimes = [p.stat().st_mtime_ns for p in (self.path, self.new_path) if p.exists()]
+        return bool(mtimes) and max(mtimes) >= source.stat().st_mtime_ns
+
+    def clear(self) -> None:
+        self.close()
+        for p in (self.path, self.new_path):
+            if p.exists():
+                p.unlink()
+
+    def replace(self, sorted_entries: Iterable[Tuple[str, int]]) -> None:
+        """Réécrit l'index depuis des couples (email, fetched_at) triés par email
+        (après normalisation); vide le journal.
+        """
+        self.close()
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.path.with_name(self.path.name + ".tmp")
+        previous = None
+        with tmp_path.open("wb") as f:
+            for email, fetched_at in sorted_entries:
+                email = normalize_email(email)
+                if email != previous:
+                    f.write(f"{email}\t{int(fetched_at)}\n".encode("utf-8"))
+                    previous = email
+        os.replace(tmp_path, self.path)
+        if self.new_path.exists():
+            self.new_path.unlink()
+        self._open()
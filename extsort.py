@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+"""
+extsort.py
+
+Tri externe (merge sort sur disque) de lignes JSONL, utilisé par conv.py et
+users.py lorsque le volume de données dépasse la mémoire disponible.
+
+Principe:
+- Les lignes (avec leur clé de tri) sont accumulées en mémoire jusqu'à
+  `buffer_bytes`, triées puis écrites dans un fichier temporaire (run).
+- Les runs sont ensuite fusionnés (k-way merge avec heapq.merge), au plus
+  MAX_MERGE_RUNS à la fois: dès que MAX_MERGE_RUNS runs de même niveau
+  s'accumulent, ils sont fusionnés en un run du niveau suivant. Le nombre de
+  fichiers temporaires ouverts reste ainsi de quelques dizaines, même avec un
+  buffer minuscule ou une entrée énorme.
+- Le tri est stable : à clé égale, l'ordre d'arrivée des lignes est conservé,
+  exactement comme `sorted()`, y compris avec reverse=True.
+
+Si toutes les lignes tiennent dans le buffer, aucun fichier temporaire n'est créé.
+
+Commentaires en français.
+"""
+
+import heapq
+import tempfile
+from operator import itemgetter
+from pathlib import Path
+from typing import Any, BinaryIO, Iterable, Iterator, List, Optional, Tuple
+
+import jsoncodec
+
+
+# Taille mémoire par défaut du buffer de tri (octets)
+DEFAULT_BUFFER_BYTES = 64 * 1024 * 1024
+
+# Surcoût mémoire approximatif d'une entrée (tuple + objets Python)
+ITEM_OVERHEAD = 100
+
+# Nombre max de runs fusionnés en une passe
+MAX_MERGE_RUNS = 16
+
+
+def _encode_key(key: Any) -> bytes:
+    return jsoncodec.dumpb(key)
+
+
+def _decode_key(raw: bytes) -> Any:
+    key = jsoncodec.loads(raw)
+    # les tuples sont sérialisés en listes JSON
+    return tuple(key) if isinstance(key, list) else key
+
+
+def _spill(buffer: Iterable[Tuple[Any, bytes]], tmp_dir: Optional[Path]) -> BinaryIO:
+    """Écrit un run trié dans un fichier temporaire (clé JSON, tabulation, ligne)."""
+    run = tempfile.TemporaryFile(dir=str(tmp_dir) if tmp_dir else None)
+    for key, line in buffer:
+        run.write(_encode_key(key))
+        run.write(b"\t")
+        run.write(line)
+        run.write(b"\n")
+    run.seek(0)
+    return run
+
+
+def _read_run(run: BinaryIO) -> Iterator[Tuple[Any, bytes]]:
+    for raw in run:
+        key, line = raw.rstrip(b"\n").split(b"\t", 1)
+        yield _decode_key(key), line
+
+
+def _merge(runs: List[BinaryIO], reverse: bool) -> Iterator[Tuple[Any, bytes]]:
+    """Fusionne des runs triés, du plus ancien au plus récent."""
+    # heapq.merge est stable: à clé égale, le run le plus ancien passe en premier
+    return heapq.merge(*(_read_run(r) for r in runs), key=itemgetter(0), reverse=reverse)
+
+
+def sort_lines(items: Iterable[Tuple[Any, bytes]], reverse: bool = False,
+               buffer_bytes: int = DEFAULT_BUFFER_BYTES,
+               tmp_dir: Optional[Path] = None) -> Iterator[Tuple[Any, bytes]]:
+    """Trie des couples (clé, ligne) avec une mémoire bornée par `buffer_bytes`.
+
+    - Les clés doivent être sérialisables en JSON (int, str, tuples de ceux-ci).
+    - Les lignes sont des `bytes` sans retour à la ligne.
+    - tmp_dir : répertoire des runs temporaires (défaut: répertoire temporaire système).
+
+    Retourne un itérateur de couples (clé, ligne) triés.
+    """
+    by_key = itemgetter(0)
+    # pile de (niveau, run), du plus ancien au plus récent ; les niveaux y sont décroissants
+    runs: List[Tuple[int, BinaryIO]] = []
+    buffer: List[Tuple[Any, bytes]] = []
+    size = 0
+
+    def merge_last(count: int, level: int) -> None:
+        """Remplace les `count` derniers runs de la pile par leur fusion."""
+        group = [run for _, run in runs[-count:]]
+        merged = _spill(_merge(group, reverse), tmp_dir)
+        del runs[-count:]
+        runs.append((level, merged))
+        for run in group:
+            run.close()
+
+    def push(run: BinaryIO) -> None:
+        runs.append((0, run))
+        while len(runs) >= MAX_MERGE_RUNS and runs[-MAX_MERGE_RUNS][0] == runs[-1][0]:
+            merge_last(MAX_MERGE_RUNS, runs[-1][0] + 1)
+
+    try:
+        for key, line in items:
+            buffer.append((key, line))
+            size += len(line) + ITEM_OVERHEAD
+            if size >= buffer_bytes:
+                buffer.sort(key=by_key, reverse=reverse)
+                push(_spill(buffer, tmp_dir))
+                buffer = []
+                size = 0
+
+        buffer.sort(key=by_key, reverse=reverse)
+        if not runs:
+            # tout tient en mémoire
+            yield from buffer
+            return
+
+        if buffer:
+            push(_spill(buffer, tmp_dir))
+            buffer = []
+        # passes intermédiaires jusqu'à ne plus avoir que MAX_MERGE_RUNS runs à fusionner
+        while len(runs) > MAX_MERGE_RUNS:
+            merge_last(MAX_MERGE_RUNS, runs[-1][0] + 1)
+        yield from _merge([run for _, run in runs], reverse)
+    finally:
+        for _, run in runs:
+            run.close()
@@ -0,0 +1,285 @@
+#!/usr/bin/env python3
+"""
+fulltext.py
+
+Index plein texte (index inversé) sur le contenu des messages exportés par mess.py.
+
+Stockage: `/conversations/messages.fts.sqlite`, à côté du dossier `messages/`:
+- `sessions` : une ligne par session indexée (nombre de messages, mtime et taille
+  du fichier de messages au moment de l'indexation)
+- `postings` : pour chaque (terme, session), un blob compact d'entiers int64
+  (fingerprint, timestamp, nombre d'occurrences) par message contenant le terme
+
+Mise à jour incrémentale:
+- mess.py réindexe chaque session qu'il réécrit (`update_session`)
+- `python3 fulltext.py build` rattrape les sessions dont le fichier a changé
+  (mtime/taille) et retire celles dont le fichier a disparu
+
+Recherche: tous les termes doivent apparaître dans le message; classement tf-idf
+puis timestamp décroissant.
+
+Exemples:
+    python3 fulltext.py build
+    python3 fulltext.py search "erreur E1234" --limit 20
+
+Commentaires en français.
+"""
+
+import argparse
+import math
+import re
+import sqlite3
+import sys
+import unicodedata
+from array import array
+from collections import Counter
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, NamedTuple, Tuple
+
+import jsoncodec
+from hashing import hash64
+
+
+ROOT = Path(__file__).resolve().parent
+
+# Emplacement par défaut (peut être patché par les tests via monkeypatch)
+MESS_DIR = ROOT / "conversations" / "messages"
+
+INDEX_NAME = "messages.fts.sqlite"
+
+# Termes plus courts ignorés (articles, ponctuation isolée...)
+MIN_TERM_LENGTH = 2
+
+INDEX_SCHEMA = """
+CREATE TABLE IF NOT EXISTS sessions (
+    session_id TEXT PRIMARY KEY,
+    messages   INTEGER NOT NULL,
+    mtime_ns   INTEGER NOT NULL,
+    size       INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS postings (
+    term       TEXT NOT NULL,
+    session_id TEXT NOT NULL,
+    data       BLOB NOT NULL,
+    PRIMARY KEY (term, session_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS postings_session ON postings (session_id);
+"""
+
+_WORD_RE = re.compile(r"\w+")
+
+
+class Hit(NamedTuple):
+    score: float
+    session_id: str
+    fingerprint: int
+    timestamp: int
+
+
+def index_path_for(mess_dir: Path) -> Path:
+    """Chemin de l'index, placé à côté du dossier des messages."""
+    return mess_dir.parent / INDEX_NAME
+
+
+def tokenize(text: str) -> List[str]:
+    """Découpe un texte en termes: minuscules, sans accents, mots d'au moins MIN_TERM_LENGTH caractères."""
+    folded = unicodedata.normalize("NFKD", text.lower())
+    folded = "".join(ch for ch in folded if not unicodedata.combining(ch))
+    return [t for t in _WORD_RE.findall(folded) if len(t) >= MIN_TERM_LENGTH]
+
+
+def message_text(m: Dict[str, Any]) -> str:
+    """Texte indexable d'un message (`content` texte, ou valeurs texte d'un contenu structuré)."""
+    content = m.get("content")
+    if isinstance(content, str):
+        return content
+    if isinstance(content, dict):
+        return " ".join(v for v in content.values() if isinstance(v, str))
+    return ""
+
+
+def message_fingerprint(m: Dict[str, Any]) -> int:
+    """Fingerprint entier du message (empreinte 64 bits s'il n'est pas numérique)."""
+    fp = m.get("fingerprint")
+    try:
+        return int(fp)
+    except Exception:
+        return hash64(str(fp).encode("utf-8"))
+
+
+def message_timestamp(m: Dict[str, Any]) -> int:
+    try:
+        return int(m.get("timestamp"))
+    except Exception:
+        return 0
+
+
+class FullTextIndex:
+    """Index inversé SQLite des messages."""
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        conn = self._connect()
+        try:
+            conn.executescript(INDEX_SCHEMA)
+        finally:
+            conn.close()
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(str(self.path), timeout=30)
+
+    def update_session(self, session_id: str, messages: Iterable[Dict[str, Any]],
+                       mtime_ns: int = 0, size: int = 0) -> int:
+        """Remplace les postings d'une session par ceux de ses messages. Retourne le nombre de messages."""
+        postings: Dict[str, array] = {}
+        count = 0
+        for m in messages:
+            count += 1
+            tf = Counter(tokenize(message_text(m)))
+            if not tf:
+                continue
+            fp, ts = message_fingerprint(m), message_timestamp(m)
+            for term, n in tf.items():
+                postings.setdefault(term, array("q")).extend((fp, ts, n))
+        conn = self._connect()
+        try:
+            with conn:
+                conn.execute("DELETE FROM postings WHERE session_id = ?", (session_id,))
+                conn.executemany(
+                    "INSERT INTO postings (term, session_id, data) VALUES (?, ?, ?)",
+                    ((term, session_id, values.tobytes()) for term, values in postings.items()),
+                )
+                conn.execute(
+                    "INSERT OR REPLACE INTO sessions (session_id, messages, mtime_ns, size) VALUES (?, ?, ?, ?)",
+                    (session_id, count, mtime_ns, size),
+                )
+        finally:
+            conn.close()
+        return count
+
+    def remove_session(self, session_id: str) -> None:
+        conn = self._connect()
+        try:
+            with conn:
+                conn.execute("DELETE FROM postings WHERE session_id = ?", (session_id,))
+                conn.execute("DELETE FROM sessions WHERE session_id = ?", (session_id,))
+        finally:
+            conn.close()
+
+    def indexed_files(self) -> Dict[str, Tuple[int, int]]:
+        """Sessions indexées -> (mtime_ns, taille) de leur fichier au moment de l'indexation."""
+        conn = self._connect()
+        try:
+            return {sid: (mtime, size) for sid, mtime, size in
+                    conn.execute("SELECT session_id, mtime_ns, size FROM sessions")}
+        finally:
+            conn.close()
+
+    def search(self, text: str, limit: int = 20) -> List[Hit]:
+        """Messages contenant tous les termes de `text`, classés par score tf-idf puis du plus récent."""
+        terms = sorted(set(tokenize(text)))
+        if not terms:
+            return []
+        conn = self._connect()
+        try:
+            total = conn.execute("SELECT COALESCE(SUM(messages), 0) FROM sessions").fetchone()[0]
+            postings = []
+            for term in terms:
+                rows = conn.execute("SELECT session_id, data FROM postings WHERE term = ?", (term,)).fetchall()
+                if not rows:
+                    return []
+                # nombre de messages contenant le terme (3 entiers de 8 octets par message)
+                postings.append((sum(len(data) for _, data in rows) // 24, rows))
+        finally:
+            conn.close()
+        # le terme le plus rare d'abord: il borne l'ensemble des candidats
+        postings.sort(key=lambda p: p[0])
+        # (session, fingerprint) -> [timestamp, score, nombre de termes trouvés]
+        matches: Dict[Tuple[str, int], List[Any]] = {}
+        for i, (df, rows) in enumerate(postings):
+            idf = math.log(1 + total / df)
+            for session_id, data in rows:
+                values = array("q")
+                values.frombytes(data)
+                for j in range(0, len(values), 3):
+                    key = (session_id, values[j])
+                    entry = matches.get(key)
+                    if entry is None:
+                        # un message absent des termes précédents ne peut plus correspondre
+                        if i > 0:
+                            continue
+                        entry = matches[key] = [values[j + 1], 0.0, 0]
+                    elif entry[2] < i:
+                        continue
+                    entry[1] += (1 + math.log(values[j + 2])) * idf
+                    entry[2] = i + 1
+        hits = [Hit(score, sid, fp, ts) for (sid, fp), (ts, score, found) in matches.items()
+                if found == len(terms)]
+        hits.sort(key=lambda h: (-h.score, -h.timestamp))
+        return hits[:limit]
+
+
+def read_messages(path: Path) -> List[Dict[str, Any]]:
+    out: List[Dict[str, Any]] = []
+    with path.open("rb") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                m = jsoncodec.loads(line)
+            except Exception:
+                continue
+            if isinstance(m, dict):
+                out.append(m)
+    return out
+
+
+def build(index: FullTextIndex, full: bool = False) -> Dict[str, int]:
+    """Indexe les fichiers de messages nouveaux ou modifiés depuis la dernière indexation."""
+    previous = index.indexed_files()
+    indexed = {} if full else previous
+    stats = {"indexed": 0, "unchanged": 0, "removed": 0}
+    seen = set()
+    for path in sorted(MESS_DIR.glob("*.jsonl")) if MESS_DIR.exists() else []:
+        session_id = path.stem
+        seen.add(session_id)
+        st = path.stat()
+        if indexed.get(session_id) == (st.st_mtime_ns, st.st_size):
+            stats["unchanged"] += 1
+            continue
+        index.update_session(session_id, read_messages(path), st.st_mtime_ns, st.st_size)
+        stats["indexed"] += 1
+    for session_id in set(previous) - seen:
+        index.remove_session(session_id)
+        stats["removed"] += 1
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Index plein texte des messages exportés")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p_build = sub.add_parser("build", help="Indexer les fichiers de messages nouveaux ou modifiés")
+    p_build.add_argument("--full", action="store_true", help="Réindexer toutes les sessions")
+    p_search = sub.add_parser("search", help="Rechercher des messages")
+    p_search.add_argument("text", help="Termes recherchés (tous requis)")
+    p_search.add_argument("--limit", type=int, default=20, help="Nombre max de résultats (défaut 20)")
+    args = parser.parse_args()
+
+    index = FullTextIndex(index_path_for(MESS_DIR))
+    if args.command == "build":
+        stats = build(index, full=args.full)
+        print(f"Index plein texte: {stats['indexed']} sessions indexées, {stats['unchanged']} inchangées, "
+              f"{stats['removed']} supprimées.")
+        return
+
+    hits = index.search(args.text, limit=args.limit)
+    if not hits:
+        print("Aucun résultat.", file=sys.stderr)
+    for hit in hits:
+        print(jsoncodec.dumps(hit._asdict()))
+
+
+if __name__ == "__main__":
+    main()
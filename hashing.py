@@ -0,0 +1,17 @@
+#!/usr/bin/env python3
+"""
+hashing.py
+
+Empreintes 64 bits communes à conv.py (table compacte des conversations) et
+fulltext.py (empreintes de messages), sans dépendance vers les scripts.
+
+Commentaires en français.
+"""
+
+import hashlib
+
+
+def hash64(data: bytes) -> int:
+    """Empreinte 64 bits (signée, pour tenir dans un array('q'))."""
+    digest = hashlib.blake2b(data, digest_size=8).digest()
+    return int.from_bytes(digest, "little", signed=True)
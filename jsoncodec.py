@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+"""
+jsoncodec.py
+
+Encodage/décodage JSON commun aux scripts (conversations, messages, profils,
+index). Le décodage utilise un décodeur natif s'il est installé (orjson, sinon
+msgspec), sinon la bibliothèque standard ; il accepte directement des bytes,
+sans décodage UTF-8 préalable.
+
+L'encodage reste celui de `json.dumps(obj, ensure_ascii=False)` (séparateurs
+", " et ": "), pour que les fichiers écrits restent identiques octet pour octet:
+les encodeurs natifs produisent un JSON compact. L'encodeur est construit une
+seule fois au lieu d'un par appel.
+
+Un document que le décodeur natif refuse mais que la bibliothèque standard
+accepte (NaN, entiers de plus de 64 bits...) est relu par la bibliothèque
+standard: le résultat et les erreurs (ValueError) sont les mêmes qu'avec
+`json.loads`.
+
+Commentaires en français.
+"""
+
+import json
+from typing import Any, Callable, Optional, Union
+
+try:
+    import orjson
+except ImportError:  # dépendance optionnelle
+    orjson = None
+
+try:
+    import msgspec
+except ImportError:  # dépendance optionnelle
+    msgspec = None
+
+BACKENDS = ("orjson", "msgspec", "json")
+
+_encoder = json.JSONEncoder(ensure_ascii=False)
+
+
+def _native_decoder(name: str) -> Optional[Callable[[Union[bytes, str]], Any]]:
+    if name == "orjson" and orjson is not None:
+        return orjson.loads
+    if name == "msgspec" and msgspec is not None:
+        return msgspec.json.Decoder().decode
+    return None
+
+
+def _available() -> str:
+    for name in BACKENDS[:-1]:
+        if _native_decoder(name) is not None:
+            return name
+    return "json"
+
+
+# Décodeur natif actif (None: bibliothèque standard seule)
+BACKEND = _available()
+_native = _native_decoder(BACKEND)
+
+
+def use(name: str) -> None:
+    """Choisit le décodeur (`orjson`, `msgspec` ou `json`). ValueError s'il n'est pas installé."""
+    global BACKEND, _native
+    if name not in BACKENDS:
+        raise ValueError(f"Décodeur JSON inconnu: {name}")
+    native = _native_decoder(name)
+    if name != "json" and native is None:
+        raise ValueError(f"Décodeur JSON non installé: {name}")
+    BACKEND, _native = name, native
+
+
+def loads(data: Union[bytes, bytearray, memoryview, str]) -> Any:
+    """Décode un document JSON (bytes ou str), comme `json.loads`."""
+    if _native is not None:
+        try:
+            return _native(data)
+        except Exception:
+            pass
+    if isinstance(data, memoryview):
+        data = data.tobytes()
+    return json.loads(data)
+
+
+def dumps(obj: Any) -> str:
+    """Encode comme `json.dumps(obj, ensure_ascii=False)`."""
+    return _encoder.encode(obj)
+
+
+def dumpb(obj: Any) -> bytes:
+    """Encode en UTF-8, comme `json.dumps(obj, ensure_ascii=False).encode("utf-8")`."""
+    return _encoder.encode(obj).encode("utf-8")
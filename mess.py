@@ -13,6 +13,12 @@ Fonctionnalités principales:
 - Gère un fichier d'état pour reprendre le traitement:
   `/conversations/messages/messages.jsonl.state.json`.
 - Deduplication des messages par champ `fingerprint` (identifiant unique).
+- Écriture des fichiers et de l'état dans un thread séparé (voir `writer.py`),
+  en parallèle des appels API.
+- Mode `--queue` : file de travail SQLite à baux (voir `workqueue.py`) pour
+  répartir les conversations entre plusieurs processus/machines.
+- Options `--projection` / `--cold` : ne stocker que certains champs des
+  messages (voir `projection.py`).
 
 Commentaires en français.
 """
@@ -21,12 +27,23 @@ import os
 import sys
 import json
 import time
+import socket
 import argparse
 from pathlib import Path
-from typing import List, Dict, Any, Optional, Tuple
+from typing import List, Dict, Any, Optional, Tuple, Callable, NamedTuple
 
 import requests
 
+import changefeed
+import crisp_api
+import fulltext
+import jsoncodec
+import projection
+import query
+from records import conversation_last, extract_session_id_from_line
+from workqueue import WorkQueue, DEFAULT_LEASE_SECONDS
+from writer import BackgroundWriter
+
 # Racine du projet
 ROOT = Path(__file__).resolve().parent
 
@@ -34,6 +51,17 @@ ROOT = Path(__file__).resolve().parent
 CONVS_FILE = ROOT / "conversations" / "conversations.jsonl"
 MESS_DIR = ROOT / "conversations" / "messages"
 STATE_FILE = MESS_DIR / "messages.jsonl.state.json"
+# File de travail partagée (mode --queue)
+QUEUE_FILE = MESS_DIR / "messages.queue.sqlite"
+
+# Ordres de traitement des conversations (--order). Hors "file", les conversations
+# passent par la file de travail, triées par priorité décroissante:
+# - recent : dernière activité (active.last) la plus récente d'abord
+# - open   : non lues par un opérateur, puis non résolues, puis les autres (récentes d'abord)
+# - stale  : synchronisées il y a le plus longtemps d'abord (jamais synchronisées en tête)
+ORDERS = ("file", "recent", "open", "stale")
+# Poids du rang (non lu / non résolu) devant active.last (timestamps en ms < 1e13)
+OPEN_RANK_WEIGHT = 1e13
 
 # Entêtes requis par l'API Crisp
 HEADERS = {
@@ -48,8 +76,7 @@ def load_state() -> Dict[str, Any]:
     """
     try:
         if STATE_FILE.exists():
-            with STATE_FILE.open("r", encoding="utf-8") as f:
-                return json.load(f)
+            return jsoncodec.loads(STATE_FILE.read_bytes())
     except Exception:
         return {}
     return {}
@@ -91,20 +118,22 @@ def merge_and_sort_messages(existing: List[Dict[str, Any]], new: List[Dict[str,
         index[str(fp)] = m
 
     # Construire la liste triée par timestamp descendant
-    def ts(item: Dict[str, Any]) -> int:
-        t = item.get("timestamp")
-        if isinstance(t, int):
-            return t
-        try:
-            return int(t)
-        except Exception:
-            return 0
-
     merged = list(index.values())
-    merged.sort(key=ts, reverse=True)
+    merged.sort(key=message_timestamp, reverse=True)
     return merged
 
 
+def message_timestamp(item: Dict[str, Any]) -> int:
+    """Timestamp d'un message en entier (0 si absent ou invalide)."""
+    t = item.get("timestamp")
+    if isinstance(t, int):
+        return t
+    try:
+        return int(t)
+    except Exception:
+        return 0
+
+
 def read_jsonl_file(path: Path) -> List[Dict[str, Any]]:
     """Lit un fichier JSONL et retourne la liste d'objets (ignore les lignes vides).
     En cas d'erreur retourne une liste vide.
@@ -113,13 +142,13 @@ def read_jsonl_file(path: Path) -> List[Dict[str, Any]]:
         return []
     out: List[Dict[str, Any]] = []
     try:
-        with path.open("r", encoding="utf-8") as f:
+        with path.open("rb") as f:
             for line in f:
                 line = line.strip()
                 if not line:
                     continue
                 try:
-                    out.append(json.loads(line))
+                    out.append(jsoncodec.loads(line))
                 except Exception:
                     # ignorer lignes malformées
                     continue
@@ -128,13 +157,43 @@ def read_jsonl_file(path: Path) -> List[Dict[str, Any]]:
     return out
 
 
-def write_jsonl_file(path: Path, items: List[Dict[str, Any]]) -> None:
+def write_jsonl_file(path: Path, items: List[Dict[str, Any]]) -> List[Tuple[int, int]]:
     """Écrit une liste d'objets en JSONL (écrase le fichier).
+    Retourne la position (offset, longueur en octets) de chaque ligne écrite.
     """
     path.parent.mkdir(parents=True, exist_ok=True)
-    with path.open("w", encoding="utf-8") as f:
+    positions: List[Tuple[int, int]] = []
+    offset = 0
+    with path.open("wb") as f:
         for it in items:
-            f.write(json.dumps(it, ensure_ascii=False) + "\n")
+            line = jsoncodec.dumpb(it)
+            length = len(line)
+            positions.append((offset, length))
+            offset += length + 1
+            f.write(line + b"\n")
+    return positions
+
+
+def index_messages(session_id: str, msg_file: Path, items: List[Dict[str, Any]],
+                   positions: List[Tuple[int, int]], archive: Optional[query.ArchiveIndex] = None,
+                   text_index: Optional[fulltext.FullTextIndex] = None) -> None:
+    """Met à jour les index de requête (query.py) et l'index plein texte (fulltext.py)
+    pour un fichier de messages réécrit.
+
+    `archive` / `text_index`: index ouverts une fois par exécution (ouverts ici à défaut).
+    """
+    if archive is None:
+        archive = query.ArchiveIndex(query.index_path_for(CONVS_FILE))
+    if text_index is None:
+        text_index = fulltext.FullTextIndex(fulltext.index_path_for(MESS_DIR))
+    entries = [(message_timestamp(m), offset, length) for m, (offset, length) in zip(items, positions)]
+    query.write_message_index(msg_file, entries)
+    archive.set_message_file(
+        session_id, msg_file, len(entries),
+        entries[0][0] if entries else None, entries[-1][0] if entries else None,
+    )
+    st = msg_file.stat()
+    text_index.update_session(session_id, items, st.st_mtime_ns, st.st_size)
 
 
 def call_messages_api(website_id: str, session_id: str, auth: Tuple[str, str], timestamp_before: Optional[int] = None) -> Optional[requests.Response]:
@@ -149,34 +208,258 @@ def call_messages_api(website_id: str, session_id: str, auth: Tuple[str, str], t
         params["timestamp_before"] = timestamp_before
 
     try:
-        resp = requests.get(url, headers=HEADERS, auth=auth, params=params, timeout=30)
+        # première page (messages les plus récents): jamais servie depuis le cache
+        resp = crisp_api.get(url, headers=HEADERS, auth=auth, params=params, fresh=timestamp_before is None)
         return resp
     except requests.RequestException as e:
         print(f"Erreur réseau lors de l'appel messages API: {e}")
         return None
 
 
-def extract_session_id_from_line(obj: Dict[str, Any]) -> Optional[str]:
-    """Extraire session_id depuis une ligne de conversations (format similaire à conv.extract_session_id).
-    On essaye quelques clés communes.
+def read_session_ids() -> List[Optional[str]]:
+    """Lit CONVS_FILE et retourne la liste des session_id dans l'ordre du fichier.
+    Les lignes malformées ou sans identifiant donnent None (pour garder les index).
     """
-    if not isinstance(obj, dict):
-        return None
-    for key in ("session_id", "id", "_id"):
-        if key in obj and isinstance(obj[key], str):
-            return obj[key]
-    if "data" in obj and isinstance(obj["data"], dict):
-        s = obj["data"].get("session_id")
-        if isinstance(s, str):
-            return s
-    return None
+    session_ids: List[Optional[str]] = []
+    with CONVS_FILE.open("rb") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                obj = jsoncodec.loads(line)
+            except Exception:
+                session_ids.append(None)
+                continue
+            session_ids.append(extract_session_id_from_line(obj))
+    return session_ids
+
+
+def conversation_rank(obj: Dict[str, Any]) -> int:
+    """Rang d'urgence d'une conversation: 2 si non lue côté opérateur, 1 si non résolue, 0 sinon."""
+    unread = obj.get("unread")
+    if isinstance(unread, dict):
+        try:
+            if int(unread.get("operator") or 0) > 0:
+                return 2
+        except (TypeError, ValueError):
+            pass
+    state = obj.get("state")
+    if isinstance(state, str) and state != "resolved":
+        return 1
+    return 0
+
+
+def task_priority(order: str, last: int, rank: int, synced_at: Optional[float]) -> float:
+    """Priorité d'une conversation dans la file (la plus grande est traitée en premier)."""
+    if order == "recent":
+        return float(last)
+    if order == "open":
+        return rank * OPEN_RANK_WEIGHT + last
+    if order == "stale":
+        return -(synced_at or 0.0)
+    return 0.0
+
+
+def read_schedule_infos() -> Tuple[List[Tuple[str, int, int]], int]:
+    """Lit CONVS_FILE et retourne les (session_id, active.last, rang) des conversations,
+    ainsi que le nombre de lignes malformées ou sans identifiant.
+    """
+    infos: List[Tuple[str, int, int]] = []
+    ignored = 0
+    with CONVS_FILE.open("rb") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                obj = jsoncodec.loads(line)
+            except Exception:
+                ignored += 1
+                continue
+            sid = extract_session_id_from_line(obj)
+            if not sid:
+                ignored += 1
+                continue
+            infos.append((sid, conversation_last(obj), conversation_rank(obj)))
+    return infos, ignored
+
+
+class FetchedConversation(NamedTuple):
+    """Messages récupérés pour une conversation, prêts à être écrits."""
+    session_id: str
+    msg_file: Path
+    existing: List[Dict[str, Any]]
+    new_messages: List[Dict[str, Any]]
+    # pages d'API appelées (statistiques pour planner.py ; 0 = non enregistré)
+    pages: int = 0
+
+
+def fetch_conversation(website_id: str, session_id: str, auth: Tuple[str, str],
+                       on_page: Optional[Callable[[], Any]] = None) -> Optional[FetchedConversation]:
+    """Récupère via l'API les messages absents de MESS_DIR/{session_id}.jsonl.
+
+    - on_page : fonction optionnelle appelée après chaque page reçue
+      (utilisée pour prolonger le bail en mode file de travail).
+
+    Les pages arrivent des plus récents aux plus anciens messages: dès qu'une page
+    contient un message déjà présent dans le fichier, les pages suivantes le sont
+    aussi et la pagination s'arrête (une resynchronisation coûte environ une requête).
+
+    Retourne None si le quota API est atteint (429), la conversation devant
+    alors être reprise plus tard. Rien n'est écrit: voir write_conversation().
+    """
+    msg_file = MESS_DIR / f"{session_id}.jsonl"
+
+    # Lire messages existants
+    existing = read_jsonl_file(msg_file)
+    existing_fps = {str(m.get("fingerprint")) for m in existing if m.get("fingerprint") is not None}
+    # messages déjà écrits dans le fichier (hors ceux récupérés pendant cet appel)
+    stored_fps = frozenset(existing_fps)
+
+    # Pagination: on commence sans timestamp_before, puis on utilise le plus ancien timestamp
+    more = True
+    page = 0
+    new_messages_acc: List[Dict[str, Any]] = []
+    oldest_ts: Optional[int] = None
+
+    while more:
+        resp = call_messages_api(website_id, session_id, auth, timestamp_before=oldest_ts)
+        page += 1
+        if resp is None:
+            print(f"Échec appel API pour {session_id}, arrêt de la conversation courante.")
+            break
+
+        if resp.status_code == 429:
+            print("429 reçu: quota API atteint. Pause et arrêt du traitement.")
+            return None
+
+        if resp.status_code not in (200, 206):
+            print(f"Réponse inattendue pour {session_id}: {resp.status_code} {getattr(resp, 'text', '')}")
+            break
+
+        try:
+            data = resp.json()
+        except Exception:
+            print(f"Impossible de décoder JSON pour {session_id} page {page}.")
+            break
+
+        if on_page is not None:
+            on_page()
+
+        # La réponse peut être une liste de messages ou un dict contenant 'data'
+        page_items: List[Dict[str, Any]] = []
+        if isinstance(data, dict) and "data" in data and isinstance(data["data"], list):
+            page_items = data["data"]
+        elif isinstance(data, list):
+            page_items = data
+        else:
+            # pas de messages
+            page_items = []
+
+        if not page_items:
+            # pas de nouveaux messages sur cette page -> fin de pagination
+            break
+
+        # Ajouter messages non présents (par fingerprint)
+        added = 0
+        ignored = 0
+        reached_stored = False
+        for m in page_items:
+            fp = m.get("fingerprint")
+            if fp is None:
+                ignored += 1
+                continue
+            if str(fp) in existing_fps:
+                reached_stored = reached_stored or str(fp) in stored_fps
+                ignored += 1
+                continue
+            new_messages_acc.append(m)
+            existing_fps.add(str(fp))
+            added += 1
+
+        # Mettre à jour oldest_ts pour pagination suivante: on prend le timestamp le plus petit
+        try:
+            ts_vals = [int(m.get("timestamp", 0)) for m in page_items if m.get("timestamp") is not None]
+            if ts_vals:
+                min_ts = min(ts_vals)
+                # Pour éviter de récupérer le même message, on demande timestamp_before = min_ts
+                # l'API retourne les messages strictement inférieurs à ce timestamp selon doc
+                oldest_ts = min_ts
+        except Exception:
+            pass
+
+        if reached_stored:
+            # messages plus anciens déjà dans le fichier: pas de page suivante à demander
+            break
+
+        # Petite pause pour limiter la rapidité des appels
+        time.sleep(0.05)
+
+        # Si l'API a retourné moins de 1 élément (ou aucun), on stoppe. Sinon on boucle.
+        # Ici on laisse la boucle se terminer naturellement si la prochaine page est vide.
+
+    return FetchedConversation(session_id, msg_file, existing, new_messages_acc, page)
+
 
+def write_conversation(result: FetchedConversation, archive: Optional[query.ArchiveIndex] = None,
+                       text_index: Optional[fulltext.FullTextIndex] = None,
+                       feed: Optional[changefeed.ChangeFeed] = None) -> None:
+    """Fusionne les nouveaux messages avec les existants et écrit le fichier de la conversation.
 
-def process_conversations(nb: int = 50, reset: bool = False) -> None:
+    `archive` / `text_index` / `feed`: index et journal des changements partagés par les
+    conversations d'une exécution.
+    """
+    session_id, msg_file, existing, new_messages_acc, pages = result
+    if archive is None:
+        archive = query.ArchiveIndex(query.index_path_for(CONVS_FILE))
+    if pages:
+        # coût (pages) et rendement (messages ajoutés) de la récupération, pour planner.py
+        archive.record_fetch(
+            session_id, pages, len(existing), len(new_messages_acc))
+    # Si on a récupéré des messages, fusionner et écrire
+    if new_messages_acc:
+        # champs stockés (projection), parties écartées écrites avant le fichier de la conversation
+        split = [projection.split("message", m) for m in new_messages_acc]
+        new_messages_acc = [hot for hot, _ in split]
+        projection.write_cold(MESS_DIR, "message",
+                              ((f"{session_id}:{hot.get('fingerprint')}", cold) for hot, cold in split))
+        merged = merge_and_sort_messages(existing, new_messages_acc)
+        index_messages(session_id, msg_file, merged, write_jsonl_file(msg_file, merged), archive, text_index)
+        # journal des changements: un changement par message ajouté au fichier
+        if feed is None:
+            feed = changefeed.ChangeFeed(changefeed.feed_path_for(CONVS_FILE))
+        feed.append(
+            "message", ((f"{session_id}:{m.get('fingerprint')}", "insert") for m in new_messages_acc), msg_file)
+        print(f"Conversation {session_id}: {len(new_messages_acc)} messages ajoutés, {len(existing)} messages existants.")
+    else:
+        # Aucun nouveau message -> si fichier n'existait pas, créer un fichier vide
+        if not msg_file.exists() and existing:
+            index_messages(session_id, msg_file, existing, write_jsonl_file(msg_file, existing), archive, text_index)
+        elif not msg_file.exists():
+            # créer au moins un fichier vide
+            index_messages(session_id, msg_file, [], write_jsonl_file(msg_file, []), archive, text_index)
+        print(f"Conversation {session_id}: aucun nouveau message.")
+
+
+def default_worker_id() -> str:
+    """Identifiant de worker par défaut: machine + pid."""
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def process_conversations(nb: int = 50, reset: bool = False, use_queue: bool = False,
+                          worker_id: Optional[str] = None,
+                          lease_seconds: float = DEFAULT_LEASE_SECONDS, order: str = "file") -> None:
     """Traitement principal: parcourt les conversations et exporte les messages.
 
     - nb : nombre maximum de conversations à traiter cette exécution.
-    - reset : réinitialise le fichier d'état pour repartir depuis le début.
+    - reset : réinitialise le fichier d'état (ou la file de travail) pour repartir depuis le début.
+    - use_queue : distribue les conversations via la file de travail partagée
+      (QUEUE_FILE) au lieu de l'index `next_index`, ce qui permet de lancer
+      plusieurs processus `mess.py` en parallèle.
+    - worker_id / lease_seconds : identifiant du worker et durée du bail en mode file.
+    - order : ordre de traitement (voir ORDERS); hors "file", passe par la file de travail
+      (reprise assurée par la file, les conversations prioritaires d'abord).
     """
     # Vérifier variables d'environnement
     identifier = os.getenv("CRISP_IDENTIFIER_PROD")
@@ -191,6 +474,15 @@ def process_conversations(nb: int = 50, reset: bool = False) -> None:
     # Préparer dossiers
     MESS_DIR.mkdir(parents=True, exist_ok=True)
 
+    # Lire toutes les conversations (JSONL)
+    if not CONVS_FILE.exists():
+        print(f"Fichier de conversations introuvable: {CONVS_FILE}")
+        return
+
+    if use_queue or order != "file":
+        process_queue(website_id, auth, nb, reset, worker_id or default_worker_id(), lease_seconds, order)
+        return
+
     if reset:
         if STATE_FILE.exists():
             STATE_FILE.unlink()
@@ -200,142 +492,137 @@ def process_conversations(nb: int = 50, reset: bool = False) -> None:
     state = load_state()
     next_index = int(state.get("next_index", 0))
 
-    # Lire toutes les conversations (JSONL)
-    if not CONVS_FILE.exists():
-        print(f"Fichier de conversations introuvable: {CONVS_FILE}")
-        return
-
-    conv_lines = []
-    with CONVS_FILE.open("r", encoding="utf-8") as f:
-        for line in f:
-            line = line.strip()
-            if not line:
-                continue
-            try:
-                conv_lines.append(json.loads(line))
-            except Exception:
-                conv_lines.append(None)
+    session_ids = read_session_ids()
 
-    total_convs = len(conv_lines)
+    total_convs = len(session_ids)
     processed = 0
     ignored_convs = 0
+    quota_reached = False
+    # index de l'archive, index plein texte et journal des changements ouverts une fois pour toute l'exécution
+    archive = query.ArchiveIndex(query.index_path_for(CONVS_FILE))
+    text_index = fulltext.FullTextIndex(fulltext.index_path_for(MESS_DIR))
+    feed = changefeed.ChangeFeed(changefeed.feed_path_for(CONVS_FILE))
+
+    def write_result(item: Tuple[int, FetchedConversation]) -> None:
+        index, result = item
+        write_conversation(result, archive, text_index, feed)
+        # prochaine conversation (sauvegardé une fois par lot)
+        state["next_index"] = index
+
+    # Les fichiers de messages sont écrits par l'étape d'écriture en arrière-plan
+    # pendant que le thread principal récupère la conversation suivante
+    with BackgroundWriter(write_result, lambda: save_state(state)) as writer:
+        idx = next_index
+        while idx < total_convs and processed < nb:
+            session_id = session_ids[idx]
+            idx += 1
+            if not session_id:
+                ignored_convs += 1
+                continue
 
-    idx = next_index
-    while idx < total_convs and processed < nb:
-        obj = conv_lines[idx]
-        idx += 1
-        if not isinstance(obj, dict):
-            ignored_convs += 1
-            continue
-
-        session_id = extract_session_id_from_line(obj)
-        if not session_id:
-            ignored_convs += 1
-            continue
+            processed += 1
+            print(f"Traitement conversation {session_id} ({processed}/{nb}) ...")
 
-        processed += 1
-        print(f"Traitement conversation {session_id} ({processed}/{nb}) ...")
+            result = fetch_conversation(website_id, session_id, auth)
+            if result is None:
+                quota_reached = True
+                break
+            writer.submit((idx, result))
 
-        msg_file = MESS_DIR / f"{session_id}.jsonl"
+    if quota_reached:
+        # Sauvegarder l'état avant de quitter (les conversations précédentes sont écrites)
+        state["next_index"] = idx - 1  # reprendre sur cette conversation
+        save_state(state)
+        return
 
-        # Lire messages existants
-        existing = read_jsonl_file(msg_file)
-        existing_fps = {str(m.get("fingerprint")) for m in existing if m.get("fingerprint") is not None}
+    print_summary(processed, ignored_convs)
 
-        # Pagination: on commence sans timestamp_before, puis on utilise le plus ancien timestamp
-        more = True
-        page = 0
-        new_messages_acc: List[Dict[str, Any]] = []
-        oldest_ts: Optional[int] = None
 
-        while more:
-            resp = call_messages_api(website_id, session_id, auth, timestamp_before=oldest_ts)
-            page += 1
-            if resp is None:
-                print(f"Échec appel API pour {session_id}, arrêt de la conversation courante.")
-                break
+def process_queue(website_id: str, auth: Tuple[str, str], nb: int, reset: bool,
+                  worker_id: str, lease_seconds: float, order: str = "file") -> None:
+    """Boucle de traitement en mode file de travail partagée.
 
-            if resp.status_code == 429:
-                print("429 reçu: quota API atteint. Pause et arrêt du traitement.")
-                # Sauvegarder l'état avant de quitter
-                state["next_index"] = idx - 1  # reprendre sur cette conversation
-                save_state(state)
-                return
+    Chaque worker alimente la file avec les session_id du fichier de conversations
+    (les tâches déjà connues sont conservées), puis prend les tâches une à une.
+    Le bail est prolongé à chaque page reçue ; un bail expiré (worker mort) est
+    repris automatiquement par un autre worker.
 
-            if resp.status_code not in (200, 206):
-                print(f"Réponse inattendue pour {session_id}: {resp.status_code} {getattr(resp, 'text', '')}")
-                break
+    Hors ordre "file", chaque conversation reçoit une priorité (`task_priority`) et
+    les conversations déjà exportées mais actives depuis (ou toutes en ordre "stale")
+    sont remises en attente.
+    """
+    queue = WorkQueue(QUEUE_FILE, lease_seconds=lease_seconds)
+    if reset:
+        queue.reset()
+        print("File de travail réinitialisée (reset).")
+
+    if order == "file":
+        session_ids = read_session_ids()
+        ignored_convs = sum(1 for sid in session_ids if not sid)
+        added = queue.enqueue(sid for sid in session_ids if sid)
+        print(f"Worker {worker_id}: {added} nouvelles conversations ajoutées à la file.")
+    else:
+        infos, ignored_convs = read_schedule_infos()
+        synced = queue.sync_times() if order == "stale" else {}
+        counts = queue.schedule(
+            ((sid, task_priority(order, last, rank, synced.get(sid)), last) for sid, last, rank in infos),
+            reopen_done=(order == "stale"),
+        )
+        print(f"Worker {worker_id}: {counts['added']} nouvelles conversations ajoutées à la file, "
+              f"{counts['reopened']} à resynchroniser (ordre {order}).")
 
-            try:
-                data = resp.json()
-            except Exception:
-                print(f"Impossible de décoder JSON pour {session_id} page {page}.")
+    processed = 0
+    quota_reached = False
+    # index de l'archive, index plein texte et journal des changements ouverts une fois pour toute l'exécution
+    archive = query.ArchiveIndex(query.index_path_for(CONVS_FILE))
+    text_index = fulltext.FullTextIndex(fulltext.index_path_for(MESS_DIR))
+    feed = changefeed.ChangeFeed(changefeed.feed_path_for(CONVS_FILE))
+
+    def write_result(result: FetchedConversation) -> None:
+        sid = result.session_id
+        # le résultat a pu attendre dans la file d'écriture: prolonger le bail avant d'écrire,
+        # et ne rien écrire si la conversation a été reprise par un autre worker
+        if not queue.heartbeat(sid, worker_id):
+            print(f"Bail perdu pour {sid} avant l'écriture: résultat abandonné (repris par un autre worker).")
+            return
+        write_conversation(result, archive, text_index, feed)
+        # la tâche n'est terminée qu'une fois le fichier écrit
+        if not queue.complete(sid, worker_id):
+            print(f"Bail perdu pour {sid} pendant l'écriture: la conversation sera retraitée.")
+
+    with BackgroundWriter(write_result) as writer:
+        while processed < nb:
+            session_id = queue.claim(worker_id)
+            if session_id is None:
+                print("File de travail vide.")
                 break
 
-            # La réponse peut être une liste de messages ou un dict contenant 'data'
-            page_items: List[Dict[str, Any]] = []
-            if isinstance(data, dict) and "data" in data and isinstance(data["data"], list):
-                page_items = data["data"]
-            elif isinstance(data, list):
-                page_items = data
-            else:
-                # pas de messages
-                page_items = []
-
-            if not page_items:
-                # pas de nouveaux messages sur cette page -> fin de pagination
-                break
+            processed += 1
+            print(f"Traitement conversation {session_id} ({processed}/{nb}) [worker {worker_id}] ...")
 
-            # Ajouter messages non présents (par fingerprint)
-            added = 0
-            ignored = 0
-            for m in page_items:
-                fp = m.get("fingerprint")
-                if fp is None:
-                    ignored += 1
-                    continue
-                if str(fp) in existing_fps:
-                    ignored += 1
-                    continue
-                new_messages_acc.append(m)
-                existing_fps.add(str(fp))
-                added += 1
+            def heartbeat(sid: str = session_id) -> None:
+                if not queue.heartbeat(sid, worker_id):
+                    print(f"Bail perdu pour {sid} (expiré et repris par un autre worker).")
 
-            # Mettre à jour oldest_ts pour pagination suivante: on prend le timestamp le plus petit
-            try:
-                ts_vals = [int(m.get("timestamp", 0)) for m in page_items if m.get("timestamp") is not None]
-                if ts_vals:
-                    min_ts = min(ts_vals)
-                    # Pour éviter de récupérer le même message, on demande timestamp_before = min_ts
-                    # l'API retourne les messages strictement inférieurs à ce timestamp selon doc
-                    oldest_ts = min_ts
-            except Exception:
-                pass
+            result = fetch_conversation(website_id, session_id, auth, on_page=heartbeat)
+            if result is None:
+                # Rendre la tâche pour qu'elle soit reprise plus tard
+                queue.release(session_id, worker_id)
+                quota_reached = True
+                break
+            writer.submit(result)
 
-            # Petite pause pour limiter la rapidité des appels
-            time.sleep(0.05)
+    if quota_reached:
+        return
 
-            # Si l'API a retourné moins de 1 élément (ou aucun), on stoppe. Sinon on boucle.
-            # Ici on laisse la boucle se terminer naturellement si la prochaine page est vide.
+    counts = queue.counts()
+    print(f"État de la file: {counts.get('done', 0)} terminées, {counts.get('pending', 0)} en attente, "
+          f"{counts.get('leased', 0)} en cours.")
+    print_summary(processed, ignored_convs)
 
-        # Si on a récupéré des messages, fusionner et écrire
-        if new_messages_acc:
-            merged = merge_and_sort_messages(existing, new_messages_acc)
-            write_jsonl_file(msg_file, merged)
-            print(f"Conversation {session_id}: {len(new_messages_acc)} messages ajoutés, {len(existing)} messages existants.")
-        else:
-            # Aucun nouveau message -> si fichier n'existait pas, créer un fichier vide
-            if not msg_file.exists() and existing:
-                write_jsonl_file(msg_file, existing)
-            elif not msg_file.exists():
-                # créer au moins un fichier vide
-                write_jsonl_file(msg_file, [])
-            print(f"Conversation {session_id}: aucun nouveau message.")
-
-        # Sauvegarder l'état: prochaine conversation
-        state["next_index"] = idx
-        save_state(state)
 
+def print_summary(processed: int, ignored_convs: int) -> None:
+    """Affiche le récapitulatif de fin d'exécution."""
     # Rapport final
     print("--- Récapitulatif ---")
     print(f"Conversations traitées cette exécution: {processed}")
@@ -352,9 +639,23 @@ def main():
     parser = argparse.ArgumentParser(description="Exporter les messages Crisp par conversation en JSONL")
     parser.add_argument("--nb", type=int, default=50, help="Nombre max de conversations à traiter (défaut 50)")
     parser.add_argument("--reset", action="store_true", help="Réinitialiser le fichier d'état et repartir du début")
+    parser.add_argument("--queue", action="store_true",
+                        help="Utiliser la file de travail partagée (plusieurs workers en parallèle)")
+    parser.add_argument("--worker-id", default=None, help="Identifiant du worker en mode --queue (défaut: machine:pid)")
+    parser.add_argument("--lease", type=float, default=DEFAULT_LEASE_SECONDS,
+                        help=f"Durée du bail en secondes en mode --queue (défaut {DEFAULT_LEASE_SECONDS:.0f})")
+    parser.add_argument("--order", choices=ORDERS, default="file",
+                        help="Ordre de traitement: file (ordre du fichier, défaut), recent (activité récente "
+                             "d'abord), open (non lues/non résolues d'abord), stale (synchronisées il y a le "
+                             "plus longtemps d'abord). Hors file, utilise la file de travail.")
+    crisp_api.add_arguments(parser)
+    projection.add_arguments(parser)
     args = parser.parse_args()
+    crisp_api.configure_from_args(args)
+    projection.configure_from_args(args)
 
-    process_conversations(nb=args.nb, reset=args.reset)
+    process_conversations(nb=args.nb, reset=args.reset, use_queue=args.queue,
+                          worker_id=args.worker_id, lease_seconds=args.lease, order=args.order)
 
 
 if __name__ == "__main__":
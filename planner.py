@@ -0,0 +1,260 @@
+#!/usr/bin/env python3
+"""
+planner.py
+
+Planification d'un budget de requêtes API entre les trois étapes de l'export
+(conv.py, mess.py, users.py).
+
+Les limites `--nb` comptent des conversations ou des utilisateurs, pas des
+requêtes: un run de mess.py peut épuiser le quota du jour à mi-parcours. Le
+planificateur estime, depuis l'état local, le travail restant de chaque étape
+et son coût en requêtes:
+- conv  : curseur de pagination (`next_page`) et dernière page atteinte
+  (`complete`) dans l'état de conv.py ; une page rapporte jusqu'à 20
+  conversations (moyenne observée: conversations du fichier / pages lues).
+  Une fois la dernière page atteinte, les nouvelles conversations (et les
+  conversations modifiées) sont relevées par `conv.py --upsert`, qui relit
+  une fenêtre de pages depuis la page 1: conv reçoit une part de relecture
+  d'au plus --upsert-pages pages
+- mess  : conversations restantes après `next_index` (état de mess.py) ;
+  pages et messages ajoutés par conversation d'après les récupérations
+  enregistrées par mess.py (table `fetches` de query.py), à défaut d'après
+  les fichiers de messages déjà présents
+- users : emails des conversations absents de l'index des emails (même
+  périmé: users.py le reconstruit à son prochain run) ; une requête par profil
+
+Le budget total est réparti par rendement décroissant (nouveaux
+enregistrements par requête), chaque étape recevant au plus ce qu'il lui faut.
+Tant que la dernière page n'est pas atteinte, le besoin de conv est inconnu:
+sa part est plafonnée à OPEN_ENDED_SHARE du budget, pour ne pas priver mess
+et users. Les étapes sont ensuite lancées dans l'ordre conv, mess, users (les
+conversations récupérées alimentent les étapes suivantes), chacune avec
+`--max-requests` (voir crisp_api.py): une fois sa part épuisée, l'étape
+s'arrête comme sur un 429.
+
+L'estimation ne fait que lire l'état local (`--dry-run` ne crée ni ne modifie
+aucun fichier). Seules les options communes aux trois étapes (crisp_api.py,
+projection.py) sont transmises ; une option propre à une étape (`--upsert`,
+`--order`, `--refresh`...) est refusée.
+
+    python3 planner.py --budget 2000 --dry-run     # estimer sans appeler l'API
+    python3 planner.py --budget 2000               # lancer les étapes
+    python3 planner.py --budget 2000 --cache on --retries 5   # options transmises aux étapes
+
+Commentaires en français.
+"""
+
+import argparse
+import math
+import subprocess
+import sys
+from pathlib import Path
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+import conv
+import crisp_api
+import mess
+import projection
+import query
+import users
+from emailindex import EmailIndex, index_path_for as email_index_path_for
+
+ROOT = Path(__file__).resolve().parent
+
+STAGES = ("conv", "mess", "users")
+
+# Conversations par page de l'API (per_page=20 dans conv.py)
+CONV_PAGE_SIZE = 20
+# Sans statistique enregistrée: une page de messages puis la page vide qui termine la pagination
+DEFAULT_PAGES_PER_CONVERSATION = 2.0
+DEFAULT_MESSAGES_PER_CONVERSATION = 10.0
+# Part max du budget pour une étape au travail restant inconnu (conv avant la dernière page)
+OPEN_ENDED_SHARE = 0.25
+# Conversations nouvelles ou modifiées attendues par page relue en --upsert (estimation prudente)
+CONV_REFRESH_YIELD = 0.5
+
+
+class StageEstimate(NamedTuple):
+    stage: str
+    pending: Optional[int]       # unités restantes (conversations, emails) ; None si inconnu
+    requests: Optional[int]      # requêtes pour tout traiter ; None si illimité
+    cost: float                  # requêtes par unité (page, conversation, email)
+    yield_per_request: float     # nouveaux enregistrements par requête
+    upsert: bool = False         # conv: relecture (--upsert) au lieu de la suite de la pagination
+
+
+class StagePlan(NamedTuple):
+    stage: str
+    requests: int                # part du budget
+    nb: int                      # valeur de --nb transmise à l'étape
+    expected: int                # nouveaux enregistrements attendus
+    options: Tuple[str, ...] = ()  # options propres à l'étape (--upsert de conv)
+
+
+def count_lines(path: Path, chunk_bytes: int = 1024 * 1024) -> int:
+    """Nombre de lignes d'un fichier (0 s'il est absent), sans décoder le JSON."""
+    if not path.exists():
+        return 0
+    count = 0
+    with path.open("rb") as f:
+        while True:
+            chunk = f.read(chunk_bytes)
+            if not chunk:
+                return count
+            count += chunk.count(b"\n")
+
+
+def estimate_conv() -> StageEstimate:
+    """Pages restantes de conv.py: illimitées tant que la dernière page n'est pas atteinte,
+    ensuite une fenêtre de relecture (--upsert) depuis la page 1.
+    """
+    state = conv.load_state()
+    pages_read = int(state.get("next_page", 1)) - 1
+    per_page = float(CONV_PAGE_SIZE)
+    count = count_lines(conv.CONV_FILE)
+    if pages_read > 0 and count:
+        per_page = min(per_page, count / pages_read)
+    if state.get("complete"):
+        # dernière page atteinte: les nouvelles conversations arrivent en tête de liste,
+        # relevées par la relecture --upsert (au plus une fenêtre de pages par run)
+        pages = conv.DEFAULT_UPSERT_PAGES
+        return StageEstimate("conv", pages, pages, 1.0, CONV_REFRESH_YIELD, upsert=True)
+    return StageEstimate("conv", None, None, 1.0, per_page)
+
+
+def estimate_mess() -> StageEstimate:
+    """Conversations restantes pour mess.py (ordre du fichier) et coût moyen en pages."""
+    session_ids = mess.read_session_ids() if mess.CONVS_FILE.exists() else []
+    next_index = int(mess.load_state().get("next_index", 0))
+    pending = sum(1 for sid in session_ids[next_index:] if sid)
+
+    fetches = pages = added = files = messages = 0
+    path = query.index_path_for(mess.CONVS_FILE)
+    if path.exists():
+        # lecture seule: l'estimation ne crée pas l'index
+        index = query.ArchiveIndex(path, readonly=True)
+        fetches, pages, added = index.fetch_totals(first_only=True)
+        if not fetches:
+            fetches, pages, added = index.fetch_totals()
+        if not (fetches and pages):
+            files, messages = index.message_totals()
+    if fetches and pages:
+        cost = pages / fetches
+        per_conversation = added / fetches
+    else:
+        cost = DEFAULT_PAGES_PER_CONVERSATION
+        per_conversation = messages / files if files else DEFAULT_MESSAGES_PER_CONVERSATION
+    return StageEstimate("mess", pending, math.ceil(pending * cost), cost, per_conversation / cost)
+
+
+def estimate_users() -> StageEstimate:
+    """Emails des conversations sans profil exporté: une requête chacun."""
+    emails = users.load_emails_from_conversations()
+    # index lu tel quel, même périmé (reconstruit au prochain run de users.py): une estimation
+    # ne relit pas tout le fichier utilisateurs
+    with EmailIndex(email_index_path_for(users.USERS_FILE)) as index:
+        pending = sum(1 for email in emails if email not in index)
+    return StageEstimate("users", pending, pending, 1.0, 1.0)
+
+
+def estimate() -> List[StageEstimate]:
+    return [estimate_conv(), estimate_mess(), estimate_users()]
+
+
+def allocate(estimates: List[StageEstimate], budget: int) -> Dict[str, StagePlan]:
+    """Répartit le budget par rendement décroissant, chaque étape limitée à son besoin estimé
+    (besoin inconnu: au plus OPEN_ENDED_SHARE du budget).
+    """
+    plans = {e.stage: StagePlan(e.stage, 0, 0, 0) for e in estimates}
+    remaining = budget
+    for e in sorted(estimates, key=lambda e: e.yield_per_request, reverse=True):
+        if remaining <= 0 or e.yield_per_request <= 0:
+            continue
+        need = e.requests if e.requests is not None else max(1, int(budget * OPEN_ENDED_SHARE))
+        share = min(remaining, need)
+        if share <= 0:
+            continue
+        remaining -= share
+        # --nb: unités couvertes par la part (au moins une), sans dépasser le travail restant
+        nb = max(1, int(share / e.cost))
+        if e.pending is not None:
+            nb = min(nb, e.pending)
+        options: Tuple[str, ...] = ()
+        if e.stage == "conv":
+            if e.upsert:
+                options = ("--upsert", "--upsert-pages", str(nb))
+            nb *= CONV_PAGE_SIZE
+        plans[e.stage] = StagePlan(e.stage, share, nb, int(share * e.yield_per_request), options)
+    return plans
+
+
+def stage_command(plan: StagePlan, extra: List[str]) -> List[str]:
+    """Ligne de commande d'une étape: --nb, --max-requests et ses options propres, plus les
+    options transmises.
+    """
+    return [sys.executable, str(ROOT / f"{plan.stage}.py"), "--nb", str(plan.nb),
+            "--max-requests", str(plan.requests)] + list(plan.options) + extra
+
+
+def stage_options(extra: List[str]) -> List[str]:
+    """Options à transmettre aux étapes: uniquement les options communes aux trois
+    scripts (crisp_api.py, projection.py), hors --max-requests fixé par le plan.
+    Lève ValueError sur une autre option.
+    """
+    parser = argparse.ArgumentParser(add_help=False)
+    crisp_api.add_arguments(parser)
+    projection.add_arguments(parser)
+    args, rejected = parser.parse_known_args(extra)
+    if rejected:
+        raise ValueError(f"options non communes aux étapes: {' '.join(rejected)}")
+    if args.max_requests is not None:
+        raise ValueError("--max-requests est fixé par le plan (utiliser --budget)")
+    return extra
+
+
+def print_plan(estimates: List[StageEstimate], plans: Dict[str, StagePlan], budget: int) -> None:
+    print(f"Budget: {budget} requêtes")
+    print("étape\trestant\trequêtes estimées\trendement/requête\tpart\t--nb\tattendus")
+    for e in estimates:
+        p = plans[e.stage]
+        pending = "?" if e.pending is None else str(e.pending)
+        needed = "?" if e.requests is None else str(e.requests)
+        stage = f"{e.stage} (upsert)" if e.upsert else e.stage
+        print(f"{stage}\t{pending}\t{needed}\t{e.yield_per_request:.2f}\t{p.requests}\t{p.nb}\t{p.expected}")
+    unused = budget - sum(p.requests for p in plans.values())
+    if unused > 0:
+        print(f"Requêtes non attribuées (travail restant épuisé ou part plafonnée): {unused}")
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Répartir un budget de requêtes API entre conv.py, mess.py et users.py",
+        epilog="Les options communes (ex: --cache on, --retries 5, --projection F) sont transmises à chaque étape.")
+    parser.add_argument("--budget", type=int, required=True, help="Nombre total de requêtes API autorisées")
+    parser.add_argument("--dry-run", action="store_true", help="Afficher l'estimation et le plan sans lancer les étapes")
+    args, extra = parser.parse_known_args()
+    try:
+        extra = stage_options(extra)
+    except ValueError as e:
+        parser.error(str(e))
+
+    estimates = estimate()
+    plans = allocate(estimates, args.budget)
+    print_plan(estimates, plans, args.budget)
+    if args.dry_run:
+        return
+
+    for stage in STAGES:
+        plan = plans[stage]
+        if plan.requests <= 0:
+            continue
+        command = stage_command(plan, extra)
+        print(f"--- {stage}: {' '.join(command[1:])}")
+        result = subprocess.run(command, cwd=str(ROOT))
+        if result.returncode != 0:
+            print(f"Étape {stage} terminée en erreur (code {result.returncode}), arrêt.")
+            sys.exit(result.returncode)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,277 @@
+#!/usr/bin/env python3
+"""
+projection.py
+
+Projection des enregistrements à l'ingestion: conv.py, mess.py et users.py ne
+stockent que les champs utiles des conversations, messages et profils, au lieu
+de la réponse complète de l'API. Les fichiers JSONL « chauds » sont plus petits
+et chaque réécriture, fusion ou lecture plus rapide.
+
+Spécification (fichier JSON passé avec `--projection`): chemins de champs
+(séparés par des points) par type d'enregistrement, un type absent étant gardé
+en entier:
+
+    {
+      "conversation": ["meta.nickname", "meta.segments", "last_message"],
+      "message": ["user.nickname"],
+      "profile": ["data.person.nickname", "data.company.name"]
+    }
+
+Un chemin qui traverse une liste s'applique à chacun de ses éléments. Les champs
+dont dépendent les scripts et les index (REQUIRED_FIELDS: session_id,
+active.last, meta.email, fingerprint, timestamp, content, email...) sont
+toujours gardés.
+
+Avec `--cold`, les parties écartées sont ajoutées à un fichier « froid » à côté
+du fichier chaud (rien n'est perdu), une ligne par enregistrement:
+`{"type": ..., "id": ..., "data": {...}}` avec les mêmes identifiants que le
+journal des changements (changefeed.py):
+- `/conversations/conversations.cold.jsonl` (id: session_id)
+- `/conversations/messages.cold.jsonl` (id: `session_id:fingerprint`)
+- `/utilisateurs/utilisateurs.cold.jsonl` (id: email en minuscules)
+
+Reconstitution des enregistrements complets (chaud + froid, dernière version
+froide de chaque identifiant):
+    python3 projection.py restore --type conversation > conversations.complet.jsonl
+
+Commentaires en français.
+"""
+
+import argparse
+import sys
+from pathlib import Path
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+import jsoncodec
+from records import extract_email_from_person, extract_session_id
+
+ROOT = Path(__file__).resolve().parent
+
+# Emplacements par défaut (peuvent être patchés par les tests via monkeypatch)
+CONVS_FILE = ROOT / "conversations" / "conversations.jsonl"
+MESS_DIR = ROOT / "conversations" / "messages"
+USERS_FILE = ROOT / "utilisateurs" / "utilisateurs.jsonl"
+
+RECORD_TYPES = ("conversation", "message", "profile")
+
+# Champs lus par conv.py, mess.py, users.py, query.py, fulltext.py et columnar.py
+REQUIRED_FIELDS = {
+    "conversation": ("session_id", "id", "_id", "data.session_id", "meta.email", "data.meta.email",
+                     "active.last", "state", "unread.operator", "created_at", "updated_at"),
+    "message": ("session_id", "fingerprint", "timestamp", "from", "type", "origin", "content"),
+    "profile": ("email", "data.email"),
+}
+
+# Valeur absente (distincte de None, qui est une valeur JSON)
+_MISSING = object()
+
+
+def _build_tree(paths: Iterable[str]) -> Dict[str, Any]:
+    """Arbre des chemins: {"meta": {"email": True}} pour "meta.email" (True = champ gardé en entier)."""
+    tree: Dict[str, Any] = {}
+    for path in paths:
+        if not isinstance(path, str) or not path or "" in path.split("."):
+            raise ValueError(f"Chemin de champ invalide: {path!r}")
+        node = tree
+        parts = path.split(".")
+        for part in parts[:-1]:
+            child = node.get(part)
+            if child is True:
+                break
+            node = node.setdefault(part, {})
+        else:
+            node[parts[-1]] = True
+    return tree
+
+
+def _split(value: Any, tree: Any) -> Tuple[Any, Any]:
+    """Sépare une valeur en (partie gardée, partie écartée), _MISSING si vide."""
+    if tree is True:
+        return value, _MISSING
+    if isinstance(value, dict):
+        hot: Dict[str, Any] = {}
+        cold: Dict[str, Any] = {}
+        for key, item in value.items():
+            sub = tree.get(key)
+            if sub is None:
+                cold[key] = item
+                continue
+            h, c = _split(item, sub)
+            if h is not _MISSING:
+                hot[key] = h
+            if c is not _MISSING:
+                cold[key] = c
+        return (hot if hot or not value else _MISSING), (cold if cold else _MISSING)
+    if isinstance(value, list):
+        parts = [_split(item, tree) for item in value]
+        if all(c is _MISSING for _, c in parts):
+            return value, _MISSING
+        # listes alignées par position (None pour un élément sans partie gardée ou écartée)
+        hot_list = [None if h is _MISSING else h for h, _ in parts]
+        cold_list = [None if c is _MISSING else c for _, c in parts]
+        return hot_list, cold_list
+    # scalaire là où la spécification attend un objet: gardé tel quel
+    return value, _MISSING
+
+
+def merge(hot: Any, cold: Any) -> Any:
+    """Reconstitue un enregistrement à partir de ses parties chaude et froide."""
+    if cold is None:
+        return hot
+    if isinstance(hot, dict) and isinstance(cold, dict):
+        merged = dict(hot)
+        for key, value in cold.items():
+            merged[key] = merge(merged[key], value) if key in merged else value
+        return merged
+    if isinstance(hot, list) and isinstance(cold, list):
+        return [merge(h, c) if h is not None else c for h, c in zip(hot, cold)]
+    return hot
+
+
+class Projection:
+    """Chemins de champs gardés par type d'enregistrement (champs requis toujours inclus)."""
+
+    def __init__(self, spec: Dict[str, Iterable[str]]):
+        self.trees: Dict[str, Dict[str, Any]] = {}
+        for record_type, paths in spec.items():
+            if record_type not in RECORD_TYPES:
+                raise ValueError(f"Type d'enregistrement inconnu: {record_type}")
+            if isinstance(paths, str):
+                raise ValueError(f"Liste de chemins attendue pour {record_type}")
+            self.trees[record_type] = _build_tree(list(REQUIRED_FIELDS[record_type]) + list(paths))
+
+    @classmethod
+    def load(cls, path: Path) -> "Projection":
+        spec = jsoncodec.loads(Path(path).read_bytes())
+        if not isinstance(spec, dict):
+            raise ValueError("La spécification de projection doit être un objet JSON")
+        return cls(spec)
+
+    def split(self, record_type: str, obj: Dict[str, Any]) -> Tuple[Dict[str, Any], Optional[Dict[str, Any]]]:
+        """Retourne (enregistrement projeté, partie écartée ou None)."""
+        tree = self.trees.get(record_type)
+        if tree is None or not isinstance(obj, dict):
+            return obj, None
+        hot, cold = _split(obj, tree)
+        return (hot if hot is not _MISSING else {}), (cold if cold is not _MISSING else None)
+
+
+def cold_path_for(hot_path: Path) -> Path:
+    """Fichier froid d'un fichier (ou dossier de messages) chaud: `x.jsonl` -> `x.cold.jsonl`."""
+    return hot_path.with_name(hot_path.stem + ".cold.jsonl")
+
+
+def append_cold(path: Path, record_type: str, parts: Iterable[Tuple[str, Dict[str, Any]]]) -> int:
+    """Ajoute les parties écartées (id, données) au fichier froid. Retourne le nombre de lignes."""
+    lines = [jsoncodec.dumpb({"type": record_type, "id": record_id, "data": data})
+             for record_id, data in parts]
+    if lines:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with path.open("ab") as f:
+            f.write(b"\n".join(lines) + b"\n")
+    return len(lines)
+
+
+def read_cold(path: Path, record_type: Optional[str] = None) -> Dict[str, Dict[str, Any]]:
+    """Dernière partie écartée de chaque identifiant (lignes malformées ignorées)."""
+    parts: Dict[str, Dict[str, Any]] = {}
+    if not path.exists():
+        return parts
+    with path.open("rb") as f:
+        for line in f:
+            try:
+                obj = jsoncodec.loads(line)
+            except ValueError:
+                continue
+            if isinstance(obj, dict) and (record_type is None or obj.get("type") == record_type):
+                parts[str(obj.get("id"))] = obj.get("data")
+    return parts
+
+
+# Projection active pour les appels suivants à split() (aucune par défaut)
+_projection: Optional[Projection] = None
+_keep_cold = False
+
+
+def configure(spec_path: Optional[Path] = None, cold: bool = False) -> None:
+    """Active la projection décrite par `spec_path` (None: enregistrements gardés en entier)."""
+    global _projection, _keep_cold
+    _projection = Projection.load(spec_path) if spec_path is not None else None
+    _keep_cold = cold
+
+
+def split(record_type: str, obj: Dict[str, Any]) -> Tuple[Dict[str, Any], Optional[Dict[str, Any]]]:
+    """Applique la projection active: (enregistrement à stocker, partie écartée ou None)."""
+    if _projection is None:
+        return obj, None
+    return _projection.split(record_type, obj)
+
+
+def write_cold(hot_path: Path, record_type: str, parts: Iterable[Tuple[str, Optional[Dict[str, Any]]]]) -> int:
+    """Ajoute les parties écartées au fichier froid de `hot_path` si `--cold` est actif."""
+    if not _keep_cold:
+        return 0
+    return append_cold(cold_path_for(hot_path), record_type,
+                       ((record_id, data) for record_id, data in parts if data is not None))
+
+
+def add_arguments(parser: argparse.ArgumentParser) -> None:
+    """Ajoute les options de projection au parser d'un script."""
+    parser.add_argument("--projection", type=Path, default=None,
+                        help="Spécification JSON des champs à garder par type d'enregistrement")
+    parser.add_argument("--cold", action="store_true",
+                        help="Garder les champs écartés par la projection dans un fichier .cold.jsonl")
+
+
+def configure_from_args(args: argparse.Namespace) -> None:
+    """Applique les options ajoutées par add_arguments()."""
+    configure(args.projection, args.cold)
+
+
+def _restored_lines(record_type: str) -> Iterator[Dict[str, Any]]:
+    """Enregistrements complets d'un type, dans l'ordre des fichiers chauds."""
+    if record_type == "conversation":
+        sources: List[Tuple[Path, Any]] = [(CONVS_FILE, extract_session_id)]
+        cold = read_cold(cold_path_for(CONVS_FILE), record_type)
+    elif record_type == "message":
+        sources = [(path, lambda m, sid=path.stem: f"{sid}:{m.get('fingerprint')}")
+                   for path in sorted(MESS_DIR.glob("*.jsonl"))] if MESS_DIR.exists() else []
+        cold = read_cold(cold_path_for(MESS_DIR), record_type)
+    else:
+        def record_id(p: Dict[str, Any]) -> Optional[str]:
+            email = extract_email_from_person(p)
+            return email.lower() if email else None
+        sources = [(USERS_FILE, record_id)]
+        cold = read_cold(cold_path_for(USERS_FILE), record_type)
+
+    for path, identify in sources:
+        if not path.exists():
+            continue
+        with path.open("rb") as f:
+            for line in f:
+                try:
+                    obj = jsoncodec.loads(line)
+                except ValueError:
+                    continue
+                yield merge(obj, cold.get(str(identify(obj)))) if isinstance(obj, dict) else obj
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Projection des enregistrements de l'archive Crisp")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p_restore = sub.add_parser("restore", help="Écrire les enregistrements complets (chaud + froid) en JSONL")
+    p_restore.add_argument("--type", choices=RECORD_TYPES, required=True, help="Type d'enregistrement")
+    sub.add_parser("required", help="Afficher les champs toujours gardés par type")
+    args = parser.parse_args()
+
+    if args.command == "required":
+        for record_type in RECORD_TYPES:
+            print(f"{record_type}\t{', '.join(REQUIRED_FIELDS[record_type])}")
+        return
+    out = sys.stdout
+    for obj in _restored_lines(args.type):
+        out.write(jsoncodec.dumps(obj) + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,462 @@
+#!/usr/bin/env python3
+"""
+query.py
+
+Index persistants et requêtes locales sur l'archive exportée.
+
+Index maintenus au fil de l'eau par conv.py, mess.py et users.py:
+- `/conversations/archive.index.sqlite` :
+  - `sessions` : session_id -> email, active.last (écrit par conv.py)
+  - `message_files` : session_id -> fichier de messages, nombre de messages,
+    timestamps extrêmes (écrit par mess.py)
+  - `fetches` : session_id -> pages d'API appelées et messages ajoutés lors de
+    la dernière récupération (écrit par mess.py, lu par planner.py)
+- `/utilisateurs/utilisateurs.jsonl.index.sqlite`, table `profiles` : email ->
+  position (offset, longueur) du profil dans utilisateurs.jsonl (réécrit par
+  users.py à chaque réécriture du fichier)
+- `/conversations/messages/.index/{session_id}.idx` : pour chaque message du
+  fichier (trié du plus récent au plus ancien), le triplet int64
+  (timestamp, offset, longueur). Une plage de dates se résout par recherche
+  dichotomique dans ce fichier (memory-map) puis lecture directe des lignes.
+
+Exemples:
+    python3 query.py sessions --email client@example.com
+    python3 query.py messages --email client@example.com --since 2024-01-01 --until 2024-02-01
+    python3 query.py profile --email client@example.com
+    python3 query.py rebuild        # reconstruire les index depuis les fichiers existants
+
+Commentaires en français.
+"""
+
+import argparse
+import mmap
+import os
+import sqlite3
+import sys
+import time
+from array import array
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+import jsoncodec
+from records import conversation_last, extract_email_from_conv, extract_email_from_person, extract_session_id_from_line
+
+
+ROOT = Path(__file__).resolve().parent
+
+# Emplacements par défaut (peuvent être patchés par les tests via monkeypatch)
+CONVS_FILE = ROOT / "conversations" / "conversations.jsonl"
+MESS_DIR = ROOT / "conversations" / "messages"
+USERS_FILE = ROOT / "utilisateurs" / "utilisateurs.jsonl"
+
+INDEX_NAME = "archive.index.sqlite"
+MESSAGE_INDEX_DIR = ".index"
+
+INDEX_SCHEMA = """
+CREATE TABLE IF NOT EXISTS sessions (
+    session_id  TEXT PRIMARY KEY,
+    email       TEXT,
+    active_last INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS sessions_email ON sessions (email, active_last);
+CREATE TABLE IF NOT EXISTS message_files (
+    session_id TEXT PRIMARY KEY,
+    path       TEXT NOT NULL,
+    count      INTEGER NOT NULL,
+    newest     INTEGER,
+    oldest     INTEGER
+);
+CREATE TABLE IF NOT EXISTS fetches (
+    session_id TEXT PRIMARY KEY,
+    pages      INTEGER NOT NULL,
+    existing   INTEGER NOT NULL,
+    added      INTEGER NOT NULL,
+    fetched_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS profiles (
+    email  TEXT PRIMARY KEY,
+    offset INTEGER NOT NULL,
+    length INTEGER NOT NULL
+);
+"""
+
+
+def normalize_email(email: str) -> str:
+    return email.strip().lower()
+
+
+def index_path_for(convs_file: Path) -> Path:
+    """Chemin de l'index SQLite, placé à côté du fichier de conversations."""
+    return convs_file.parent / INDEX_NAME
+
+
+def profile_index_path_for(users_file: Path) -> Path:
+    """Chemin de l'index des profils, placé à côté du fichier utilisateurs."""
+    return users_file.with_name(users_file.name + ".index.sqlite")
+
+
+class ArchiveIndex:
+    """Index SQLite de l'archive (sessions par email, fichiers de messages, profils)."""
+
+    def __init__(self, path: Path, readonly: bool = False):
+        """`readonly`: index existant ouvert en lecture seule (ni création, ni schéma)."""
+        self.path = Path(path)
+        self.readonly = readonly
+        if readonly:
+            return
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        conn = self._connect()
+        try:
+            conn.executescript(INDEX_SCHEMA)
+        finally:
+            conn.close()
+
+    def _connect(self) -> sqlite3.Connection:
+        if self.readonly:
+            return sqlite3.connect(f"{self.path.resolve().as_uri()}?mode=ro", uri=True, timeout=30)
+        return sqlite3.connect(str(self.path), timeout=30)
+
+    def update_sessions(self, rows: Iterable[Tuple[str, Optional[str], int]]) -> None:
+        """Ajoute ou met à jour des conversations (session_id, email, active.last)."""
+        conn = self._connect()
+        try:
+            with conn:
+                conn.executemany(
+                    "INSERT OR REPLACE INTO sessions (session_id, email, active_last) VALUES (?, ?, ?)",
+                    ((sid, normalize_email(email) if email else None, last) for sid, email, last in rows),
+                )
+        finally:
+            conn.close()
+
+    def sessions_for_email(self, email: str) -> List[Tuple[str, int]]:
+        """Conversations d'un email (session_id, active.last), les plus récentes d'abord."""
+        conn = self._connect()
+        try:
+            return conn.execute(
+                "SELECT session_id, active_last FROM sessions WHERE email = ? ORDER BY active_last DESC",
+                (normalize_email(email),),
+            ).fetchall()
+        finally:
+            conn.close()
+
+    def last_activity_by_email(self) -> Dict[str, int]:
+        """Dernière activité (active.last max) de chaque email."""
+        conn = self._connect()
+        try:
+            return dict(conn.execute(
+                "SELECT email, MAX(active_last) FROM sessions WHERE email IS NOT NULL GROUP BY email"
+            ))
+        finally:
+            conn.close()
+
+    def set_message_file(self, session_id: str, path: Path, count: int,
+                         newest: Optional[int], oldest: Optional[int]) -> None:
+        conn = self._connect()
+        try:
+            with conn:
+                conn.execute(
+                    "INSERT OR REPLACE INTO message_files (session_id, path, count, newest, oldest)"
+                    " VALUES (?, ?, ?, ?, ?)",
+                    (session_id, str(path), count, newest, oldest),
+                )
+        finally:
+            conn.close()
+
+    def message_file(self, session_id: str) -> Optional[Tuple[Path, int, Optional[int], Optional[int]]]:
+        """Fichier de messages d'une session (chemin, nombre, plus récent, plus ancien)."""
+        conn = self._connect()
+        try:
+            row = conn.execute(
+                "SELECT path, count, newest, oldest FROM message_files WHERE session_id = ?", (session_id,)
+            ).fetchone()
+        finally:
+            conn.close()
+        if row is None:
+            return None
+        return Path(row[0]), row[1], row[2], row[3]
+
+    def record_fetch(self, session_id: str, pages: int, existing: int, added: int) -> None:
+        """Enregistre une récupération de messages (pages appelées, messages déjà présents et ajoutés)."""
+        conn = self._connect()
+        try:
+            with conn:
+                conn.execute(
+                    "INSERT OR REPLACE INTO fetches (session_id, pages, existing, added, fetched_at)"
+                    " VALUES (?, ?, ?, ?, ?)",
+                    (session_id, pages, existing, added, time.time()),
+                )
+        finally:
+            conn.close()
+
+    def fetch_totals(self, first_only: bool = False) -> Tuple[int, int, int]:
+        """Nombre de récupérations, total des pages et des messages ajoutés
+        (`first_only`: premières récupérations seulement, sans message déjà présent).
+        """
+        sql = "SELECT COUNT(*), COALESCE(SUM(pages), 0), COALESCE(SUM(added), 0) FROM fetches"
+        if first_only:
+            sql += " WHERE existing = 0"
+        conn = self._connect()
+        try:
+            return tuple(conn.execute(sql).fetchone())
+        finally:
+            conn.close()
+
+    def message_totals(self) -> Tuple[int, int]:
+        """Nombre de fichiers de messages indexés et total de leurs messages."""
+        conn = self._connect()
+        try:
+            return tuple(conn.execute("SELECT COUNT(*), COALESCE(SUM(count), 0) FROM message_files").fetchone())
+        finally:
+            conn.close()
+
+    def replace_profiles(self, entries: Iterable[Tuple[str, int, int]]) -> None:
+        """Remplace toutes les positions de profils (email, offset, longueur)."""
+        conn = self._connect()
+        try:
+            with conn:
+                conn.execute("DELETE FROM profiles")
+                conn.executemany(
+                    "INSERT OR REPLACE INTO profiles (email, offset, length) VALUES (?, ?, ?)",
+                    ((normalize_email(e), off, length) for e, off, length in entries),
+                )
+        finally:
+            conn.close()
+
+    def set_profile(self, email: str, offset: int, length: int) -> None:
+        """Ajoute ou remplace la position d'un profil (profil ajouté en fin de fichier)."""
+        conn = self._connect()
+        try:
+            with conn:
+                conn.execute(
+                    "INSERT OR REPLACE INTO profiles (email, offset, length) VALUES (?, ?, ?)",
+                    (normalize_email(email), offset, length),
+                )
+        finally:
+            conn.close()
+
+    def profile_location(self, email: str) -> Optional[Tuple[int, int]]:
+        conn = self._connect()
+        try:
+            return conn.execute(
+                "SELECT offset, length FROM profiles WHERE email = ?", (normalize_email(email),)
+            ).fetchone()
+        finally:
+            conn.close()
+
+
+# --- Index de timestamps par session -------------------------------------------------
+
+def message_index_path(msg_file: Path) -> Path:
+    return msg_file.parent / MESSAGE_INDEX_DIR / (msg_file.stem + ".idx")
+
+
+def write_message_index(msg_file: Path, entries: Iterable[Tuple[int, int, int]]) -> None:
+    """Écrit l'index d'un fichier de messages: triplets (timestamp, offset, longueur)
+    dans l'ordre des lignes du fichier (timestamps décroissants).
+    """
+    values = array("q")
+    for entry in entries:
+        values.extend(entry)
+    path = message_index_path(msg_file)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name(path.name + ".tmp")
+    with tmp_path.open("wb") as f:
+        values.tofile(f)
+    os.replace(tmp_path, path)
+
+
+def _message_timestamp(m: Dict[str, Any]) -> int:
+    try:
+        return int(m.get("timestamp"))
+    except Exception:
+        return 0
+
+
+def index_messages_file(msg_file: Path) -> List[Tuple[int, int, int]]:
+    """Construit (et écrit) l'index d'un fichier de messages existant. Retourne les entrées."""
+    entries: List[Tuple[int, int, int]] = []
+    with msg_file.open("rb") as f:
+        offset = 0
+        for raw in f:
+            start = offset
+            offset += len(raw)
+            line = raw.strip()
+            if not line:
+                continue
+            try:
+                m = jsoncodec.loads(line)
+            except Exception:
+                continue
+            if isinstance(m, dict):
+                entries.append((_message_timestamp(m), start + len(raw) - len(raw.lstrip()), len(line)))
+    write_message_index(msg_file, entries)
+    return entries
+
+
+def _first_below(view: memoryview, count: int, bound: int) -> int:
+    """Premier indice dont le timestamp est < bound (timestamps décroissants)."""
+    lo, hi = 0, count
+    while lo < hi:
+        mid = (lo + hi) // 2
+        if view[3 * mid] < bound:
+            hi = mid
+        else:
+            lo = mid + 1
+    return lo
+
+
+def read_messages_range(msg_file: Path, since: Optional[int] = None,
+                        until: Optional[int] = None) -> Iterator[Dict[str, Any]]:
+    """Messages d'une session avec since <= timestamp < until (du plus récent au plus ancien).
+
+    Utilise l'index de la session (reconstruit s'il est absent ou plus ancien
+    que le fichier de messages) et ne lit que les lignes de la plage.
+    """
+    if not msg_file.exists():
+        return
+    idx_path = message_index_path(msg_file)
+    if not idx_path.exists() or idx_path.stat().st_mtime_ns < msg_file.stat().st_mtime_ns:
+        index_messages_file(msg_file)
+    if idx_path.stat().st_size == 0:
+        return
+    with idx_path.open("rb") as f_idx, msg_file.open("rb") as f_msg:
+        idx_map = mmap.mmap(f_idx.fileno(), 0, access=mmap.ACCESS_READ)
+        msg_map = mmap.mmap(f_msg.fileno(), 0, access=mmap.ACCESS_READ)
+        view = memoryview(idx_map).cast("q")
+        try:
+            count = len(view) // 3
+            start = 0 if until is None else _first_below(view, count, until)
+            end = count if since is None else _first_below(view, count, since)
+            for i in range(start, end):
+                offset, length = view[3 * i + 1], view[3 * i + 2]
+                yield jsoncodec.loads(msg_map[offset:offset + length])
+        finally:
+            view.release()
+            idx_map.close()
+            msg_map.close()
+
+
+# --- Reconstruction complète -------------------------------------------------------
+
+def rebuild(index: ArchiveIndex) -> Dict[str, int]:
+    """Reconstruit tous les index depuis les fichiers de l'archive."""
+    stats = {"sessions": 0, "message_files": 0, "profiles": 0}
+
+    def conversation_rows() -> Iterator[Tuple[str, Optional[str], int]]:
+        if not CONVS_FILE.exists():
+            return
+        with CONVS_FILE.open("rb") as f:
+            for line in f:
+                try:
+                    obj = jsoncodec.loads(line)
+                except Exception:
+                    continue
+                sid = extract_session_id_from_line(obj)
+                if sid:
+                    stats["sessions"] += 1
+                    yield sid, extract_email_from_conv(obj), conversation_last(obj)
+
+    index.update_sessions(conversation_rows())
+
+    if MESS_DIR.exists():
+        for msg_file in sorted(MESS_DIR.glob("*.jsonl")):
+            entries = index_messages_file(msg_file)
+            index.set_message_file(msg_file.stem, msg_file, len(entries),
+                                   entries[0][0] if entries else None, entries[-1][0] if entries else None)
+            stats["message_files"] += 1
+
+    profiles: List[Tuple[str, int, int]] = []
+    if USERS_FILE.exists():
+        with USERS_FILE.open("rb") as f:
+            offset = 0
+            for raw in f:
+                start = offset
+                offset += len(raw)
+                line = raw.strip()
+                if not line:
+                    continue
+                try:
+                    email = extract_email_from_person(jsoncodec.loads(line))
+                except Exception:
+                    continue
+                if email:
+                    profiles.append((email, start + len(raw) - len(raw.lstrip()), len(line)))
+    ArchiveIndex(profile_index_path_for(USERS_FILE)).replace_profiles(profiles)
+    stats["profiles"] = len(profiles)
+    return stats
+
+
+# --- Ligne de commande -------------------------------------------------------------
+
+def parse_time(value: Optional[str]) -> Optional[int]:
+    """Convertit un timestamp en millisecondes ou une date ISO (UTC par défaut) en millisecondes."""
+    if value is None:
+        return None
+    if value.isdigit():
+        return int(value)
+    dt = datetime.fromisoformat(value)
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return int(dt.timestamp() * 1000)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Requêtes locales indexées sur l'archive Crisp exportée")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p_sessions = sub.add_parser("sessions", help="Conversations d'un email")
+    p_sessions.add_argument("--email", required=True)
+    p_messages = sub.add_parser("messages", help="Messages d'un email ou d'une session sur une période")
+    target = p_messages.add_mutually_exclusive_group(required=True)
+    target.add_argument("--email")
+    target.add_argument("--session")
+    p_messages.add_argument("--since", help="Début inclus (timestamp ms ou date ISO)")
+    p_messages.add_argument("--until", help="Fin exclue (timestamp ms ou date ISO)")
+    p_profile = sub.add_parser("profile", help="Profil utilisateur d'un email")
+    p_profile.add_argument("--email", required=True)
+    sub.add_parser("rebuild", help="Reconstruire les index depuis les fichiers existants")
+    args = parser.parse_args()
+
+    index = ArchiveIndex(index_path_for(CONVS_FILE))
+
+    if args.command == "rebuild":
+        stats = rebuild(index)
+        print(f"Index reconstruits: {stats['sessions']} conversations, "
+              f"{stats['message_files']} fichiers de messages, {stats['profiles']} profils.")
+        return
+
+    if args.command == "sessions":
+        for session_id, last in index.sessions_for_email(args.email):
+            print(f"{session_id}\t{last}")
+        return
+
+    if args.command == "profile":
+        location = ArchiveIndex(profile_index_path_for(USERS_FILE)).profile_location(args.email)
+        if location is None or not USERS_FILE.exists():
+            print(f"Aucun profil indexé pour {args.email}", file=sys.stderr)
+            sys.exit(1)
+        with USERS_FILE.open("rb") as f:
+            f.seek(location[0])
+            print(f.read(location[1]).decode("utf-8"))
+        return
+
+    since, until = parse_time(args.since), parse_time(args.until)
+    if args.session:
+        session_ids = [args.session]
+    else:
+        session_ids = [sid for sid, _ in index.sessions_for_email(args.email)]
+    for session_id in session_ids:
+        info = index.message_file(session_id)
+        msg_file = info[0] if info else MESS_DIR / f"{session_id}.jsonl"
+        # sauter directement les sessions hors de la période demandée
+        if info and info[2] is not None:
+            if since is not None and info[2] < since:
+                continue
+            if until is not None and info[3] is not None and info[3] >= until:
+                continue
+        for m in read_messages_range(msg_file, since, until):
+            print(jsoncodec.dumps(m))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+"""
+records.py
+
+Lecture des champs communs des enregistrements stockés (session_id et
+active.last d'une conversation, email d'une conversation ou d'un profil), sans
+dépendance vers les scripts: columnar.py, query.py et projection.py les lisent
+sans importer conv.py, mess.py ou users.py (et donc crisp_api / requests).
+
+Commentaires en français.
+"""
+
+from typing import Any, Dict, Optional
+
+
+def extract_session_id(conv_obj: Dict[str, Any]) -> Optional[str]:
+    """Extrait session_id d'un objet conversation selon la structure attendue."""
+    # Selon la doc, l'identifiant est typiquement dans conv_obj.get('session_id')
+    if not isinstance(conv_obj, dict):
+        return None
+    # Plusieurs clés possibles selon la réponse
+    for key in ("session_id", "id", "_id"):
+        if key in conv_obj and isinstance(conv_obj[key], str):
+            return conv_obj[key]
+    # Parfois il peut être sous data -> session_id
+    if "data" in conv_obj and isinstance(conv_obj["data"], dict):
+        s = conv_obj["data"].get("session_id")
+        if isinstance(s, str):
+            return s
+    return None
+
+
+# Même lecture pour une ligne de conversations.jsonl (nom utilisé par mess.py)
+extract_session_id_from_line = extract_session_id
+
+
+def conversation_last(c: Dict[str, Any]) -> int:
+    """Retourne active.last (timestamp de dernière activité) ou 0 si absent."""
+    try:
+        # accès à active.last
+        active = c.get("active", {})
+        if isinstance(active, dict):
+            last = active.get("last")
+            if isinstance(last, int):
+                return last
+            # parfois string
+            if isinstance(last, str) and last.isdigit():
+                return int(last)
+    except Exception:
+        pass
+    return 0
+
+
+def extract_email_from_conv(obj: Dict[str, Any]) -> Optional[str]:
+    """Extrait l'email depuis un objet conversation. Selon le .jsonl fourni,
+    l'email se trouve dans la clé `meta.email` à la racine ou dans `data.meta.email`.
+    Retourne None si introuvable.
+    """
+    if not isinstance(obj, dict):
+        return None
+    # cas courant: meta.email à la racine
+    meta = obj.get("meta")
+    if isinstance(meta, dict):
+        email = meta.get("email")
+        if isinstance(email, str) and email.strip():
+            return email.strip()
+
+    # autre forme: data -> meta -> email
+    data = obj.get("data")
+    if isinstance(data, dict):
+        meta2 = data.get("meta")
+        if isinstance(meta2, dict):
+            email = meta2.get("email")
+            if isinstance(email, str) and email.strip():
+                return email.strip()
+
+    return None
+
+
+def extract_email_from_person(obj: Dict[str, Any]) -> Optional[str]:
+    """Extrait l'email depuis un objet person retourné par l'API (ou stocké).
+    Selon la doc l'email peut être à la racine sous 'email' ou sous 'data'... On gère
+    les cas simples.
+    """
+    if not isinstance(obj, dict):
+        return None
+    e = obj.get("email")
+    if isinstance(e, str) and e.strip():
+        return e.strip()
+    # parfois sous 'data' -> 'email' ou 'attributes'
+    d = obj.get("data")
+    if isinstance(d, dict):
+        e2 = d.get("email")
+        if isinstance(e2, str) and e2.strip():
+            return e2.strip()
+    # fallback: search any top-level string value containing '@'
+    for k, v in obj.items():
+        if isinstance(v, str) and "@" in v:
+            return v.strip()
+    return None
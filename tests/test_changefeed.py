@@ -0,0 +1,76 @@
+import sys
+from pathlib import Path
+
+import pytest
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT))
+
+from changefeed import ChangeFeed, Consumer, feed_path_for
+import mess
+import users
+from emailindex import EmailIndex, index_path_for
+
+
+def test_consumer_resumes_from_committed_offset(tmp_path):
+    feed = ChangeFeed(tmp_path / "changes.sqlite")
+    feed.append("conversation", [("s1", "insert"), ("s2", "insert")], tmp_path / "c.jsonl")
+    feed.append("profile", [("a@x.com", "insert")])
+    with pytest.raises(ValueError):
+        feed.append("autre", [("x", "insert")])
+
+    etl = Consumer(feed, "etl")
+    batch = etl.poll(limit=2)
+    assert [(c.seq, c.record_id) for c in batch] == [(1, "s1"), (2, "s2")]
+    assert batch[0].location == str(tmp_path / "c.jsonl")
+    etl.commit()
+
+    # un nouveau lecteur reprend après l'offset enregistré
+    feed.append("conversation", [("s1", "update")])
+    etl = Consumer(feed, "etl")
+    assert [(c.record_type, c.record_id, c.op) for c in etl.poll()] == [
+        ("profile", "a@x.com", "insert"), ("conversation", "s1", "update")]
+    etl.commit()
+
+    # filtre par type: la position avance jusqu'à la fin du journal
+    profiles = Consumer(feed, "profiles")
+    assert [c.record_id for c in profiles.poll(record_type="profile")] == ["a@x.com"]
+    assert profiles.poll(record_type="profile") == [] and profiles.position == 4
+    profiles.commit()
+
+    assert feed.offsets() == {"etl": 4, "profiles": 4}
+    assert feed.prune() == 4
+    # les séquences ne sont jamais réutilisées après purge
+    feed.append("conversation", [("s3", "insert")])
+    assert feed.read(after=0)[0].seq == 5
+
+
+def test_scripts_publish_changes(tmp_path, monkeypatch):
+    convs_file = tmp_path / "conversations" / "conversations.jsonl"
+    messages_dir = tmp_path / "conversations" / "messages"
+    users_file = tmp_path / "utilisateurs" / "utilisateurs.jsonl"
+    monkeypatch.setattr(mess, "CONVS_FILE", convs_file)
+    monkeypatch.setattr(mess, "MESS_DIR", messages_dir)
+    monkeypatch.setattr(users, "CONV_FILE", convs_file)
+    monkeypatch.setattr(users, "USERS_DIR", users_file.parent)
+    monkeypatch.setattr(users, "USERS_FILE", users_file)
+
+    msg_file = messages_dir / "s1.jsonl"
+    existing = [{"fingerprint": 1, "timestamp": 1}]
+    mess.write_conversation(mess.FetchedConversation("s1", msg_file, existing, [{"fingerprint": 2, "timestamp": 2}]))
+    # aucun nouveau message: rien à publier
+    mess.write_conversation(mess.FetchedConversation("s1", msg_file, existing, []))
+
+    email_index = EmailIndex(index_path_for(users_file))
+    users.append_user({"email": "A@x.com"}, "A@x.com", email_index)
+    # journal ouvert une fois par exécution et transmis à chaque profil
+    feed = ChangeFeed(feed_path_for(convs_file))
+    monkeypatch.setattr(users.changefeed, "ChangeFeed", None)
+    users.append_user({"email": "a@x.com", "v": 2}, "a@x.com", email_index, feed=feed)
+
+    changes = ChangeFeed(feed_path_for(convs_file)).read()
+    assert [(c.record_type, c.record_id, c.op, c.location) for c in changes] == [
+        ("message", "s1:2", "insert", str(msg_file)),
+        ("profile", "a@x.com", "insert", str(users_file)),
+        ("profile", "a@x.com", "update", str(users_file)),
+    ]
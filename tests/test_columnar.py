@@ -0,0 +1,65 @@
+import sys
+import json
+import os
+import subprocess
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT))
+
+import columnar
+
+
+def write_messages(path, messages):
+    path.write_text("".join(json.dumps(m) + "\n" for m in messages), encoding="utf-8")
+
+
+def test_incremental_columnar_export(tmp_path, monkeypatch):
+    convs_dir = tmp_path / "conversations"
+    mess_dir = convs_dir / "messages"
+    mess_dir.mkdir(parents=True)
+    convs_file = convs_dir / "conversations.jsonl"
+    convs_file.write_text(json.dumps({"session_id": "s1", "state": "resolved", "active": {"last": 9}}) + "\n")
+    monkeypatch.setattr(columnar, "CONVS_FILE", convs_file)
+    monkeypatch.setattr(columnar, "MESS_DIR", mess_dir)
+    monkeypatch.setattr(columnar, "COLUMNAR_DIR", convs_dir / "columnar")
+
+    write_messages(mess_dir / "s1.jsonl", [
+        {"fingerprint": 11, "timestamp": 200, "from": "user", "type": "text", "origin": "chat"},
+        {"fingerprint": 12, "timestamp": 100, "from": "operator", "type": "text", "origin": "chat"},
+    ])
+    write_messages(mess_dir / "s2.jsonl", [{"fingerprint": 21, "timestamp": 50, "from": "user", "type": "file"}])
+
+    stats = columnar.export()
+    assert stats == {"converted": 2, "reused": 0, "removed": 0, "rows": 3}
+
+    # seule la session modifiée est reconvertie
+    write_messages(mess_dir / "s2.jsonl", [
+        {"fingerprint": 22, "timestamp": 60, "from": "operator", "type": "text"},
+        {"fingerprint": 21, "timestamp": 50, "from": "user", "type": "file"},
+    ])
+    os.utime(mess_dir / "s2.jsonl", ns=(1, 1))
+    stats = columnar.export()
+    assert stats == {"converted": 1, "reused": 1, "removed": 0, "rows": 4}
+
+    dicts = columnar.load_dictionaries()
+    with columnar.open_table("messages") as t:
+        assert list(t["fingerprint"]) == [11, 12, 22, 21]
+        assert list(t["timestamp"]) == [200, 100, 60, 50]
+        assert [dicts["session"].values[c] for c in t["session"]] == ["s1", "s1", "s2", "s2"]
+        assert [dicts["from"].values[c] for c in t["from"]] == ["user", "operator", "operator", "user"]
+        assert t["origin"][3] == -1
+        # offset/length pointent sur la ligne du message dans son fichier
+        raw = (mess_dir / "s2.jsonl").read_bytes()
+        assert json.loads(raw[t["offset"][2]:t["offset"][2] + t["length"][2]])["fingerprint"] == 22
+    with columnar.open_table("conversations") as c:
+        assert list(c["active_last"]) == [9]
+        assert dicts["state"].values[c["state"][0]] == "resolved"
+
+
+def test_readers_do_not_import_the_api_scripts():
+    # columnar, query et projection lisent l'archive sans charger conv/mess/users ni requests
+    code = ("import sys, columnar, query, projection; "
+            "print(sorted(m for m in ('conv', 'mess', 'users', 'crisp_api', 'requests') if m in sys.modules))")
+    out = subprocess.run([sys.executable, "-c", code], cwd=str(ROOT), capture_output=True, text=True, check=True)
+    assert out.stdout.strip() == "[]"
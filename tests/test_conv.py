@@ -29,3 +29,180 @@ def test_sort_conversations():
     assert res[0]['session_id'] == '2'
     assert res[1]['session_id'] == '1'
     assert res[2]['session_id'] == '3'
+
+
+def test_conversation_table_dedup_and_sorted_write(tmp_path):
+    from conv import ConversationTable
+
+    path = tmp_path / "conversations.jsonl"
+    a = {'session_id': '1', 'active': {'last': 100}, 'meta': {'email': 'é@x.fr'}}
+    b = {'session_id': '2', 'active': {'last': 300}}
+    path.write_text("".join(json.dumps(c, ensure_ascii=False) + "\n" for c in (a, b)), encoding="utf-8")
+
+    table = ConversationTable.load(path)
+    assert len(table) == 2
+    assert '1' in table and '3' not in table
+    assert not table.add('1', a)
+    assert table.add('3', {'session_id': '3', 'active': {'last': 200}})
+    table.write()
+
+    lines = path.read_text(encoding="utf-8").splitlines()
+    assert [json.loads(l)['session_id'] for l in lines] == ['2', '3', '1']
+    assert lines[2] == json.dumps(a, ensure_ascii=False)
+
+    # les offsets sont mis à jour: une seconde écriture donne le même contenu
+    table.write()
+    assert path.read_text(encoding="utf-8").splitlines() == lines
+
+
+def test_conversation_table_update_only_changed(tmp_path):
+    from conv import ConversationTable
+
+    path = tmp_path / "conversations.jsonl"
+    a = {'session_id': '1', 'active': {'last': 100}, 'state': 'pending'}
+    b = {'session_id': '2', 'active': {'last': 300}, 'state': 'pending'}
+    path.write_text("".join(json.dumps(c) + "\n" for c in (a, b)), encoding="utf-8")
+
+    table = ConversationTable.load(path)
+    assert not table.update('1', dict(a))
+    assert not table.update('9', a)
+    assert table.update('1', {'session_id': '1', 'active': {'last': 500}, 'state': 'resolved'})
+    assert table.update('2', {'session_id': '2', 'active': {'last': 300}, 'state': 'resolved'})
+    table.write()
+
+    rows = [json.loads(l) for l in path.read_text(encoding="utf-8").splitlines()]
+    assert [(r['session_id'], r['state']) for r in rows] == [('1', 'resolved'), ('2', 'resolved')]
+    assert len(ConversationTable.load(path)) == 2
+
+
+def test_conversation_table_write_changes_only_in_place(tmp_path):
+    from conv import ConversationTable
+
+    path = tmp_path / "conversations.jsonl"
+    a = {'session_id': '1', 'active': {'last': 100}, 'state': 'pending'}
+    b = {'session_id': '2', 'active': {'last': 300}, 'state': 'pending'}
+    path.write_text("".join(json.dumps(c) + "\n" for c in (b, a)), encoding="utf-8")
+
+    table = ConversationTable.load(path)
+    # même rang, version plus courte: réécrite à sa place, complétée par des espaces
+    assert table.update('2', {'session_id': '2', 'active': {'last': 300}, 'state': 'ok'})
+    # rang changé, et nouvelle conversation: en attente de la réécriture triée
+    assert table.update('1', {'session_id': '1', 'active': {'last': 500}, 'state': 'resolved'})
+    table.add('3', {'session_id': '3', 'active': {'last': 50}})
+    assert table.write_changes() == 1
+
+    lines = path.read_text(encoding="utf-8").splitlines()
+    assert len(lines) == 2 and lines[0].endswith(" ") and json.loads(lines[0])['state'] == 'ok'
+    assert json.loads(lines[1])['state'] == 'pending'
+    assert sorted(table.pending) == [1, 2] and table.dead_bytes > 0
+    assert ConversationTable.load(path).dead_bytes == table.dead_bytes
+
+    table.write()
+    rows = [json.loads(l) for l in path.read_text(encoding="utf-8").splitlines()]
+    assert [(r['session_id'], r.get('state')) for r in rows] == [('1', 'resolved'), ('2', 'ok'), ('3', None)]
+    assert not path.read_text(encoding="utf-8").replace("\n", "").endswith(" ")
+    assert table.dead_bytes == 0 and not table.pending
+
+
+class PageResponse:
+    status_code = 200
+
+    def __init__(self, items):
+        self.items = items
+        self.text = json.dumps({"data": items})
+
+    def json(self):
+        return {"data": self.items}
+
+
+def test_upsert_run_leaves_file_sorted_without_blank_lines(tmp_path, monkeypatch):
+    import conv
+
+    conv_dir = tmp_path / "conversations"
+    conv_file = conv_dir / "conversations.jsonl"
+    monkeypatch.setattr(conv, "CONV_DIR", conv_dir)
+    monkeypatch.setattr(conv, "CONV_FILE", conv_file)
+    monkeypatch.setattr(conv, "STATE_FILE", conv_dir / "conversations.jsonl.state.json")
+    monkeypatch.setattr(conv.time, "sleep", lambda s: None)
+    monkeypatch.setenv("CRISP_IDENTIFIER_PROD", "id")
+    monkeypatch.setenv("CRISP_KEY_PROD", "key")
+    monkeypatch.setenv("ID_SITE_CRISP", "site")
+
+    old = [{"session_id": f"s{i}", "active": {"last": 1000 - i}, "state": "pending"} for i in range(45)]
+    conv_dir.mkdir()
+    conv_file.write_text("".join(json.dumps(c) + "\n" for c in old), encoding="utf-8")
+    # page 1: une nouvelle conversation et une conversation modifiée sans changer de rang ;
+    # page 2: une conversation qui remonte en tête (version plus longue)
+    page1 = [dict(c) for c in old[:20]]
+    page1[0] = {"session_id": "new", "active": {"last": 6000}}
+    page1[5] = {"session_id": "s5", "active": {"last": 995}, "state": "ok"}
+    page2 = [dict(c) for c in old[20:40]]
+    page2[5] = {"session_id": "s25", "active": {"last": 5000}, "state": "resolved", "note": "x" * 50}
+    pages = {1: page1, 2: page2, 3: old[40:]}
+
+    def fake_call_api(website_id, page_number, auth, fresh=False):
+        return PageResponse(pages[page_number])
+
+    monkeypatch.setattr(conv, "call_api", fake_call_api)
+    monkeypatch.setattr(sys, "argv", ["conv.py", "--upsert", "--upsert-pages", "2"])
+    conv.main()
+
+    raw = conv_file.read_text(encoding="utf-8").split("\n")
+    assert raw[-1] == ""
+    lines = raw[:-1]
+    assert all(line.strip() == line and line for line in lines)
+    rows = [json.loads(line) for line in lines]
+    lasts = [r["active"]["last"] for r in rows]
+    assert lasts == sorted(lasts, reverse=True)
+    assert [r["session_id"] for r in rows[:2]] == ["new", "s25"]
+    assert len(rows) == 46 and len({r["session_id"] for r in rows}) == 46
+    assert next(r for r in rows if r["session_id"] == "s5")["state"] == "ok"
+    assert conv.load_state()["upsert_next_page"] == 3
+
+
+def test_reset_removes_conversations_and_sidecars(tmp_path, monkeypatch):
+    import conv
+
+    conv_dir = tmp_path / "conversations"
+    monkeypatch.setattr(conv, "CONV_DIR", conv_dir)
+    monkeypatch.setattr(conv, "CONV_FILE", conv_dir / "conversations.jsonl")
+    monkeypatch.setattr(conv, "STATE_FILE", conv_dir / "conversations.jsonl.state.json")
+    (conv_dir / "messages").mkdir(parents=True)
+    names = ["conversations.jsonl", "conversations.jsonl.state.json", "conversations.cold.jsonl",
+             "archive.index.sqlite"]
+    for name in names:
+        (conv_dir / name).write_text("x")
+    (conv_dir / "messages" / "s1.jsonl").write_text("x")
+
+    assert sorted(p.name for p in conv.reset_files()) == sorted(names)
+    assert [p.name for p in conv_dir.iterdir()] == ["messages"]
+    assert conv.reset_files() == []
+
+
+def test_conversation_table_hash_collision_keeps_both(tmp_path, monkeypatch):
+    import conv
+    from conv import ConversationTable
+
+    # toutes les empreintes en collision: seul le session_id stocké les distingue
+    monkeypatch.setattr(conv, "session_key", lambda session_id: 7)
+    monkeypatch.setattr(conv, "REINDEX_ROWS", 1)
+    path = tmp_path / "conversations.jsonl"
+    a = {'session_id': '1', 'active': {'last': 100}}
+    b = {'session_id': '2', 'active': {'last': 300}}
+    a2 = {'session_id': '1', 'active': {'last': 200}}
+    path.write_text("".join(json.dumps(c) + "\n" for c in (a, b, a2)), encoding="utf-8")
+
+    table = ConversationTable.load(path)
+    # doublon du fichier fusionné (la dernière version l'emporte), pas la collision
+    assert len(table) == 2 and table.dead_bytes == len(json.dumps(a)) + 1
+    assert '1' in table and '2' in table and '3' not in table
+    assert table.add('3', {'session_id': '3', 'active': {'last': 50}})
+    assert table.add('4', {'session_id': '4', 'active': {'last': 400}})
+    assert not table.add('3', {'session_id': '3', 'active': {'last': 50}})
+    assert table.update('2', {'session_id': '2', 'active': {'last': 300}, 'state': 'resolved'})
+    table.write()
+
+    rows = [json.loads(l) for l in path.read_text(encoding="utf-8").splitlines()]
+    assert [(r['session_id'], r['active']['last']) for r in rows] == [('4', 400), ('2', 300), ('1', 200), ('3', 50)]
+    assert rows[1]['state'] == 'resolved'
+    assert len(ConversationTable.load(path)) == 4
@@ -0,0 +1,200 @@
+import sys
+import json
+import time
+from pathlib import Path
+
+import pytest
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT))
+
+import crisp_api
+
+
+class DummyResponse:
+    def __init__(self, status_code, data):
+        self.status_code = status_code
+        self.content = json.dumps(data).encode("utf-8")
+        self.text = self.content.decode("utf-8")
+
+    def json(self):
+        return json.loads(self.content)
+
+
+@pytest.fixture(autouse=True)
+def cache_off():
+    yield
+    crisp_api.configure("off")
+    crisp_api.configure_requests()
+
+
+def test_record_then_replay_without_network(tmp_path, monkeypatch):
+    calls = []
+
+    def fake_get(url, headers=None, auth=None, params=None, timeout=None):
+        calls.append((url, params))
+        if url.endswith("/quota"):
+            return DummyResponse(429, {})
+        return DummyResponse(200, {"data": [{"url": url, "params": params}]})
+
+    monkeypatch.setattr(crisp_api.requests, "get", fake_get)
+    cache_file = tmp_path / "cache.sqlite"
+
+    crisp_api.configure("record", cache_file)
+    crisp_api.get("https://api/x", headers={}, auth=("a", "b"), params={"p": 1})
+    crisp_api.get("https://api/quota", headers={}, auth=("a", "b"))
+    assert len(calls) == 2
+
+    crisp_api.configure("replay", cache_file)
+    resp = crisp_api.get("https://api/x", headers={}, auth=("a", "b"), params={"p": 1})
+    assert resp.status_code == 200
+    assert resp.json() == {"data": [{"url": "https://api/x", "params": {"p": 1}}]}
+    # autres paramètres ou réponse non valide (429): pas en cache
+    with pytest.raises(crisp_api.CacheMiss):
+        crisp_api.get("https://api/x", headers={}, auth=("a", "b"), params={"p": 2})
+    with pytest.raises(crisp_api.CacheMiss):
+        crisp_api.get("https://api/quota", headers={}, auth=("a", "b"))
+    assert len(calls) == 2
+
+
+def test_expired_entries_are_refetched(tmp_path, monkeypatch):
+    calls = []
+
+    def fake_get(url, headers=None, auth=None, timeout=None):
+        calls.append(url)
+        return DummyResponse(200, {"n": len(calls)})
+
+    monkeypatch.setattr(crisp_api.requests, "get", fake_get)
+    crisp_api.configure("on", tmp_path / "cache.sqlite", ttl_hours=1)
+    assert crisp_api.get("https://api/y", headers={}, auth=None).json() == {"n": 1}
+    assert crisp_api.get("https://api/y", headers={}, auth=None).json() == {"n": 1}
+
+    crisp_api.configure("on", tmp_path / "cache.sqlite", ttl_hours=0)
+    assert crisp_api.get("https://api/y", headers={}, auth=None).json() == {"n": 2}
+
+
+def test_retries_transient_errors_but_not_quota(monkeypatch):
+    script = []
+    calls = []
+
+    def fake_get(url, headers=None, auth=None, timeout=None):
+        calls.append(url)
+        outcome = script.pop(0)
+        if isinstance(outcome, Exception):
+            raise outcome
+        return DummyResponse(outcome, {})
+
+    monkeypatch.setattr(crisp_api.requests, "get", fake_get)
+    crisp_api.configure_requests(retries=2, backoff=0)
+
+    script[:] = [503, crisp_api.requests.ConnectionError("coupure"), 200]
+    assert crisp_api.get("https://api/a", headers={}, auth=None).status_code == 200
+    assert len(calls) == 3
+
+    # tentatives épuisées: la dernière réponse 5xx est retournée
+    script[:] = [500, 502, 504]
+    assert crisp_api.get("https://api/a", headers={}, auth=None).status_code == 504
+    # ... ou la dernière erreur réseau relevée
+    script[:] = [crisp_api.requests.Timeout("lent")] * 3
+    with pytest.raises(crisp_api.requests.Timeout):
+        crisp_api.get("https://api/a", headers={}, auth=None)
+
+    # 429 (quota) et 4xx ne sont pas retentés
+    del calls[:]
+    script[:] = [429]
+    assert crisp_api.get("https://api/a", headers={}, auth=None).status_code == 429
+    assert len(calls) == 1
+
+    # erreur non transitoire: relevée sans nouvelle tentative
+    del calls[:]
+    script[:] = [crisp_api.requests.exceptions.InvalidURL("url")]
+    with pytest.raises(crisp_api.requests.exceptions.InvalidURL):
+        crisp_api.get("https://api/a", headers={}, auth=None)
+    assert len(calls) == 1
+
+
+def test_short_rate_limit_is_retried_and_timeouts_are_short(monkeypatch):
+    seen = []
+    script = [{"Retry-After": "0"}, {"Retry-After": "3600"}]
+
+    def fake_get(url, headers=None, auth=None, timeout=None):
+        seen.append(timeout)
+        resp = DummyResponse(429, {})
+        resp.headers = script.pop(0)
+        return resp
+
+    monkeypatch.setattr(crisp_api.requests, "get", fake_get)
+    crisp_api.configure_requests(retries=3, backoff=0)
+    # attente courte annoncée: nouvelle tentative ; attente longue (quota du jour): 429 retourné
+    assert crisp_api.get("https://api/a", headers={}, auth=None).status_code == 429
+    assert len(seen) == 2
+    assert seen[0] == crisp_api.DEFAULT_TIMEOUT and seen[0][1] < 30
+
+
+def test_slow_request_is_hedged_within_budget(monkeypatch):
+    calls = []
+
+    def fake_get(url, headers=None, auth=None, timeout=None):
+        calls.append(url)
+        if len(calls) == 21:
+            time.sleep(2)  # requête bloquée: la copie lancée au-delà du p95 répond avant
+            return DummyResponse(200, {"copie": False})
+        time.sleep(0.001)
+        return DummyResponse(200, {"copie": len(calls) == 22})
+
+    monkeypatch.setattr(crisp_api.requests, "get", fake_get)
+    crisp_api.configure_requests(retries=0, hedge=True, hedge_budget=0.1)
+    for _ in range(20):
+        crisp_api.get("https://api/b", headers={}, auth=None)
+
+    started = time.monotonic()
+    resp = crisp_api.get("https://api/b", headers={}, auth=None)
+    assert time.monotonic() - started < 1
+    assert resp.json() == {"copie": True}
+    assert crisp_api._hedger.hedges == 1
+
+
+def test_request_budget_counts_retries_and_returns_synthetic_quota(tmp_path, monkeypatch):
+    calls = []
+
+    def fake_get(url, headers=None, auth=None, timeout=None):
+        calls.append(url)
+        return DummyResponse(503 if len(calls) == 1 else 200, {"n": len(calls)})
+
+    monkeypatch.setattr(crisp_api.requests, "get", fake_get)
+    crisp_api.configure("on", tmp_path / "cache.sqlite")
+    crisp_api.configure_requests(retries=1, backoff=0, max_requests=3)
+
+    # 503 puis 200: deux requêtes consommées
+    assert crisp_api.get("https://api/c", headers={}, auth=None).json() == {"n": 2}
+    # servie par le cache: ne consomme pas de budget
+    assert crisp_api.get("https://api/c", headers={}, auth=None).json() == {"n": 2}
+    assert crisp_api.get("https://api/d", headers={}, auth=None).status_code == 200
+    assert crisp_api.requests_used() == 3
+
+    resp = crisp_api.get("https://api/e", headers={}, auth=None)
+    assert resp.status_code == 429 and not resp.from_cache
+    assert len(calls) == 3
+    # la réponse synthétique n'est pas mise en cache
+    crisp_api.configure_requests()
+    assert crisp_api.get("https://api/e", headers={}, auth=None).status_code == 200
+
+
+def test_fresh_pages_bypass_cache_in_on_mode(tmp_path, monkeypatch):
+    calls = []
+
+    def fake_get(url, headers=None, auth=None, params=None, timeout=None):
+        calls.append(url)
+        return DummyResponse(200, {"n": len(calls)})
+
+    monkeypatch.setattr(crisp_api.requests, "get", fake_get)
+    cache_file = tmp_path / "cache.sqlite"
+    crisp_api.configure("on", cache_file)
+    assert crisp_api.get("https://api/p1", headers={}, auth=None, fresh=True).json() == {"n": 1}
+    # toujours demandée à l'API, mais la réponse est enregistrée
+    assert crisp_api.get("https://api/p1", headers={}, auth=None, fresh=True).json() == {"n": 2}
+    assert crisp_api.get("https://api/p1", headers={}, auth=None).json() == {"n": 2}
+
+    crisp_api.configure("replay", cache_file)
+    assert crisp_api.get("https://api/p1", headers={}, auth=None, fresh=True).json() == {"n": 2}
+    assert len(calls) == 2
@@ -0,0 +1,143 @@
+import sys
+import json
+import random
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT))
+
+from emailindex import EmailIndex, index_path_for
+import users
+
+
+def test_sorted_lookup_and_journal(tmp_path):
+    rnd = random.Random(7)
+    emails = sorted({f"user{rnd.randint(0, 10**6)}@ex{rnd.randint(0, 9)}.com" for _ in range(2000)})
+    path = tmp_path / "utilisateurs.jsonl.emails"
+    index = EmailIndex(path)
+    assert len(index) == 0 and "a@x.com" not in index
+
+    index.replace((e, i) for i, e in enumerate(emails[::2]))
+    assert len(index) == len(emails[::2])
+    for i, e in enumerate(emails):
+        assert (e in index) == (i % 2 == 0)
+        assert index.fetched_at(e) == (i // 2 if i % 2 == 0 else None)
+    assert " USER%s" % emails[0][4:].upper() in index
+
+    # ajouts et re-récupérations journalisés, visibles après réouverture
+    assert index.add(emails[1], 111) is True
+    assert index.add(emails[1].upper(), 222) is False
+    assert index.add(emails[0], 333) is False
+    index.close()
+    reopened = EmailIndex(path)
+    assert emails[1] in reopened and len(reopened) == len(emails[::2]) + 1
+    assert reopened.fetched_at(emails[1]) == 222 and reopened.fetched_at(emails[0]) == 333
+    entries = dict(reopened)
+    assert len(entries) == len(reopened) and entries[emails[0]] == 333 and entries[emails[2]] == 1
+
+
+def test_refresh_priority_order(tmp_path):
+    index = EmailIndex(tmp_path / "u.emails")
+    day = 86400 * 1000
+    now = 100 * day
+    index.replace([
+        ("active-old@x.com", 10 * day),     # actif après récupération
+        ("active-recent@x.com", 90 * day),  # actif après récupération, plus récemment
+        ("fresh@x.com", 95 * day),          # à jour
+        ("stale@x.com", 50 * day),          # trop ancien
+        ("unknown@x.com", 0),               # date inconnue
+    ])
+    activity = {"active-old@x.com": 20 * day, "active-recent@x.com": 99 * day, "fresh@x.com": 94 * day}
+    assert users.select_refresh(index, activity, 10, 30 * day, now) == [
+        "active-recent@x.com", "active-old@x.com", "unknown@x.com", "stale@x.com"]
+    assert users.select_refresh(index, activity, 1, 30 * day, now) == ["active-recent@x.com"]
+    assert users.select_refresh(index, activity, 0, 30 * day, now) == []
+
+
+def test_users_main_uses_index_and_sorts_once(tmp_path, monkeypatch):
+    conv_dir = tmp_path / "conversations"
+    conv_dir.mkdir()
+    conv_file = conv_dir / "conversations.jsonl"
+    conv_file.write_text("".join(json.dumps({"meta": {"email": e}}) + "\n"
+                                 for e in ("c@x.com", "A@x.com", "b@x.com")), encoding="utf-8")
+    users_file = tmp_path / "utilisateurs" / "utilisateurs.jsonl"
+    monkeypatch.setattr(users, "CONV_DIR", conv_dir)
+    monkeypatch.setattr(users, "CONV_FILE", conv_file)
+    monkeypatch.setattr(users, "USERS_DIR", users_file.parent)
+    monkeypatch.setattr(users, "USERS_FILE", users_file)
+    monkeypatch.setenv("CRISP_IDENTIFIER_PROD", "id")
+    monkeypatch.setenv("CRISP_KEY_PROD", "key")
+    monkeypatch.setenv("ID_SITE_CRISP", "site")
+
+    # profil existant, sans index: reconstruit au démarrage
+    users_file.parent.mkdir()
+    users_file.write_text(json.dumps({"email": "a@x.com", "v": 0}) + "\n", encoding="utf-8")
+    calls = []
+
+    class Resp:
+        status_code = 200
+
+        def __init__(self, email):
+            self.email = email
+
+        def json(self):
+            return {"email": self.email, "v": 1}
+
+    def fake_get(url, headers=None, auth=None, timeout=None):
+        email = url.rsplit("/", 1)[-1].replace("%40", "@")
+        calls.append(email)
+        return Resp(email)
+
+    monkeypatch.setattr(users.requests, "get", fake_get)
+    monkeypatch.setattr(users.time, "sleep", lambda s: None)
+    monkeypatch.setattr(sys, "argv", ["prog", "--nb", "5"])
+    users.main()
+
+    assert calls == ["c@x.com", "b@x.com"]
+    lines = [json.loads(l) for l in users_file.read_text(encoding="utf-8").splitlines()]
+    assert [p["email"] for p in lines] == ["a@x.com", "b@x.com", "c@x.com"]
+    index = EmailIndex(index_path_for(users_file))
+    assert [e for e, _ in index] == ["a@x.com", "b@x.com", "c@x.com"]
+    assert index.fetched_at("a@x.com") == 0 and index.fetched_at("b@x.com") > 0
+    assert not (users_file.parent / "utilisateurs.jsonl.emails.new").exists()
+
+    # deuxième exécution: tout est déjà présent, aucun appel
+    users.main()
+    assert calls == ["c@x.com", "b@x.com"]
+
+    # rafraîchissement: seul le profil sans date est re-récupéré et remplacé
+    monkeypatch.setattr(sys, "argv", ["prog", "--refresh", "5"])
+    users.main()
+    assert calls == ["c@x.com", "b@x.com", "a@x.com"]
+    lines = [json.loads(l) for l in users_file.read_text(encoding="utf-8").splitlines()]
+    assert lines == [{"email": e, "v": 1} for e in ("a@x.com", "b@x.com", "c@x.com")]
+    assert EmailIndex(index_path_for(users_file)).fetched_at("a@x.com") > 0
+
+
+def test_rebuild_reuses_the_open_email_index(tmp_path, monkeypatch):
+    users_file = tmp_path / "utilisateurs" / "utilisateurs.jsonl"
+    monkeypatch.setattr(users, "USERS_DIR", users_file.parent)
+    monkeypatch.setattr(users, "USERS_FILE", users_file)
+    users_file.parent.mkdir()
+    users_file.write_text("".join(json.dumps({"email": e}) + "\n" for e in ("b@x.com", "a@x.com")))
+
+    opened = []
+    real_init = users.EmailIndex.__init__
+
+    def tracking_init(self, path):
+        opened.append(self)
+        real_init(self, path)
+
+    monkeypatch.setattr(users.EmailIndex, "__init__", tracking_init)
+    # index absent: reconstruit par le tri, sur la seule instance ouverte
+    index = users.load_email_index()
+    assert opened == [index]
+    assert "a@x.com" in index and len(index) == 2
+
+    index.add("c@x.com")
+    with users_file.open("a") as f:
+        f.write(json.dumps({"email": "c@x.com"}) + "\n")
+    users.sort_users_file(dedup=True, email_index=index)
+    assert opened == [index]
+    assert len(index) == 3 and "c@x.com" in index
+    index.close()
@@ -0,0 +1,61 @@
+import sys
+import json
+import random
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT))
+
+from extsort import sort_lines
+import users
+
+
+def test_sort_lines_matches_sorted_when_spilling(tmp_path):
+    rnd = random.Random(42)
+    items = [(rnd.randint(0, 20), f"line-{i}".encode()) for i in range(500)]
+    for reverse in (False, True):
+        expected = sorted(items, key=lambda kv: kv[0], reverse=reverse)
+        # buffer minuscule: plusieurs dizaines de runs temporaires
+        result = list(sort_lines(iter(items), reverse=reverse, buffer_bytes=2000, tmp_dir=tmp_path))
+        assert result == expected
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_save_users_sorted_external_is_identical(tmp_path, monkeypatch):
+    monkeypatch.setattr(users, "USERS_DIR", tmp_path)
+    monkeypatch.setattr(users, "USERS_FILE", tmp_path / "utilisateurs.jsonl")
+    users_map = {f"{name}@example.com": {"email": f"{name}@example.com", "n": "é"} for name in ("b", "A", "c", "a")}
+
+    users.save_users_sorted(users_map, buffer_bytes=1)
+    lines = (tmp_path / "utilisateurs.jsonl").read_text(encoding="utf-8").splitlines()
+    expected = [json.dumps(users_map[e], ensure_ascii=False) for e in sorted(users_map, key=str.lower)]
+    assert lines == expected
+
+    # re-trier le fichier depuis le disque ne change rien
+    users.sort_users_file(buffer_bytes=1)
+    assert (tmp_path / "utilisateurs.jsonl").read_text(encoding="utf-8").splitlines() == expected
+
+
+def test_sort_lines_caps_open_runs(tmp_path, monkeypatch):
+    import extsort
+
+    monkeypatch.setattr(extsort, "MAX_MERGE_RUNS", 3)
+    opened = []
+    real_temporary_file = extsort.tempfile.TemporaryFile
+
+    def tracking_temporary_file(*args, **kwargs):
+        run = real_temporary_file(*args, **kwargs)
+        opened.append(run)
+        peak[0] = max(peak[0], sum(1 for r in opened if not r.closed))
+        return run
+
+    peak = [0]
+    monkeypatch.setattr(extsort.tempfile, "TemporaryFile", tracking_temporary_file)
+    rnd = random.Random(7)
+    items = [(rnd.randint(0, 20), f"line-{i}".encode()) for i in range(500)]
+    for reverse in (False, True):
+        # buffer nul: un run par ligne, fusionnés 3 par 3 sur plusieurs niveaux
+        result = list(sort_lines(iter(items), reverse=reverse, buffer_bytes=0, tmp_dir=tmp_path))
+        assert result == sorted(items, key=lambda kv: kv[0], reverse=reverse)
+    assert len(opened) > 1000 and peak[0] <= 16
+    assert all(r.closed for r in opened)
@@ -0,0 +1,44 @@
+import sys
+import json
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT))
+
+import fulltext
+import mess
+
+
+def test_search_ranks_messages_written_by_mess(tmp_path, monkeypatch):
+    convs_file = tmp_path / "conversations" / "conversations.jsonl"
+    messages_dir = tmp_path / "conversations" / "messages"
+    monkeypatch.setattr(mess, "CONVS_FILE", convs_file)
+    monkeypatch.setattr(mess, "MESS_DIR", messages_dir)
+    monkeypatch.setattr(fulltext, "MESS_DIR", messages_dir)
+
+    s1 = [
+        {"fingerprint": 1, "timestamp": 100, "content": "Erreur E1234 au paiement"},
+        {"fingerprint": 2, "timestamp": 200, "content": "erreur e1234, ERREUR encore"},
+        {"fingerprint": 3, "timestamp": 300, "content": {"name": "facture.pdf", "url": "https://x"}},
+    ]
+    s2 = [{"fingerprint": 4, "timestamp": 400, "content": "Problème de paiement résolu"}]
+    mess.write_conversation(mess.FetchedConversation("s1", messages_dir / "s1.jsonl", [], s1))
+    mess.write_conversation(mess.FetchedConversation("s2", messages_dir / "s2.jsonl", [], s2))
+
+    index = fulltext.FullTextIndex(fulltext.index_path_for(messages_dir))
+    hits = index.search("erreur E1234")
+    assert [(h.session_id, h.fingerprint) for h in hits] == [("s1", 2), ("s1", 1)]
+    # accents et casse ignorés, tous les termes requis
+    assert [h.fingerprint for h in index.search("PROBLEME")] == [4]
+    assert [h.fingerprint for h in index.search("paiement")] == [4, 1]
+    assert [h.fingerprint for h in index.search("facture")] == [3]
+    assert index.search("erreur inconnu") == []
+
+    # mess a déjà tout indexé: build ne refait rien, puis rattrape les changements sur disque
+    assert fulltext.build(index) == {"indexed": 0, "unchanged": 2, "removed": 0}
+    (messages_dir / "s2.jsonl").unlink()
+    (messages_dir / "s3.jsonl").write_text(
+        json.dumps({"fingerprint": 5, "timestamp": 500, "content": "nouvelle erreur"}) + "\n", encoding="utf-8")
+    assert fulltext.build(index) == {"indexed": 1, "unchanged": 1, "removed": 1}
+    assert index.search("paiement")[0].fingerprint == 1
+    assert [h.fingerprint for h in index.search("erreur")] == [2, 5, 1]
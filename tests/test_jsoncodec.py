@@ -0,0 +1,37 @@
+import json
+import sys
+from pathlib import Path
+
+import pytest
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT))
+
+import jsoncodec
+
+
+def test_encoding_is_byte_compatible_with_stdlib():
+    obj = {"texte": "café   \"guillemets\" \\", "n": [1, -2.5, 1e300, 2 ** 70, None, True],
+           "vide": {}, "emoji": "\U0001f600", "ctrl": "\x01\t"}
+    assert jsoncodec.dumps(obj) == json.dumps(obj, ensure_ascii=False)
+    assert jsoncodec.dumpb(obj) == json.dumps(obj, ensure_ascii=False).encode("utf-8")
+
+
+def test_decoding_from_bytes_matches_stdlib(monkeypatch):
+    raw = jsoncodec.dumpb({"a": "é", "b": [1, 2.5]})
+    for data in (raw, bytearray(raw), memoryview(raw), raw.decode("utf-8")):
+        assert jsoncodec.loads(data) == {"a": "é", "b": [1, 2.5]}
+
+    # un document refusé par le décodeur natif est relu par la bibliothèque standard
+    def strict(data):
+        raise ValueError("refusé")
+    monkeypatch.setattr(jsoncodec, "BACKEND", jsoncodec.BACKEND)
+    monkeypatch.setattr(jsoncodec, "_native", strict)
+    assert jsoncodec.loads(b'{"n": 123456789012345678901234567890}') == {"n": 123456789012345678901234567890}
+    with pytest.raises(ValueError):
+        jsoncodec.loads(b"{malform")
+
+    jsoncodec.use("json")
+    assert jsoncodec.BACKEND == "json" and jsoncodec._native is None
+    with pytest.raises(ValueError):
+        jsoncodec.use("yaml")
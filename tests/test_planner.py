@@ -0,0 +1,132 @@
+import json
+import sys
+from pathlib import Path
+
+import pytest
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT))
+
+import conv
+import mess
+import planner
+import users
+from planner import StageEstimate, allocate
+
+
+def test_estimates_from_local_state_and_allocation_by_yield(tmp_path, monkeypatch):
+    conv_dir = tmp_path / "conversations"
+    conv_file = conv_dir / "conversations.jsonl"
+    messages_dir = conv_dir / "messages"
+    users_file = tmp_path / "utilisateurs" / "utilisateurs.jsonl"
+    monkeypatch.setattr(conv, "CONV_FILE", conv_file)
+    monkeypatch.setattr(conv, "STATE_FILE", conv_dir / "conversations.jsonl.state.json")
+    monkeypatch.setattr(mess, "CONVS_FILE", conv_file)
+    monkeypatch.setattr(mess, "MESS_DIR", messages_dir)
+    monkeypatch.setattr(mess, "STATE_FILE", messages_dir / "messages.jsonl.state.json")
+    monkeypatch.setattr(users, "CONV_FILE", conv_file)
+    monkeypatch.setattr(users, "USERS_DIR", users_file.parent)
+    monkeypatch.setattr(users, "USERS_FILE", users_file)
+
+    conv_dir.mkdir()
+    conv_file.write_text("".join(
+        json.dumps({"session_id": f"s{i}", "meta": {"email": f"u{i % 3}@x.com"}}) + "\n" for i in range(6)))
+    conv.save_state({"next_page": 2})
+    mess.save_state({"next_index": 2})
+    # deux conversations déjà récupérées: 3 pages pour 12 messages en moyenne
+    mess.write_conversation(mess.FetchedConversation("s0", messages_dir / "s0.jsonl", [],
+                                                     [{"fingerprint": i, "timestamp": i} for i in range(10)], 3))
+    mess.write_conversation(mess.FetchedConversation("s1", messages_dir / "s1.jsonl", [],
+                                                     [{"fingerprint": i, "timestamp": i} for i in range(14)], 3))
+    users_file.parent.mkdir()
+    users_file.write_text(json.dumps({"email": "U0@x.com"}) + "\n")
+    # index des emails reconstruit comme au run de users.py
+    users.load_email_index().close()
+
+    conv_est, mess_est, users_est = planner.estimate()
+    # 6 conversations pour 1 page lue: au plus 20 par page, dernière page non atteinte
+    assert conv_est == StageEstimate("conv", None, None, 1.0, 6.0)
+    assert mess_est == StageEstimate("mess", 4, 12, 3.0, 4.0)
+    assert users_est == StageEstimate("users", 2, 2, 1.0, 1.0)
+
+    conv.save_state({"next_page": 2, "complete": True})
+    conv_est = planner.estimate_conv()
+    # dernière page atteinte: relecture --upsert, au plus une fenêtre de pages
+    assert conv_est == StageEstimate("conv", conv.DEFAULT_UPSERT_PAGES, conv.DEFAULT_UPSERT_PAGES, 1.0,
+                                     planner.CONV_REFRESH_YIELD, upsert=True)
+
+    plans = allocate([conv_est, mess_est, users_est], 10)
+    # mess d'abord (4 messages par requête), le reste pour users puis conv
+    assert plans["mess"] == planner.StagePlan("mess", 10, 3, 40)
+    assert plans["users"].requests == 0 and plans["conv"].requests == 0
+    plans = allocate([conv_est, mess_est, users_est], 100)
+    assert (plans["mess"].requests, plans["mess"].nb, plans["users"].requests, plans["users"].nb) == (12, 4, 2, 2)
+    assert plans["conv"] == planner.StagePlan("conv", 50, 50 * planner.CONV_PAGE_SIZE, 25,
+                                              ("--upsert", "--upsert-pages", "50"))
+    assert planner.stage_command(plans["conv"], [])[2:] == [
+        "--nb", "1000", "--max-requests", "50", "--upsert", "--upsert-pages", "50"]
+
+    command = planner.stage_command(plans["users"], ["--cache", "on"])
+    assert command[1:] == [str(ROOT / "users.py"), "--nb", "2", "--max-requests", "2", "--cache", "on"]
+
+
+def test_open_ended_conv_share_is_capped():
+    estimates = [StageEstimate("conv", None, None, 1.0, 20.0),
+                 StageEstimate("mess", 4, 12, 3.0, 4.0),
+                 StageEstimate("users", 2, 2, 1.0, 1.0)]
+    plans = allocate(estimates, 1000)
+    assert plans["conv"].requests == 250 and plans["conv"].nb == 250 * planner.CONV_PAGE_SIZE
+    assert (plans["mess"].requests, plans["users"].requests) == (12, 2)
+
+
+def test_only_shared_options_are_forwarded():
+    assert planner.stage_options(["--cache", "on", "--retries", "5", "--cold"]) == [
+        "--cache", "on", "--retries", "5", "--cold"]
+    for extra in (["--upsert"], ["--order", "recent"], ["--refresh", "10"], ["--max-requests", "3"]):
+        with pytest.raises(ValueError):
+            planner.stage_options(extra)
+
+
+def test_estimate_is_read_only(tmp_path, monkeypatch):
+    conv_file = tmp_path / "conversations" / "conversations.jsonl"
+    messages_dir = conv_file.parent / "messages"
+    users_file = tmp_path / "utilisateurs" / "utilisateurs.jsonl"
+    monkeypatch.setattr(conv, "CONV_FILE", conv_file)
+    monkeypatch.setattr(conv, "STATE_FILE", conv_file.parent / "conversations.jsonl.state.json")
+    monkeypatch.setattr(mess, "CONVS_FILE", conv_file)
+    monkeypatch.setattr(mess, "MESS_DIR", messages_dir)
+    monkeypatch.setattr(mess, "STATE_FILE", messages_dir / "messages.jsonl.state.json")
+    monkeypatch.setattr(users, "CONV_FILE", conv_file)
+    monkeypatch.setattr(users, "USERS_DIR", users_file.parent)
+    monkeypatch.setattr(users, "USERS_FILE", users_file)
+    conv_file.parent.mkdir()
+    conv_file.write_text(json.dumps({"session_id": "s0", "meta": {"email": "a@x.com"}}) + "\n")
+
+    before = sorted(tmp_path.rglob("*"))
+    assert planner.estimate()[1] == StageEstimate("mess", 1, 2, 2.0, 5.0)
+    assert sorted(tmp_path.rglob("*")) == before
+
+    # index existant: lu sans être modifié
+    mess.write_conversation(mess.FetchedConversation("s0", messages_dir / "s0.jsonl", [],
+                                                     [{"fingerprint": 1, "timestamp": 1}], 2))
+    before = {p: p.stat().st_mtime_ns for p in tmp_path.rglob("*")}
+    assert planner.estimate()[1] == StageEstimate("mess", 1, 2, 2.0, 0.5)
+    assert {p: p.stat().st_mtime_ns for p in tmp_path.rglob("*")} == before
+
+
+def test_users_estimate_reads_stale_email_index_without_parsing_profiles(tmp_path, monkeypatch):
+    conv_file = tmp_path / "conversations.jsonl"
+    users_file = tmp_path / "utilisateurs" / "utilisateurs.jsonl"
+    monkeypatch.setattr(users, "CONV_FILE", conv_file)
+    monkeypatch.setattr(users, "USERS_DIR", users_file.parent)
+    monkeypatch.setattr(users, "USERS_FILE", users_file)
+    conv_file.write_text("".join(json.dumps({"meta": {"email": f"u{i}@x.com"}}) + "\n" for i in range(3)))
+    users_file.parent.mkdir()
+    users_file.write_text(json.dumps({"email": "u0@x.com"}) + "\n")
+    users.load_email_index().close()
+    # profil ajouté après l'index: index périmé, lu tel quel
+    with users_file.open("a") as f:
+        f.write(json.dumps({"email": "u1@x.com"}) + "\n")
+
+    monkeypatch.setattr(users, "read_existing_users", None)
+    assert planner.estimate_users() == StageEstimate("users", 2, 2, 1.0, 1.0)
@@ -0,0 +1,94 @@
+import json
+import sys
+from pathlib import Path
+
+import pytest
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT))
+
+import projection
+from projection import Projection, cold_path_for, merge, read_cold
+import mess
+import users
+from emailindex import EmailIndex, index_path_for
+
+
+@pytest.fixture(autouse=True)
+def no_projection():
+    yield
+    projection.configure()
+
+
+def test_split_keeps_required_fields_and_merge_restores_record():
+    spec = Projection({"conversation": ["meta.nickname", "messages.text"]})
+    conv = {
+        "session_id": "s1",
+        "active": {"last": 5, "now": True},
+        "meta": {"email": "a@x.com", "nickname": "A", "device": {"os": "linux"}},
+        "messages": [{"text": "bonjour", "raw": "x"}, {"raw": "y"}, "libre"],
+        "participants": [1, 2],
+        "state": "resolved",
+    }
+    hot, cold = spec.split("conversation", conv)
+    assert hot == {
+        "session_id": "s1",
+        "active": {"last": 5},
+        "meta": {"email": "a@x.com", "nickname": "A"},
+        "messages": [{"text": "bonjour"}, None, "libre"],
+        "state": "resolved",
+    }
+    assert cold == {
+        "active": {"now": True},
+        "meta": {"device": {"os": "linux"}},
+        "messages": [{"raw": "x"}, {"raw": "y"}, None],
+        "participants": [1, 2],
+    }
+    assert merge(hot, cold) == conv
+    # type absent de la spécification: gardé en entier
+    assert spec.split("message", {"fingerprint": 1, "x": 2}) == ({"fingerprint": 1, "x": 2}, None)
+    with pytest.raises(ValueError):
+        Projection({"autre": ["x"]})
+    with pytest.raises(ValueError):
+        Projection({"message": ["user..nickname"]})
+
+
+def test_scripts_store_projected_records_and_cold_parts(tmp_path, monkeypatch):
+    convs_file = tmp_path / "conversations" / "conversations.jsonl"
+    messages_dir = tmp_path / "conversations" / "messages"
+    users_file = tmp_path / "utilisateurs" / "utilisateurs.jsonl"
+    for module in (mess, projection):
+        monkeypatch.setattr(module, "CONVS_FILE", convs_file)
+        monkeypatch.setattr(module, "MESS_DIR", messages_dir)
+    monkeypatch.setattr(projection, "USERS_FILE", users_file)
+    monkeypatch.setattr(users, "CONV_FILE", convs_file)
+    monkeypatch.setattr(users, "USERS_DIR", users_file.parent)
+    monkeypatch.setattr(users, "USERS_FILE", users_file)
+
+    spec_file = tmp_path / "projection.json"
+    spec_file.write_text(json.dumps({"message": ["user.nickname"], "profile": ["person.nickname"]}))
+    projection.configure(spec_file, cold=True)
+
+    msg = {"fingerprint": 7, "timestamp": 3, "content": "salut", "user": {"nickname": "A", "user_id": "u1"},
+           "read": "chat", "mentions": []}
+    msg_file = messages_dir / "s1.jsonl"
+    mess.write_conversation(mess.FetchedConversation("s1", msg_file, [], [msg]))
+    stored = json.loads(msg_file.read_text(encoding="utf-8"))
+    assert stored == {"fingerprint": 7, "timestamp": 3, "content": "salut", "user": {"nickname": "A"}}
+    assert cold_path_for(messages_dir) == tmp_path / "conversations" / "messages.cold.jsonl"
+    assert read_cold(cold_path_for(messages_dir)) == {
+        "s1:7": {"user": {"user_id": "u1"}, "read": "chat", "mentions": []}}
+
+    # email hors des champs requis: profil gardé en entier
+    email_index = EmailIndex(index_path_for(users_file))
+    users.append_user({"email": "B@x.com", "person": {"nickname": "B"}, "segments": ["vip"]}, "B@x.com", email_index)
+    users.append_user({"contact": "c@x.com", "segments": []}, "c@x.com", email_index)
+    assert [json.loads(l) for l in users_file.read_text(encoding="utf-8").splitlines()] == [
+        {"email": "B@x.com", "person": {"nickname": "B"}},
+        {"contact": "c@x.com", "segments": []},
+    ]
+    assert read_cold(cold_path_for(users_file), "profile") == {"b@x.com": {"segments": ["vip"]}}
+
+    assert list(projection._restored_lines("message")) == [msg]
+    assert list(projection._restored_lines("profile"))[0] == {
+        "email": "B@x.com", "person": {"nickname": "B"}, "segments": ["vip"]}
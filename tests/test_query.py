@@ -0,0 +1,79 @@
+import sys
+import json
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT))
+
+import mess
+import query
+import users
+
+
+def setup_paths(tmp_path, monkeypatch):
+    convs_file = tmp_path / "conversations" / "conversations.jsonl"
+    messages_dir = tmp_path / "conversations" / "messages"
+    users_file = tmp_path / "utilisateurs" / "utilisateurs.jsonl"
+    for module in (mess, query):
+        monkeypatch.setattr(module, "CONVS_FILE", convs_file)
+        monkeypatch.setattr(module, "MESS_DIR", messages_dir)
+    monkeypatch.setattr(query, "USERS_FILE", users_file)
+    monkeypatch.setattr(users, "USERS_DIR", users_file.parent)
+    monkeypatch.setattr(users, "USERS_FILE", users_file)
+    return convs_file, messages_dir, users_file
+
+
+def test_messages_range_uses_index_written_by_mess(tmp_path, monkeypatch):
+    convs_file, messages_dir, _ = setup_paths(tmp_path, monkeypatch)
+    msg_file = messages_dir / "s1.jsonl"
+    new = [{"fingerprint": i, "timestamp": 1000 + 10 * i, "content": f"é{i}"} for i in range(20)]
+    mess.write_conversation(mess.FetchedConversation("s1", msg_file, [], new))
+
+    index = query.ArchiveIndex(query.index_path_for(convs_file))
+    path, count, newest, oldest = index.message_file("s1")
+    assert (path, count, newest, oldest) == (msg_file, 20, 1190, 1000)
+
+    found = list(query.read_messages_range(msg_file, since=1050, until=1100))
+    assert [m["fingerprint"] for m in found] == [9, 8, 7, 6, 5]
+    assert len(list(query.read_messages_range(msg_file))) == 20
+    assert list(query.read_messages_range(msg_file, since=5000)) == []
+
+    # un index reconstruit depuis le fichier est identique à celui écrit par mess
+    idx_bytes = query.message_index_path(msg_file).read_bytes()
+    query.index_messages_file(msg_file)
+    assert query.message_index_path(msg_file).read_bytes() == idx_bytes
+
+
+def test_sessions_and_profiles_lookup(tmp_path, monkeypatch):
+    convs_file, _, users_file = setup_paths(tmp_path, monkeypatch)
+    index = query.ArchiveIndex(query.index_path_for(convs_file))
+    index.update_sessions([("s1", "A@x.com", 10), ("s2", "a@x.com ", 30), ("s3", "b@x.com", 20)])
+    assert index.sessions_for_email("a@X.com") == [("s2", 30), ("s1", 10)]
+    # une conversation mise à jour remplace l'ancienne entrée
+    index.update_sessions([("s1", "b@x.com", 40)])
+    assert index.sessions_for_email("b@x.com") == [("s1", 40), ("s3", 20)]
+
+    users_map = {e: {"email": e, "nom": "é"} for e in ("c@x.com", "B@x.com", "a@x.com")}
+    users.save_users_sorted(users_map)
+    profiles = query.ArchiveIndex(query.profile_index_path_for(users_file))
+    offset, length = profiles.profile_location("b@x.com")
+    with users_file.open("rb") as f:
+        f.seek(offset)
+        assert json.loads(f.read(length)) == users_map["B@x.com"]
+    assert profiles.profile_location("absent@x.com") is None
+
+
+def test_shared_archive_index_is_not_reopened_per_conversation(tmp_path, monkeypatch):
+    convs_file, messages_dir, _ = setup_paths(tmp_path, monkeypatch)
+    archive = query.ArchiveIndex(query.index_path_for(convs_file))
+    text_index = mess.fulltext.FullTextIndex(mess.fulltext.index_path_for(messages_dir))
+    opened = []
+    monkeypatch.setattr(query.ArchiveIndex, "__init__", lambda self, path: opened.append(path))
+    monkeypatch.setattr(mess.fulltext.FullTextIndex, "__init__", lambda self, path: opened.append(path))
+    for sid in ("s1", "s2"):
+        mess.write_conversation(mess.FetchedConversation(
+            sid, messages_dir / f"{sid}.jsonl", [], [{"fingerprint": 1, "timestamp": 1}], 2), archive, text_index)
+    assert opened == []
+    assert sorted(text_index.indexed_files()) == ["s1", "s2"]
+    assert archive.message_file("s2")[1] == 1
+    assert archive.fetch_totals() == (2, 4, 2)
@@ -66,3 +66,45 @@ def test_extract_email_from_conversation_and_person(tmp_path, monkeypatch):
     lines = [json.loads(l) for l in ufile.read_text(encoding="utf-8").splitlines() if l.strip()]
     emails_out = sorted([users.extract_email_from_person(o) for o in lines])
     assert emails_out == ["a@example.com", "b@example.com"]
+
+
+def test_parallel_chunked_scan_keeps_first_seen_order(tmp_path, monkeypatch):
+    conv_file = tmp_path / "conversations.jsonl"
+    lines = []
+    for i in range(300):
+        if i % 7 == 0:
+            lines.append(json.dumps({"meta": {"nickname": "sans email"}}))
+        elif i % 11 == 0:
+            lines.append("{malformée")
+        else:
+            lines.append(make_conv_line(f"u{(i * 37) % 50}@example.com"))
+    conv_file.write_text("\n".join(lines), encoding="utf-8")  # pas de fin de ligne finale
+    monkeypatch.setattr(users, "CONV_FILE", conv_file)
+
+    expected = []
+    for line in lines:
+        try:
+            email = users.extract_email_from_conv(json.loads(line))
+        except ValueError:
+            continue
+        if email and email not in expected:
+            expected.append(email)
+
+    assert users.load_emails_from_conversations(workers=1) == expected
+    assert users.load_emails_from_conversations(workers=3, chunk_bytes=500, parallel_min_bytes=0) == expected
+
+
+def test_reset_removes_users_file_and_its_indexes(tmp_path, monkeypatch):
+    users_file = tmp_path / "utilisateurs" / "utilisateurs.jsonl"
+    monkeypatch.setattr(users, "USERS_DIR", users_file.parent)
+    monkeypatch.setattr(users, "USERS_FILE", users_file)
+    users_file.parent.mkdir()
+    names = ["utilisateurs.jsonl", "utilisateurs.jsonl.emails", "utilisateurs.jsonl.emails.new",
+             "utilisateurs.jsonl.index.sqlite", "utilisateurs.cold.jsonl"]
+    for name in names:
+        (users_file.parent / name).write_text("x")
+    (users_file.parent / "autre.jsonl").write_text("x")
+
+    assert sorted(p.name for p in users.reset_files()) == sorted(names)
+    assert [p.name for p in users_file.parent.iterdir()] == ["autre.jsonl"]
+    assert users.reset_files() == []
@@ -0,0 +1,198 @@
+import sys
+import json
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT))
+
+import mess
+from workqueue import WorkQueue
+
+
+class DummyResponse:
+    def __init__(self, status_code, json_data=None, text=""):
+        self.status_code = status_code
+        self._json = json_data
+        self.text = text
+
+    def json(self):
+        return self._json
+
+
+def test_claim_complete_and_enqueue_idempotent(tmp_path):
+    q = WorkQueue(tmp_path / "q.sqlite")
+    assert q.enqueue(["s1", "s2"]) == 2
+    assert q.enqueue(["s2", "s3"]) == 1
+
+    # deux workers ne reçoivent jamais la même tâche
+    assert q.claim("w1") == "s1"
+    assert q.claim("w2") == "s2"
+    assert q.complete("s1", "w1")
+    # w1 ne peut pas terminer la tâche de w2
+    assert not q.complete("s2", "w1")
+    assert q.counts() == {"done": 1, "leased": 1, "pending": 1}
+
+
+def test_expired_lease_is_reclaimed(tmp_path):
+    q = WorkQueue(tmp_path / "q.sqlite", lease_seconds=-1)
+    q.enqueue(["s1"])
+    assert q.claim("dead") == "s1"
+    # le bail est déjà expiré: un autre worker reprend la tâche
+    assert q.claim("w2") == "s1"
+    assert not q.heartbeat("s1", "dead")
+    assert q.complete("s1", "w2")
+    assert q.claim("w3") is None
+
+
+def test_process_conversations_queue_mode(tmp_path, monkeypatch):
+    convs_dir = tmp_path / "conversations"
+    convs_dir.mkdir()
+    convs_file = convs_dir / "conversations.jsonl"
+    convs_file.write_text("\n".join(json.dumps({"session_id": s}) for s in ("s1", "s2")) + "\n")
+    messages_dir = convs_dir / "messages"
+    monkeypatch.setattr(mess, "CONVS_FILE", convs_file)
+    monkeypatch.setattr(mess, "MESS_DIR", messages_dir)
+    monkeypatch.setattr(mess, "STATE_FILE", messages_dir / "messages.jsonl.state.json")
+    monkeypatch.setattr(mess, "QUEUE_FILE", messages_dir / "messages.queue.sqlite")
+    monkeypatch.setattr(mess.requests, "get", lambda url, headers, auth, params, timeout: DummyResponse(200, []))
+    monkeypatch.setenv("CRISP_IDENTIFIER_PROD", "id")
+    monkeypatch.setenv("CRISP_KEY_PROD", "key")
+    monkeypatch.setenv("ID_SITE_CRISP", "w1")
+
+    mess.process_conversations(nb=1, use_queue=True, worker_id="a")
+    mess.process_conversations(nb=5, use_queue=True, worker_id="b")
+
+    assert (messages_dir / "s1.jsonl").exists()
+    assert (messages_dir / "s2.jsonl").exists()
+    assert WorkQueue(messages_dir / "messages.queue.sqlite").counts() == {"done": 2}
+
+
+
+def test_result_not_written_after_lease_lost(tmp_path, monkeypatch):
+    convs_dir = tmp_path / "conversations"
+    convs_dir.mkdir()
+    convs_file = convs_dir / "conversations.jsonl"
+    convs_file.write_text(json.dumps({"session_id": "s1"}) + "\n")
+    messages_dir = convs_dir / "messages"
+    queue_file = messages_dir / "messages.queue.sqlite"
+    monkeypatch.setattr(mess, "CONVS_FILE", convs_file)
+    monkeypatch.setattr(mess, "MESS_DIR", messages_dir)
+    monkeypatch.setattr(mess, "QUEUE_FILE", queue_file)
+    monkeypatch.setenv("CRISP_IDENTIFIER_PROD", "id")
+    monkeypatch.setenv("CRISP_KEY_PROD", "key")
+    monkeypatch.setenv("ID_SITE_CRISP", "w1")
+
+    def fetch_then_lose_lease(website_id, session_id, auth, on_page=None):
+        # bail expiré pendant l'attente dans la file d'écriture: un autre worker reprend la tâche
+        assert WorkQueue(queue_file).claim("b") == session_id
+        return mess.FetchedConversation(session_id, messages_dir / f"{session_id}.jsonl", [],
+                                        [{"fingerprint": 1, "timestamp": 1}], 1)
+
+    monkeypatch.setattr(mess, "fetch_conversation", fetch_then_lose_lease)
+    mess.process_conversations(nb=1, use_queue=True, worker_id="a", lease_seconds=-1)
+
+    assert not (messages_dir / "s1.jsonl").exists()
+    assert WorkQueue(queue_file).counts() == {"leased": 1}
+
+def test_priority_order_migration_and_reopen(tmp_path):
+    import sqlite3
+    import time
+
+    # file créée par une version sans colonne priority
+    path = tmp_path / "q.sqlite"
+    conn = sqlite3.connect(str(path))
+    conn.executescript(
+        "CREATE TABLE tasks (session_id TEXT PRIMARY KEY, position INTEGER NOT NULL,"
+        " status TEXT NOT NULL DEFAULT 'pending', owner TEXT, lease_until REAL,"
+        " attempts INTEGER NOT NULL DEFAULT 0, done_at REAL);"
+        "INSERT INTO tasks (session_id, position, status, done_at) VALUES ('old', 0, 'done', 1000);"
+    )
+    conn.commit()
+    conn.close()
+
+    q = WorkQueue(path)
+    now_ms = int(time.time() * 1000)
+    counts = q.schedule([("a", 10, now_ms), ("b", 30, now_ms), ("c", 20, now_ms), ("old", 5, 999_000)])
+    # "old" n'a pas eu d'activité après sa fin: pas remise en attente
+    assert counts == {"added": 3, "reopened": 0}
+    assert [q.claim("w") for _ in range(3)] == ["b", "c", "a"]
+    for sid in ("a", "b", "c"):
+        assert q.complete(sid, "w")
+
+    # activité postérieure à la fin: remise en attente; re-priorisation
+    counts = q.schedule([("old", 1, 1_000_001), ("a", 1, 0), ("d", 50, 0)])
+    assert counts == {"added": 1, "reopened": 1}
+    assert [q.claim("w"), q.claim("w"), q.claim("w")] == ["d", "old", None]
+    assert set(q.sync_times()) == {"old", "a", "b", "c"}
+
+
+def test_process_conversations_recent_order(tmp_path, monkeypatch):
+    convs_dir = tmp_path / "conversations"
+    convs_dir.mkdir()
+    convs_file = convs_dir / "conversations.jsonl"
+    convs = [
+        {"session_id": "idle", "state": "resolved", "active": {"last": 10}},
+        {"session_id": "hot", "state": "resolved", "active": {"last": 30}},
+        {"session_id": "open", "state": "unresolved", "active": {"last": 20}},
+        {"session_id": "unread", "state": "resolved", "unread": {"operator": 2}, "active": {"last": 5}},
+    ]
+    convs_file.write_text("\n".join(json.dumps(c) for c in convs) + "\n")
+    messages_dir = convs_dir / "messages"
+    monkeypatch.setattr(mess, "CONVS_FILE", convs_file)
+    monkeypatch.setattr(mess, "MESS_DIR", messages_dir)
+    monkeypatch.setattr(mess, "QUEUE_FILE", messages_dir / "messages.queue.sqlite")
+    fetched = []
+
+    def fake_get(url, headers, auth, params, timeout):
+        fetched.append(url.split("/conversation/")[1].split("/")[0])
+        return DummyResponse(200, [])
+
+    monkeypatch.setattr(mess.requests, "get", fake_get)
+    monkeypatch.setenv("CRISP_IDENTIFIER_PROD", "id")
+    monkeypatch.setenv("CRISP_KEY_PROD", "key")
+    monkeypatch.setenv("ID_SITE_CRISP", "w1")
+
+    # run interrompu après 2 conversations: les plus récentes sont exportées d'abord
+    mess.process_conversations(nb=2, order="recent", worker_id="a")
+    assert fetched == ["hot", "open"]
+    # reprise: l'ordre "open" fait passer les non lues avant les autres
+    mess.process_conversations(nb=5, order="open", worker_id="a")
+    assert fetched == ["hot", "open", "unread", "idle"]
+
+
+def test_reopened_task_resync_stops_at_known_messages(tmp_path, monkeypatch):
+    convs_dir = tmp_path / "conversations"
+    convs_dir.mkdir()
+    convs_file = convs_dir / "conversations.jsonl"
+    convs_file.write_text(json.dumps({"session_id": "s1", "active": {"last": 10}}) + "\n")
+    messages_dir = convs_dir / "messages"
+    monkeypatch.setattr(mess, "CONVS_FILE", convs_file)
+    monkeypatch.setattr(mess, "MESS_DIR", messages_dir)
+    monkeypatch.setattr(mess, "QUEUE_FILE", messages_dir / "messages.queue.sqlite")
+    monkeypatch.setattr(mess.time, "sleep", lambda s: None)
+    history = [{"fingerprint": ts, "timestamp": ts} for ts in (60, 50, 40, 30, 20, 10)]
+    calls = []
+
+    def fake_get(url, headers, auth, params, timeout):
+        # pages de 2 messages, des plus récents aux plus anciens
+        before = params.get("timestamp_before")
+        calls.append(before)
+        older = [m for m in history if before is None or m["timestamp"] < before]
+        return DummyResponse(200, older[:2])
+
+    monkeypatch.setattr(mess.requests, "get", fake_get)
+    monkeypatch.setenv("CRISP_IDENTIFIER_PROD", "id")
+    monkeypatch.setenv("CRISP_KEY_PROD", "key")
+    monkeypatch.setenv("ID_SITE_CRISP", "w1")
+
+    # premier export: 3 pages puis la page vide
+    mess.process_conversations(nb=5, order="stale", worker_id="a")
+    assert len(calls) == 4
+
+    # nouveau message, tâche rouverte par l'ordre "stale": une seule page relue
+    history.insert(0, {"fingerprint": 70, "timestamp": 70})
+    calls.clear()
+    mess.process_conversations(nb=5, order="stale", worker_id="a")
+    assert calls == [None]
+    lines = (messages_dir / "s1.jsonl").read_text().splitlines()
+    assert sorted(json.loads(l)["fingerprint"] for l in lines) == [10, 20, 30, 40, 50, 60, 70]
@@ -0,0 +1,40 @@
+import sys
+import threading
+from pathlib import Path
+
+import pytest
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT))
+
+from writer import BackgroundWriter
+
+
+def test_items_are_handled_in_order_and_flushed_by_batch():
+    handled = []
+    flushes = []
+    release = threading.Event()
+
+    def handle(item):
+        release.wait(5)
+        handled.append(item)
+
+    with BackgroundWriter(handle, lambda: flushes.append(len(handled)), max_pending=10, batch_size=4) as w:
+        for i in range(10):
+            w.submit(i)
+        release.set()
+
+    assert handled == list(range(10))
+    # un flush par lot, le dernier après tous les éléments
+    assert flushes[-1] == 10
+    assert len(flushes) < 10
+
+
+def test_writer_error_is_raised_in_caller():
+    def handle(item):
+        raise OSError("disque plein")
+
+    w = BackgroundWriter(handle)
+    w.submit(1)
+    with pytest.raises(OSError):
+        w.close()
@@ -7,8 +7,10 @@ Script pour exporter les profils utilisateurs depuis l'API Crisp.
 Comportement:
 - Lit les conversations dans `conversations/conversations.jsonl` et extrait les emails
 - Vérifie si l'utilisateur est déjà présent dans `utilisateurs/utilisateurs.jsonl`
+  (via l'index trié des emails `utilisateurs.jsonl.emails`, voir emailindex.py)
 - Appelle l'API Crisp pour récupérer le profil si absent et l'ajoute au fichier
 - Gère --nb (nombre max d'utilisateurs à récupérer, défaut 50) et --reset
+- Options --projection / --cold : ne stocker que certains champs des profils (voir projection.py)
 - Affiche la progression (email traité) et un récapitulatif final
 
 Variables d'environnement attendues:
@@ -23,13 +25,24 @@ Une réponse HTTP 200 ou 206 est considérée valide. 429 est géré comme quota
 
 import os
 import sys
-import json
 import time
 import argparse
+import heapq
+import mmap
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
-from typing import Optional, Dict, Any, Set, List
+from typing import Optional, Dict, Any, Set, List, Iterable, Iterator, Tuple
 import requests
 
+import changefeed
+import crisp_api
+import jsoncodec
+import projection
+import query
+from emailindex import EmailIndex, index_path_for as email_index_path_for
+from extsort import sort_lines, DEFAULT_BUFFER_BYTES
+from records import extract_email_from_conv, extract_email_from_person
+
 
 # Répertoires et fichiers (possibilité d'overrider dans les tests via monkeypatch)
 ROOT_DIR = Path(__file__).resolve().parents[0]
@@ -38,6 +51,14 @@ CONV_FILE = CONV_DIR / "conversations.jsonl"
 USERS_DIR = ROOT_DIR / "utilisateurs"
 USERS_FILE = USERS_DIR / "utilisateurs.jsonl"
 
+# Analyse de conversations.jsonl: taille des morceaux, et taille minimale du fichier
+# pour une analyse en parallèle (en dessous, le coût du pool de processus domine)
+DEFAULT_SCAN_CHUNK_BYTES = 16 * 1024 * 1024
+PARALLEL_SCAN_MIN_BYTES = 64 * 1024 * 1024
+
+# Âge par défaut (jours) au-delà duquel un profil est à rafraîchir (--refresh)
+DEFAULT_MAX_AGE_DAYS = 30.0
+
 # Headers requis par l'API
 HEADERS = {
     "Content-Type": "application/json",
@@ -45,32 +66,6 @@ HEADERS = {
 }
 
 
-def extract_email_from_conv(obj: Dict[str, Any]) -> Optional[str]:
-    """Extrait l'email depuis un objet conversation. Selon le .jsonl fourni,
-    l'email se trouve dans la clé `meta.email` à la racine ou dans `data.meta.email`.
-    Retourne None si introuvable.
-    """
-    if not isinstance(obj, dict):
-        return None
-    # cas courant: meta.email à la racine
-    meta = obj.get("meta")
-    if isinstance(meta, dict):
-        email = meta.get("email")
-        if isinstance(email, str) and email.strip():
-            return email.strip()
-
-    # autre forme: data -> meta -> email
-    data = obj.get("data")
-    if isinstance(data, dict):
-        meta2 = data.get("meta")
-        if isinstance(meta2, dict):
-            email = meta2.get("email")
-            if isinstance(email, str) and email.strip():
-                return email.strip()
-
-    return None
-
-
 def read_existing_users() -> Dict[str, Dict[str, Any]]:
     """Lit le fichier utilisateurs.jsonl existant et renvoie un mapping email->obj.
     Ignorer les lignes malformées.
@@ -78,13 +73,13 @@ def read_existing_users() -> Dict[str, Dict[str, Any]]:
     res: Dict[str, Dict[str, Any]] = {}
     if not USERS_FILE.exists():
         return res
-    with USERS_FILE.open("r", encoding="utf-8") as f:
+    with USERS_FILE.open("rb") as f:
         for line in f:
             line = line.strip()
             if not line:
                 continue
             try:
-                obj = json.loads(line)
+                obj = jsoncodec.loads(line)
             except Exception:
                 continue
             email = extract_email_from_person(obj)
@@ -93,29 +88,6 @@ def read_existing_users() -> Dict[str, Dict[str, Any]]:
     return res
 
 
-def extract_email_from_person(obj: Dict[str, Any]) -> Optional[str]:
-    """Extrait l'email depuis un objet person retourné par l'API (ou stocké).
-    Selon la doc l'email peut être à la racine sous 'email' ou sous 'data'... On gère
-    les cas simples.
-    """
-    if not isinstance(obj, dict):
-        return None
-    e = obj.get("email")
-    if isinstance(e, str) and e.strip():
-        return e.strip()
-    # parfois sous 'data' -> 'email' ou 'attributes'
-    d = obj.get("data")
-    if isinstance(d, dict):
-        e2 = d.get("email")
-        if isinstance(e2, str) and e2.strip():
-            return e2.strip()
-    # fallback: search any top-level string value containing '@'
-    for k, v in obj.items():
-        if isinstance(v, str) and "@" in v:
-            return v.strip()
-    return None
-
-
 def call_person_api(website_id: str, people_id: str, auth) -> Optional[requests.Response]:
     """Appelle l'API Crisp pour récupérer le profil d'un people_id (ici email encodé dans l'URL).
     Retourne la Response ou None en cas d'exception.
@@ -126,52 +98,310 @@ def call_person_api(website_id: str, people_id: str, auth) -> Optional[requests.
     pid = quote(people_id, safe="")
     url = f"https://api.crisp.chat/v1/website/{website_id}/people/profile/{pid}"
     try:
-        resp = requests.get(url, headers=HEADERS, auth=auth, timeout=30)
+        resp = crisp_api.get(url, headers=HEADERS, auth=auth)
         return resp
     except requests.RequestException as e:
         print(f"Erreur réseau lors de l'appel API pour {people_id}: {e}")
         return None
 
 
-def load_emails_from_conversations() -> List[str]:
-    """Parcourt le fichier conversations.jsonl et retourne la liste d'emails (avec duplicates).
-    On lit ligne à ligne pour limiter la mémoire.
+def chunk_bounds(mm: mmap.mmap, chunk_bytes: int) -> List[Tuple[int, int]]:
+    """Découpe un fichier mappé en morceaux d'environ `chunk_bytes` alignés sur les fins de ligne."""
+    bounds: List[Tuple[int, int]] = []
+    start, size = 0, len(mm)
+    while start < size:
+        end = mm.find(b"\n", min(start + chunk_bytes, size) - 1)
+        end = size if end == -1 else end + 1
+        bounds.append((start, end))
+        start = end
+    return bounds
+
+
+def scan_emails_chunk(path: str, start: int, end: int) -> List[str]:
+    """Emails (sans doublons, dans l'ordre) des conversations situées entre les octets
+    `start` et `end` du fichier. Exécuté dans les processus du pool.
     """
     emails: List[str] = []
-    if not CONV_FILE.exists():
-        return emails
-    with CONV_FILE.open("r", encoding="utf-8") as f:
-        for line in f:
-            line = line.strip()
-            if not line:
+    seen: Set[str] = set()
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        pos = start
+        while pos < end:
+            nl = mm.find(b"\n", pos, end)
+            line_end = end if nl == -1 else nl
+            line = mm[pos:line_end]
+            pos = line_end + 1
+            # pré-filtre: une ligne sans clé "email" ne peut pas fournir d'email
+            if b'"email"' not in line:
                 continue
             try:
-                obj = json.loads(line)
+                obj = jsoncodec.loads(line)
             except Exception:
                 continue
             email = extract_email_from_conv(obj)
-            if email:
+            if email and email not in seen:
+                seen.add(email)
+                emails.append(email)
+    return emails
+
+
+def load_emails_from_conversations(workers: Optional[int] = None,
+                                   chunk_bytes: int = DEFAULT_SCAN_CHUNK_BYTES,
+                                   parallel_min_bytes: int = PARALLEL_SCAN_MIN_BYTES) -> List[str]:
+    """Parcourt le fichier conversations.jsonl et retourne la liste d'emails sans doublons,
+    dans l'ordre de première apparition.
+
+    Le fichier est mappé en mémoire et découpé en morceaux alignés sur les lignes, analysés
+    en parallèle par un pool de processus (`workers`, défaut: nombre de CPU). Les résultats
+    sont fusionnés dans l'ordre des morceaux au fil de l'eau. Les petits fichiers (moins de
+    `parallel_min_bytes`) ou `workers=1` sont analysés dans le processus courant.
+    """
+    if not CONV_FILE.exists() or CONV_FILE.stat().st_size == 0:
+        return []
+    workers = workers or os.cpu_count() or 1
+    with CONV_FILE.open("rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        bounds = chunk_bounds(mm, chunk_bytes)
+
+    path = str(CONV_FILE)
+    if workers <= 1 or len(bounds) <= 1 or CONV_FILE.stat().st_size < parallel_min_bytes:
+        results: Iterable[List[str]] = (scan_emails_chunk(path, start, end) for start, end in bounds)
+        return _dedup_ordered(results)
+
+    with ProcessPoolExecutor(max_workers=min(workers, len(bounds))) as pool:
+        # map() rend les résultats dans l'ordre des morceaux, dès qu'ils sont disponibles
+        results = pool.map(scan_emails_chunk, [path] * len(bounds),
+                           [start for start, _ in bounds], [end for _, end in bounds])
+        return _dedup_ordered(results)
+
+
+def _dedup_ordered(chunks: Iterable[List[str]]) -> List[str]:
+    emails: List[str] = []
+    seen: Set[str] = set()
+    for chunk in chunks:
+        for email in chunk:
+            if email not in seen:
+                seen.add(email)
                 emails.append(email)
     return emails
 
 
-def save_users_sorted(users_map: Dict[str, Dict[str, Any]]) -> None:
+def save_users_sorted(users_map: Dict[str, Dict[str, Any]], buffer_bytes: int = DEFAULT_BUFFER_BYTES) -> None:
     """Sauve le mapping email->obj dans USERS_FILE trié par email alphabétique.
-    Réécrit entièrement le fichier.
+    Réécrit entièrement le fichier. Le tri passe par un tri externe borné par
+    `buffer_bytes` (débordement sur disque au-delà).
+    """
+    items = ((e.lower(), jsoncodec.dumpb(obj)) for e, obj in users_map.items())
+    write_users_sorted(items, buffer_bytes)
+
+
+def sort_users_file(buffer_bytes: int = DEFAULT_BUFFER_BYTES, dedup: bool = False,
+                    email_index: Optional[EmailIndex] = None) -> None:
+    """Trie USERS_FILE par email alphabétique sans le charger en mémoire.
+    Les lignes sont relues en flux et recopiées telles quelles (lignes malformées ignorées).
+    Avec `dedup`, seule la dernière ligne de chaque email (insensible à la casse) est gardée.
+    `email_index`: index des emails déjà ouvert par l'appelant (voir write_users_sorted).
+    """
+    if not USERS_FILE.exists():
+        return
+
+    def items() -> Iterator[Tuple[str, bytes]]:
+        with USERS_FILE.open("rb") as f:
+            for raw in f:
+                line = raw.strip()
+                if not line:
+                    continue
+                try:
+                    obj = jsoncodec.loads(line)
+                except Exception:
+                    continue
+                email = extract_email_from_person(obj)
+                if email:
+                    yield email.lower(), line
+
+    write_users_sorted(items(), buffer_bytes, dedup=dedup, email_index=email_index)
+
+
+def _keep_last(sorted_items: Iterable[Tuple[str, bytes]]) -> Iterator[Tuple[str, bytes]]:
+    """Pour des couples triés de façon stable, ne garde que le dernier de chaque clé."""
+    previous: Optional[Tuple[str, bytes]] = None
+    for item in sorted_items:
+        if previous is not None and previous[0] != item[0]:
+            yield previous
+        previous = item
+    if previous is not None:
+        yield previous
+
+
+def write_users_sorted(items: Iterable[Tuple[str, bytes]], buffer_bytes: int = DEFAULT_BUFFER_BYTES,
+                       dedup: bool = False, email_index: Optional[EmailIndex] = None) -> None:
+    """Écrit les couples (email en minuscules, ligne JSON) triés dans USERS_FILE
+    (via un fichier temporaire remplacé à la fin), puis réécrit l'index des emails
+    et l'index des positions de profils utilisé par query.py.
+
+    `email_index`: index des emails ouvert par l'appelant, réécrit et rouvert sur place
+    (seul descripteur ouvert sur le fichier remplacé) ; à défaut, ouvert puis fermé ici.
     """
     USERS_DIR.mkdir(parents=True, exist_ok=True)
-    emails_sorted = sorted(users_map.keys(), key=lambda s: s.lower())
-    with USERS_FILE.open("w", encoding="utf-8") as f:
-        for e in emails_sorted:
-            obj = users_map[e]
-            f.write(json.dumps(obj, ensure_ascii=False) + "\n")
+    tmp_path = USERS_FILE.with_name(USERS_FILE.name + ".tmp")
+    positions: List[Tuple[str, int, int]] = []
+    offset = 0
+    sorted_items = sort_lines(items, buffer_bytes=buffer_bytes, tmp_dir=USERS_DIR)
+    if dedup:
+        sorted_items = _keep_last(sorted_items)
+    with tmp_path.open("wb") as f:
+        for email, line in sorted_items:
+            positions.append((email, offset, len(line)))
+            offset += len(line) + 1
+            f.write(line)
+            f.write(b"\n")
+    os.replace(tmp_path, USERS_FILE)
+    # conserver les dates de récupération connues (0 pour un profil sans date)
+    owned = email_index is None
+    if owned:
+        email_index = EmailIndex(email_index_path_for(USERS_FILE))
+    entries = [(e, email_index.fetched_at(e) or 0) for e, _, _ in positions]
+    email_index.replace(entries)
+    if owned:
+        email_index.close()
+    query.ArchiveIndex(query.profile_index_path_for(USERS_FILE)).replace_profiles(positions)
+
+
+def reset_files() -> List[Path]:
+    """Supprime le fichier utilisateurs et ses fichiers associés (index des emails,
+    index des profils, fichier froid de la projection). Retourne les fichiers supprimés.
+    """
+    email_index = email_index_path_for(USERS_FILE)
+    paths = [USERS_FILE, email_index, email_index.with_name(email_index.name + ".new"),
+             query.profile_index_path_for(USERS_FILE), projection.cold_path_for(USERS_FILE)]
+    removed = []
+    for path in paths:
+        if path.exists():
+            path.unlink()
+            removed.append(path)
+    return removed
+
+
+def load_email_index(buffer_bytes: int = DEFAULT_BUFFER_BYTES) -> EmailIndex:
+    """Ouvre l'index des emails de USERS_FILE, reconstruit (par un tri du fichier)
+    s'il est absent ou plus ancien que le fichier.
+    """
+    index = EmailIndex(email_index_path_for(USERS_FILE))
+    if not index.is_fresh(USERS_FILE):
+        if USERS_FILE.exists():
+            print("Index des emails absent ou périmé, reconstruction...")
+            # index réécrit et rouvert sur place (aucune autre instance ouverte sur le fichier)
+            sort_users_file(buffer_bytes, email_index=index)
+        else:
+            index.clear()
+            index = EmailIndex(email_index_path_for(USERS_FILE))
+    return index
+
+
+def append_user(person: Dict[str, Any], email: str, email_index: EmailIndex,
+                fetched_at: Optional[int] = None, profile_index: Optional[query.ArchiveIndex] = None,
+                feed: Optional[changefeed.ChangeFeed] = None) -> None:
+    """Ajoute un profil en fin de USERS_FILE (trié en fin d'exécution) et met à jour
+    l'index des emails (avec la date de récupération), l'index des positions de profils
+    et le journal des changements.
+
+    `profile_index` / `feed`: ouverts une fois par exécution (ouverts ici à défaut).
+    """
+    USERS_DIR.mkdir(parents=True, exist_ok=True)
+    record_id = email.strip().lower()
+    hot, cold = projection.split("profile", person)
+    if extract_email_from_person(hot) is None:
+        # email trouvé hors des champs requis: profil gardé en entier (tri et index par email)
+        hot, cold = person, None
+    projection.write_cold(USERS_FILE, "profile", [(record_id, cold)])
+    line = jsoncodec.dumpb(hot)
+    with USERS_FILE.open("ab") as f:
+        offset = f.tell()
+        f.write(line)
+        f.write(b"\n")
+    is_new = email_index.add(email, now_ms() if fetched_at is None else fetched_at)
+    if feed is None:
+        feed = changefeed.ChangeFeed(changefeed.feed_path_for(CONV_FILE))
+    feed.append("profile", [(record_id, "insert" if is_new else "update")], USERS_FILE)
+    if profile_index is None:
+        profile_index = query.ArchiveIndex(query.profile_index_path_for(USERS_FILE))
+    profile_index.set_profile(email, offset, len(line))
+
+
+def now_ms() -> int:
+    return int(time.time() * 1000)
+
+
+def refresh_priority(fetched_at: int, last_activity: int, now: int, max_age_ms: int) -> Optional[Tuple[int, int]]:
+    """Priorité de rafraîchissement d'un profil (plus petite = plus prioritaire), None si à jour.
+
+    - d'abord les profils dont une conversation a eu de l'activité (`active.last`)
+      après leur récupération, les plus récemment actifs en premier
+    - puis les profils plus anciens que `max_age_ms`, les plus anciens en premier
+      (une date inconnue, 0, compte comme la plus ancienne)
+    """
+    if last_activity > fetched_at:
+        return (0, -last_activity)
+    if now - fetched_at > max_age_ms:
+        return (1, fetched_at)
+    return None
+
+
+def select_refresh(email_index: EmailIndex, activity: Dict[str, int], budget: int,
+                   max_age_ms: int, now: Optional[int] = None) -> List[str]:
+    """Choisit au plus `budget` emails à re-récupérer, par priorité décroissante."""
+    if budget <= 0:
+        return []
+    now = now_ms() if now is None else now
+
+    def candidates() -> Iterator[Tuple[Tuple[int, int], str]]:
+        for email, fetched_at in email_index:
+            priority = refresh_priority(fetched_at, activity.get(email, 0), now, max_age_ms)
+            if priority is not None:
+                yield priority, email
+
+    return [email for _, email in heapq.nsmallest(budget, candidates())]
+
+
+def fetch_person(website_id: str, email: str, auth) -> Tuple[bool, Optional[Dict[str, Any]]]:
+    """Récupère un profil. Retourne (quota atteint, profil ou None si échec)."""
+    resp = call_person_api(website_id, email, auth)
+    if resp is None:
+        print(f"Échec de l'appel pour {email}, on passe au suivant.")
+        return False, None
+
+    if resp.status_code == 429:
+        print("Réponse 429: quota d'appels atteint. Arrêt des requêtes.")
+        return True, None
+
+    if resp.status_code not in (200, 206):
+        print(f"Réponse inattendue pour {email}: {resp.status_code} {getattr(resp, 'text', '')}")
+        return False, None
+
+    # tenter de décoder
+    try:
+        return False, resp.json()
+    except Exception:
+        print(f"Impossible de décoder JSON pour {email}, on passe.")
+        return False, None
 
 
 def main():
     parser = argparse.ArgumentParser(description="Exporter les profils utilisateurs depuis Crisp")
     parser.add_argument("--nb", type=int, default=50, help="Nombre max d'utilisateurs à exporter (défaut 50)")
-    parser.add_argument("--reset", action="store_true", help="Supprimer le fichier utilisateurs.jsonl avant d'exécuter")
+    parser.add_argument("--reset", action="store_true", help="Supprimer le fichier utilisateurs.jsonl (et ses index) avant d'exécuter")
+    parser.add_argument("--sort-mem", type=int, default=DEFAULT_BUFFER_BYTES // (1024 * 1024),
+                        help="Mémoire max (Mo) du tri avant débordement sur disque (défaut 64, minimum 1)")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="Nombre de processus pour analyser conversations.jsonl (défaut: nombre de CPU)")
+    parser.add_argument("--refresh", type=int, default=0,
+                        help="Nombre max de profils existants à re-récupérer (actifs depuis leur récupération, "
+                             "puis trop anciens; défaut 0)")
+    parser.add_argument("--max-age", type=float, default=DEFAULT_MAX_AGE_DAYS,
+                        help=f"Âge (jours) au-delà duquel un profil est à rafraîchir (défaut {DEFAULT_MAX_AGE_DAYS:.0f})")
+    crisp_api.add_arguments(parser)
+    projection.add_arguments(parser)
     args = parser.parse_args()
+    crisp_api.configure_from_args(args)
+    projection.configure_from_args(args)
 
     identifier = os.getenv("CRISP_IDENTIFIER_PROD")
     key = os.getenv("CRISP_KEY_PROD")
@@ -183,41 +413,39 @@ def main():
     # Prépare dossier
     USERS_DIR.mkdir(parents=True, exist_ok=True)
 
-    if args.reset and USERS_FILE.exists():
-        USERS_FILE.unlink()
-        print("Fichier utilisateurs supprimé (reset).")
+    if args.reset and reset_files():
+        print("Fichier utilisateurs et index associés supprimés (reset).")
 
     # Auth HTTP Basic
     auth = (identifier, key)
 
-    # Lire existants
-    existing = read_existing_users()
+    # Emails déjà présents: index trié persistant (sans relire le fichier utilisateurs)
+    buffer_bytes = max(args.sort_mem, 1) * 1024 * 1024
+    existing = load_email_index(buffer_bytes)
     existing_initial = len(existing)
 
     # Charger emails depuis conversations
-    emails = load_emails_from_conversations()
-    if not emails:
+    emails = load_emails_from_conversations(workers=args.workers)
+    if not emails and args.refresh <= 0:
         print("Aucun email trouvé dans le fichier de conversations.")
         # afficher récap
         print("--- Récapitulatif ---")
         print(f"Utilisateurs initialement présents: {existing_initial}")
         print(f"Nouveaux utilisateurs ajoutés lors de cette exécution: 0")
         print(f"Utilisateurs totaux dans le fichier: {existing_initial}")
+        existing.close()
         return
 
-    # Utiliser un set pour conserver l'ordre de traitement unique tout en parcourant
-    seen_in_run: Set[str] = set()
-    emails_unique_ordered: List[str] = []
-    for e in emails:
-        if e not in seen_in_run:
-            seen_in_run.add(e)
-            emails_unique_ordered.append(e)
-
     target = args.nb
     added = 0
     ignored = 0
+    refreshed = 0
+    quota_reached = False
+    # index des positions de profils et journal des changements ouverts une fois pour toute l'exécution
+    profile_index = query.ArchiveIndex(query.profile_index_path_for(USERS_FILE))
+    feed = changefeed.ChangeFeed(changefeed.feed_path_for(CONV_FILE))
 
-    for email in emails_unique_ordered:
+    for email in emails:
         # Si déjà dans existing, on ignore (n'entre pas dans le quota)
         if email in existing:
             ignored += 1
@@ -228,41 +456,50 @@ def main():
             break
 
         print(f"Traitement: {email}")
-        resp = call_person_api(website_id, email, auth)
-        if resp is None:
-            print(f"Échec de l'appel pour {email}, on passe au suivant.")
-            continue
-
-        if resp.status_code == 429:
-            print("Réponse 429: quota d'appels atteint. Arrêt des requêtes.")
+        quota_reached, person = fetch_person(website_id, email, auth)
+        if quota_reached:
             break
-
-        if resp.status_code not in (200, 206):
-            print(f"Réponse inattendue pour {email}: {resp.status_code} {getattr(resp, 'text', '')}")
+        if person is None:
             continue
 
-        # tenter de décoder
-        try:
-            person = resp.json()
-        except Exception:
-            print(f"Impossible de décoder JSON pour {email}, on passe.")
-            continue
-
-        # enregistrer dans existing
+        # sauvegarde incrémentale: ajout en fin de fichier après chaque profil (sécurise contre crash),
+        # le fichier est re-trié une seule fois en fin d'exécution
         person_email = extract_email_from_person(person) or email
-        existing[person_email] = person
+        append_user(person, person_email, existing, profile_index=profile_index, feed=feed)
         added += 1
-        # sauvegarde incrémentale: réécrire le fichier trié après chaque ajout (sécurise contre crash)
-        save_users_sorted(existing)
 
         # petite pause pour respecter quotas
         time.sleep(0.1)
 
+    # Rafraîchissement des profils existants, dans la limite du budget --refresh
+    if args.refresh > 0 and not quota_reached:
+        # dernière activité par email, depuis l'index des conversations (query.py)
+        activity = query.ArchiveIndex(query.index_path_for(CONV_FILE)).last_activity_by_email()
+        to_refresh = select_refresh(existing, activity, args.refresh, int(args.max_age * 86400 * 1000))
+        print(f"Profils à rafraîchir: {len(to_refresh)}")
+        for email in to_refresh:
+            print(f"Rafraîchissement: {email}")
+            quota_reached, person = fetch_person(website_id, email, auth)
+            if quota_reached:
+                break
+            if person is None:
+                continue
+            append_user(person, email, existing, profile_index=profile_index, feed=feed)
+            refreshed += 1
+            time.sleep(0.1)
+
+    if added or refreshed:
+        # tri final; un profil re-téléchargé remplace l'ancien (dernière occurrence gardée)
+        # l'index ouvert est réécrit et rouvert sur place
+        sort_users_file(buffer_bytes, dedup=True, email_index=existing)
     total_final = len(existing)
+    existing.close()
     print("--- Récapitulatif ---")
     print(f"Utilisateurs initialement présents: {existing_initial}")
     print(f"Nouveaux utilisateurs ajoutés lors de cette exécution: {added}")
     print(f"Utilisateurs ignorés (déjà présents) lors de cette exécution: {ignored}")
+    if args.refresh > 0:
+        print(f"Profils rafraîchis lors de cette exécution: {refreshed}")
     print(f"Utilisateurs totaux dans le fichier: {total_final}")
 
 
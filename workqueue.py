@@ -0,0 +1,233 @@
+#!/usr/bin/env python3
+"""
+workqueue.py
+
+File de travail partagée (SQLite) pour répartir l'export des messages entre
+plusieurs processus `mess.py`, sur une ou plusieurs machines partageant le même
+stockage.
+
+Principe:
+- Chaque session_id est une tâche (`pending`, `leased` ou `done`).
+- Un worker prend une tâche avec `claim()` : il obtient un bail (lease) d'une
+  durée limitée qu'il prolonge avec `heartbeat()` tant qu'il travaille.
+- Si un worker meurt, son bail expire et la tâche redevient disponible pour
+  les autres workers au prochain `claim()`.
+- `complete()` marque la tâche terminée, `release()` la remet dans la file
+  (par exemple sur un 429).
+- Les tâches sont prises par priorité décroissante puis dans l'ordre d'ajout.
+  `schedule()` ajoute ou re-priorise des tâches et remet en attente les tâches
+  terminées dont l'activité (ex: active.last) est postérieure à leur fin.
+
+Chaque opération ouvre sa propre connexion et s'exécute dans une transaction
+`BEGIN IMMEDIATE`, ce qui sérialise les prises de tâches entre processus.
+
+Commentaires en français.
+"""
+
+import sqlite3
+import time
+from pathlib import Path
+from typing import Dict, Iterable, Optional, Tuple
+
+
+# Durée par défaut d'un bail (secondes)
+DEFAULT_LEASE_SECONDS = 300.0
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS tasks (
+    session_id  TEXT PRIMARY KEY,
+    position    INTEGER NOT NULL,
+    status      TEXT NOT NULL DEFAULT 'pending',
+    owner       TEXT,
+    lease_until REAL,
+    attempts    INTEGER NOT NULL DEFAULT 0,
+    done_at     REAL,
+    priority    REAL NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS tasks_status_position ON tasks (status, position);
+"""
+
+# Colonnes ajoutées après la première version (migration des files existantes)
+MIGRATIONS = (
+    ("priority", "ALTER TABLE tasks ADD COLUMN priority REAL NOT NULL DEFAULT 0"),
+)
+
+
+class WorkQueue:
+    """File de tâches à baux stockée dans un fichier SQLite."""
+
+    def __init__(self, path: Path, lease_seconds: float = DEFAULT_LEASE_SECONDS, timeout: float = 30.0):
+        self.path = Path(path)
+        self.lease_seconds = lease_seconds
+        self.timeout = timeout
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        conn = self._connect()
+        try:
+            conn.executescript(SCHEMA)
+            columns = {row[1] for row in conn.execute("PRAGMA table_info(tasks)")}
+            for column, sql in MIGRATIONS:
+                if column not in columns:
+                    conn.execute(sql)
+            conn.execute("CREATE INDEX IF NOT EXISTS tasks_status_priority ON tasks (status, priority, position)")
+        finally:
+            conn.close()
+
+    def _connect(self) -> sqlite3.Connection:
+        # isolation_level=None : on gère les transactions explicitement
+        return sqlite3.connect(str(self.path), timeout=self.timeout, isolation_level=None)
+
+    def enqueue(self, session_ids: Iterable[str]) -> int:
+        """Ajoute les session_id absents de la file (dans l'ordre fourni).
+        Retourne le nombre de tâches ajoutées.
+        """
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute("SELECT COALESCE(MAX(position), -1) FROM tasks").fetchone()
+            position = int(row[0]) + 1
+            added = 0
+            for sid in session_ids:
+                cur = conn.execute(
+                    "INSERT OR IGNORE INTO tasks (session_id, position) VALUES (?, ?)",
+                    (sid, position),
+                )
+                if cur.rowcount:
+                    position += 1
+                    added += 1
+            conn.execute("COMMIT")
+            return added
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+
+    def schedule(self, tasks: Iterable[Tuple[str, float, int]], reopen_done: bool = False) -> Dict[str, int]:
+        """Ajoute ou met à jour des tâches (session_id, priorité, dernière activité en ms).
+
+        - tâche absente : ajoutée en attente
+        - tâche en attente ou en cours : priorité mise à jour
+        - tâche terminée : remise en attente si sa dernière activité est postérieure
+          à sa fin (`done_at`), ou toujours avec `reopen_done`
+
+        Retourne le nombre de tâches ajoutées et remises en attente.
+        """
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute("SELECT COALESCE(MAX(position), -1) FROM tasks").fetchone()
+            position = int(row[0]) + 1
+            added = reopened = 0
+            for sid, priority, activity in tasks:
+                row = conn.execute("SELECT status, done_at FROM tasks WHERE session_id = ?", (sid,)).fetchone()
+                if row is None:
+                    conn.execute(
+                        "INSERT INTO tasks (session_id, position, priority) VALUES (?, ?, ?)",
+                        (sid, position, priority),
+                    )
+                    position += 1
+                    added += 1
+                elif row[0] == "done":
+                    if reopen_done or activity > (row[1] or 0) * 1000:
+                        conn.execute(
+                            "UPDATE tasks SET status = 'pending', priority = ? WHERE session_id = ?",
+                            (priority, sid),
+                        )
+                        reopened += 1
+                else:
+                    conn.execute("UPDATE tasks SET priority = ? WHERE session_id = ?", (priority, sid))
+            conn.execute("COMMIT")
+            return {"added": added, "reopened": reopened}
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+
+    def sync_times(self) -> Dict[str, float]:
+        """Date de dernière fin (done_at) de chaque tâche déjà terminée au moins une fois."""
+        conn = self._connect()
+        try:
+            return dict(conn.execute("SELECT session_id, done_at FROM tasks WHERE done_at IS NOT NULL"))
+        finally:
+            conn.close()
+
+    def claim(self, worker_id: str) -> Optional[str]:
+        """Prend la prochaine tâche disponible (en attente ou bail expiré).
+        Retourne le session_id ou None si la file est vide.
+        """
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            now = time.time()
+            row = conn.execute(
+                "SELECT session_id FROM tasks"
+                " WHERE status = 'pending' OR (status = 'leased' AND lease_until < ?)"
+                " ORDER BY priority DESC, position LIMIT 1",
+                (now,),
+            ).fetchone()
+            if row is None:
+                conn.execute("COMMIT")
+                return None
+            conn.execute(
+                "UPDATE tasks SET status = 'leased', owner = ?, lease_until = ?, attempts = attempts + 1"
+                " WHERE session_id = ?",
+                (worker_id, now + self.lease_seconds, row[0]),
+            )
+            conn.execute("COMMIT")
+            return row[0]
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+
+    def _update_owned(self, sql: str, params: tuple) -> bool:
+        """Exécute une mise à jour limitée aux tâches détenues par le worker."""
+        conn = self._connect()
+        try:
+            cur = conn.execute(sql, params)
+            return cur.rowcount == 1
+        finally:
+            conn.close()
+
+    def heartbeat(self, session_id: str, worker_id: str) -> bool:
+        """Prolonge le bail. Retourne False si le bail a été perdu."""
+        return self._update_owned(
+            "UPDATE tasks SET lease_until = ?"
+            " WHERE session_id = ? AND owner = ? AND status = 'leased'",
+            (time.time() + self.lease_seconds, session_id, worker_id),
+        )
+
+    def complete(self, session_id: str, worker_id: str) -> bool:
+        """Marque la tâche comme terminée. Retourne False si le bail a été perdu."""
+        return self._update_owned(
+            "UPDATE tasks SET status = 'done', owner = NULL, lease_until = NULL, done_at = ?"
+            " WHERE session_id = ? AND owner = ? AND status = 'leased'",
+            (time.time(), session_id, worker_id),
+        )
+
+    def release(self, session_id: str, worker_id: str) -> bool:
+        """Rend la tâche à la file sans la marquer terminée (ex: quota atteint)."""
+        return self._update_owned(
+            "UPDATE tasks SET status = 'pending', owner = NULL, lease_until = NULL"
+            " WHERE session_id = ? AND owner = ? AND status = 'leased'",
+            (session_id, worker_id),
+        )
+
+    def counts(self) -> Dict[str, int]:
+        """Retourne le nombre de tâches par statut."""
+        conn = self._connect()
+        try:
+            rows = conn.execute("SELECT status, COUNT(*) FROM tasks GROUP BY status").fetchall()
+        finally:
+            conn.close()
+        return {status: n for status, n in rows}
+
+    def reset(self) -> None:
+        """Vide la file (toutes les tâches sont supprimées)."""
+        conn = self._connect()
+        try:
+            conn.execute("DELETE FROM tasks")
+        finally:
+            conn.close()
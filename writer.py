@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+"""
+writer.py
+
+Étape d'écriture en arrière-plan pour découpler les appels API (réseau) des
+écritures disque dans conv.py et mess.py.
+
+Principe:
+- Le thread principal récupère les données via l'API et soumet chaque résultat
+  terminé avec `submit()`.
+- Un thread d'écriture traite les résultats par lots : `handle(item)` pour
+  chaque résultat, puis un seul `flush()` par lot (réécriture de fichier,
+  sauvegarde de l'état...).
+- La file est bornée : si l'écriture prend du retard, `submit()` bloque
+  (backpressure) au lieu d'accumuler les résultats en mémoire.
+- Une erreur dans le thread d'écriture est relevée au `submit()` ou au `close()`
+  suivant.
+
+Commentaires en français.
+"""
+
+import queue
+import threading
+from typing import Any, Callable, List, Optional
+
+
+# Valeur sentinelle pour arrêter le thread d'écriture
+_STOP = object()
+
+
+class BackgroundWriter:
+    """Thread d'écriture par lots alimenté par une file bornée."""
+
+    def __init__(self, handle: Callable[[Any], None], flush: Optional[Callable[[], None]] = None,
+                 max_pending: int = 8, batch_size: int = 16, batch_delay: float = 0.5):
+        """
+        - handle : traitement d'un résultat (appelé dans le thread d'écriture)
+        - flush : appelé une fois après chaque lot traité
+        - max_pending : nombre max de résultats en attente avant blocage de submit()
+        - batch_size : nombre max de résultats par lot
+        - batch_delay : attente max (secondes) d'autres résultats pour compléter un lot
+        """
+        self.handle = handle
+        self.flush = flush
+        self.batch_size = batch_size
+        self.batch_delay = batch_delay
+        self._queue: "queue.Queue[Any]" = queue.Queue(maxsize=max_pending)
+        self._error: Optional[BaseException] = None
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name="background-writer", daemon=True)
+        self._thread.start()
+
+    def _next_batch(self) -> List[Any]:
+        """Attend un résultat puis complète le lot avec ceux qui arrivent rapidement."""
+        batch = [self._queue.get()]
+        while batch[-1] is not _STOP and len(batch) < self.batch_size:
+            try:
+                batch.append(self._queue.get(timeout=self.batch_delay))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self) -> None:
+        while True:
+            batch = self._next_batch()
+            stop = batch[-1] is _STOP
+            items = batch[:-1] if stop else batch
+            if self._error is None:
+                try:
+                    for item in items:
+                        self.handle(item)
+                    if items and self.flush is not None:
+                        self.flush()
+                except BaseException as e:  # relevée dans le thread principal
+                    self._error = e
+            if stop:
+                return
+
+    def _raise_error(self) -> None:
+        if self._error is not None:
+            error, self._error = self._error, None
+            raise error
+
+    def submit(self, item: Any) -> None:
+        """Soumet un résultat à écrire (bloque si la file est pleine)."""
+        self._raise_error()
+        self._queue.put(item)
+
+    def close(self) -> None:
+        """Attend l'écriture de tous les résultats soumis et arrête le thread."""
+        if not self._closed:
+            self._closed = True
+            self._queue.put(_STOP)
+            self._thread.join()
+        self._raise_error()
+
+    def __enter__(self) -> "BackgroundWriter":
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        if exc_type is None:
+            self.close()
+        else:
+            # on attend quand même les écritures en cours, sans masquer l'exception d'origine
+            try:
+                self.close()
+            except Exception:
+                pass